@@ -0,0 +1,89 @@
+"""
+Bounded LRU caches for category prediction.
+
+For the prediction cache, keys are (model version, preprocessed description), so a retrained model
+never sees stale entries: its version differs and old keys simply age out.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+prediction_cache = LRUCache(getattr(settings, 'CATEGORY_PREDICTION_CACHE_SIZE', 4096))
+
+
+def predict_with_cache(model, clean_texts):
+    """
+    Predict the given preprocessed descriptions, only sending cache misses
+    to the model (in a single batch).
+    """
+    results = [None] * len(clean_texts)
+    missing = {}
+    for i, text in enumerate(clean_texts):
+        cached = prediction_cache.get((model.version, text))
+        if cached is None:
+            missing.setdefault(text, []).append(i)
+        else:
+            results[i] = dict(cached)
+
+    if missing:
+        texts = list(missing)
+        for text, prediction in zip(texts, model.predict_many(texts)):
+            prediction_cache.set((model.version, text), prediction)
+            for i in missing[text]:
+                results[i] = dict(prediction)
+    return results
@@ -0,0 +1,430 @@
+"""
+Category prediction model.
+
+The TF-IDF vectorizer and the random forest are trained once from the
+expense corpus (dataset.csv), saved to disk as a versioned artifact and
+loaded once per worker. The artifact is only rebuilt when the corpus
+version (a hash of the dataset contents) changes.
+
+User corrections are appended to a separate log (dataset_corrections.csv)
+and absorbed by an incremental overlay on top of the forest, so learning
+from one correction never rewrites the corpus or refits the forest.
+
+Corrections are folded into the forest by a debounced background retrain,
+which publishes the new artifact atomically (write to a temporary file,
+then rename). Workers notice the new file on their next get_model() call.
+"""
+import csv
+import contextlib
+import hashlib
+import io
+import math
+import os
+import tempfile
+import threading
+from collections import Counter, defaultdict
+
+import joblib
+import pandas as pd
+from django.conf import settings
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from .retraining import RetrainScheduler
+from .similarity import SimilarityIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Bump when the artifact layout changes so old files are retrained.
+ARTIFACT_FORMAT = 3
+
+
+class CorpusError(Exception):
+    """The training corpus is missing or malformed."""
+
+
+CORRECTIONS_FIELDS = ['description', 'category', 'clean_description']
+
+
+class IncrementalModel:
+    """
+    Multinomial naive Bayes updated one labelled row at a time.
+
+    Used for the correction log and for per-user models. Exact descriptions
+    are remembered verbatim; the token statistics generalise to new ones.
+    Rows may be learned while other threads predict.
+    """
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        # predict() iterates the counts that partial_fit() grows
+        self._lock = threading.Lock()
+        self.exact = {}
+        self.class_rows = Counter()
+        self.class_tokens = Counter()
+        self.token_counts = defaultdict(Counter)
+        self.vocabulary = set()
+        self.n_rows = 0
+
+    def partial_fit(self, clean_text, category):
+        tokens = clean_text.split()
+        with self._lock:
+            self.exact[clean_text] = category
+            self.class_rows[category] += 1
+            self.class_tokens[category] += len(tokens)
+            self.token_counts[category].update(tokens)
+            self.vocabulary.update(tokens)
+            self.n_rows += 1
+
+    def predict(self, clean_text):
+        """Return (category, probability), or None if no token is known."""
+        with self._lock:
+            tokens = [t for t in clean_text.split() if t in self.vocabulary]
+            if not tokens:
+                return None
+            vocab_size = len(self.vocabulary)
+            scores = {}
+            for category, rows in self.class_rows.items():
+                counts = self.token_counts[category]
+                denominator = self.class_tokens[category] + self.alpha * vocab_size
+                score = math.log(rows / self.n_rows)
+                for token in tokens:
+                    score += math.log((counts[token] + self.alpha) / denominator)
+                scores[category] = score
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(v - scores[best]) for v in scores.values())
+        return best, 1.0 / total
+
+
+class CategoryModel:
+    def __init__(self, dataset_version, trained_offset, vectorizer, classifier, index):
+        # Hash of dataset.csv and the correction log prefix the forest was trained on
+        self.dataset_version = dataset_version
+        self.trained_offset = trained_offset
+        self.vectorizer = vectorizer
+        self.classifier = classifier
+        # Inverted index over the corpus TF-IDF rows, for the closest-match confidence
+        self.index = index
+        self.corrections = IncrementalModel()
+        # Byte offset of the correction log already absorbed
+        self.corrections_offset = 0
+
+    @property
+    def corpus_version(self):
+        return f'{self.dataset_version}-{self.trained_offset}'
+
+    @property
+    def version(self):
+        # Changes with every absorbed correction, so cached predictions expire
+        return f'{self.corpus_version}.{self.corrections.n_rows}'
+
+    def predict(self, clean_text):
+        return self.predict_many([clean_text])[0]
+
+    def predict_many(self, clean_texts):
+        """Predict a batch with one transform and one predict_proba call."""
+        vectors = self.vectorizer.transform(clean_texts)
+        closest, similarities = self.index.search(vectors, k=1)
+        probabilities = self.classifier.predict_proba(vectors)
+        best = probabilities.argmax(axis=1)
+        known_terms = vectors.getnnz(axis=1)
+        predictions = []
+        for i, text in enumerate(clean_texts):
+            prediction = {
+                'predicted_category': self.classifier.classes_[best[i]],
+                'confidence': float(similarities[i, 0]),
+                'closest_match_index': int(closest[i, 0]),
+            }
+            if text in self.corrections.exact:
+                prediction['predicted_category'] = self.corrections.exact[text]
+                prediction['confidence'] = 1.0
+            elif not known_terms[i]:
+                # None of the words are in the forest's vocabulary
+                learned = self.corrections.predict(text)
+                if learned is not None:
+                    prediction['predicted_category'] = learned[0]
+            predictions.append(prediction)
+        return predictions
+
+    def absorb_corrections(self, path=None):
+        """Learn from rows appended to the correction log since the last call."""
+        path = path or corrections_path()
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if size < self.corrections_offset:
+            # The log was truncated or replaced; start over
+            self.corrections = IncrementalModel()
+            self.corrections_offset = 0
+        if size == self.corrections_offset:
+            return 0
+        with open(path, 'rb') as f:
+            f.seek(self.corrections_offset)
+            chunk = f.read(size - self.corrections_offset)
+        # Only consume complete lines; a concurrent append may be in flight
+        end = chunk.rfind(b'\n') + 1
+        if not end:
+            return 0
+        absorbed = 0
+        for row in csv.reader(io.StringIO(chunk[:end].decode('utf-8'))):
+            if len(row) != len(CORRECTIONS_FIELDS) or row == CORRECTIONS_FIELDS:
+                continue
+            _, category, clean_description = row
+            self.corrections.partial_fit(clean_description, category)
+            absorbed += 1
+        self.corrections_offset += end
+        return absorbed
+
+
+def dataset_path():
+    return getattr(settings, 'CATEGORY_DATASET_PATH', os.path.join(settings.BASE_DIR, 'dataset.csv'))
+
+
+def model_path():
+    return getattr(settings, 'CATEGORY_MODEL_PATH',
+                   os.path.join(settings.BASE_DIR, 'ml_models', 'category_model.joblib'))
+
+
+def corrections_path():
+    return getattr(settings, 'CATEGORY_CORRECTIONS_PATH',
+                   os.path.join(settings.BASE_DIR, 'dataset_corrections.csv'))
+
+
+def record_correction(description, category, clean_description):
+    """
+    Append one labelled row to the correction log.
+
+    The row is written with a single append, so the cost does not depend on
+    the size of the corpus or the log. Workers pick it up on their next
+    get_model() call.
+    """
+    description = ' '.join(str(description).split())
+    category = ' '.join(str(category).split())
+    clean_description = ' '.join(str(clean_description).split())
+    path = corrections_path()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if not os.path.exists(path):
+        writer.writerow(CORRECTIONS_FIELDS)
+    writer.writerow([description, category, clean_description])
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        f.write(buffer.getvalue())
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def corpus_version(path=None):
+    """Hash of the dataset contents."""
+    path = path or dataset_path()
+    digest = hashlib.sha256(f'format-{ARTIFACT_FORMAT}:'.encode())
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        raise CorpusError('Dataset file not found')
+    return digest.hexdigest()[:16]
+
+
+def corrections_snapshot(path=None):
+    """Byte offset of the end of the last complete line in the correction log."""
+    path = path or corrections_path()
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+    with open(path, 'rb') as f:
+        position = size
+        while position > 0:
+            start = max(0, position - 65536)
+            f.seek(start)
+            chunk = f.read(position - start)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                return start + newline + 1
+            position = start
+    return 0
+
+
+def load_corpus(path=None, corrections_offset=0):
+    path = path or dataset_path()
+    if not os.path.exists(path):
+        raise CorpusError('Dataset file not found')
+    data = pd.read_csv(path)
+    if 'clean_description' not in data.columns or 'category' not in data.columns:
+        raise CorpusError('Invalid dataset format')
+    if corrections_offset:
+        with open(corrections_path(), 'rb') as f:
+            corrections = pd.read_csv(io.BytesIO(f.read(corrections_offset)))
+        # Concurrent first writers can each emit a header row
+        corrections = corrections[corrections['category'] != 'category']
+        data = pd.concat([data, corrections], ignore_index=True)
+    return data
+
+
+def fit_model(data, classifier=None, dataset_version='', trained_offset=0):
+    """Fit the vectorizer, classifier and similarity index on a corpus DataFrame."""
+    if classifier is None:
+        classifier = RandomForestClassifier(random_state=42, n_estimators=100)
+    vectorizer = TfidfVectorizer()
+    matrix = vectorizer.fit_transform(data['clean_description'].fillna(''))
+    classifier.fit(matrix, data['category'])
+    return CategoryModel(dataset_version, trained_offset, vectorizer, classifier,
+                         SimilarityIndex(matrix))
+
+
+def train_model(dataset_version=None, corrections_offset=0):
+    dataset_version = dataset_version or corpus_version()
+    data = load_corpus(corrections_offset=corrections_offset)
+    return fit_model(data, dataset_version=dataset_version, trained_offset=corrections_offset)
+
+
+def save_model(model, path=None):
+    """Write the artifact next to its final location and rename it into place."""
+    path = path or model_path()
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            joblib.dump({
+                'format': ARTIFACT_FORMAT,
+                'dataset_version': model.dataset_version,
+                'trained_offset': model.trained_offset,
+                'vectorizer': model.vectorizer,
+                'classifier': model.classifier,
+                'index': model.index,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_model(path=None, mmap=None):
+    """
+    Load the published artifact, or return None if there is none.
+
+    With mmap (the CATEGORY_MODEL_MMAP setting by default) the artifact's
+    numpy arrays are memory-mapped read-only instead of copied, so every
+    worker shares one copy of them through the page cache. The forest is
+    not among them: sklearn copies each tree's arrays when unpickling it,
+    so a worker loading an artifact itself (after a retrain) holds a
+    private copy of the forest. Only the model preloaded in the gunicorn
+    master is shared whole.
+    """
+    path = path or model_path()
+    if mmap is None:
+        mmap = getattr(settings, 'CATEGORY_MODEL_MMAP', True)
+    try:
+        payload = joblib.load(path, mmap_mode='r' if mmap else None)
+    except (FileNotFoundError, EOFError, ValueError, KeyError):
+        return None
+    if not isinstance(payload, dict) or payload.get('format') != ARTIFACT_FORMAT:
+        return None
+    return CategoryModel(payload['dataset_version'], payload['trained_offset'],
+                         payload['vectorizer'], payload['classifier'], payload['index'])
+
+
+@contextlib.contextmanager
+def _training_lock():
+    """Serialise training across worker processes sharing the model directory."""
+    path = model_path() + '.lock'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def retrain(force=False):
+    """
+    Train on the dataset plus every complete correction and publish the artifact.
+
+    Skips training if the published artifact already covers the same data,
+    e.g. because another worker retrained while this one waited for the lock.
+    """
+    with _training_lock():
+        dataset_version = corpus_version()
+        offset = corrections_snapshot()
+        if not force:
+            current = load_model()
+            if (current is not None and current.dataset_version == dataset_version
+                    and current.trained_offset == offset):
+                return current
+        model = train_model(dataset_version, offset)
+        save_model(model)
+        return model
+
+
+retrain_scheduler = RetrainScheduler(
+    retrain,
+    delay=getattr(settings, 'CATEGORY_RETRAIN_DELAY', 30),
+    max_delay=getattr(settings, 'CATEGORY_RETRAIN_MAX_DELAY', 300),
+)
+
+
+_lock = threading.Lock()
+_model = None
+_artifact_stamp = None
+_dataset_stamp = None
+
+
+def get_model():
+    """
+    Return the worker's model, loading it on first use.
+
+    Each call only stats the artifact, the dataset and the correction log.
+    A newly published artifact is loaded; a changed dataset schedules a
+    background retrain while the current model keeps serving; new
+    corrections are absorbed incrementally. Training only happens inline
+    when no artifact has been published yet.
+    """
+    global _model, _artifact_stamp, _dataset_stamp
+    artifact_stamp = _file_stamp(model_path())
+    dataset_stamp = _file_stamp(dataset_path())
+    if dataset_stamp is None:
+        raise CorpusError('Dataset file not found')
+    if _model is not None and artifact_stamp == _artifact_stamp and dataset_stamp == _dataset_stamp:
+        if _corrections_pending(_model):
+            with _lock:
+                _model.absorb_corrections()
+        return _model
+    with _lock:
+        if _model is None or artifact_stamp != _artifact_stamp:
+            model = load_model()
+            if model is None:
+                model = retrain()
+            model.absorb_corrections()
+            _model = model
+            _artifact_stamp = _file_stamp(model_path())
+        if dataset_stamp != _dataset_stamp:
+            if _model.dataset_version != corpus_version():
+                retrain_scheduler.schedule()
+            _dataset_stamp = dataset_stamp
+        _model.absorb_corrections()
+    return _model
+
+
+def _corrections_pending(model):
+    try:
+        return os.path.getsize(corrections_path()) != model.corrections_offset
+    except FileNotFoundError:
+        return model.corrections_offset != 0
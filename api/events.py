@@ -0,0 +1,104 @@
+"""
+In-process event pipeline.
+
+Views publish events and return immediately; a background thread in the
+same worker delivers them to the subscribed handlers. This replaces the
+HTTP calls the expense views used to make back into the API, which tied up
+one gunicorn worker waiting on another.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CategoryCorrected:
+    """The user saved an expense under a different category than predicted."""
+    description: str
+    category: str
+
+
+@dataclass(frozen=True)
+class StatementUploaded:
+    """A bank statement was saved for import by StatementImport job_id (expenses.importing)."""
+    job_id: int
+    format: str
+    date_format: str = None
+
+
+class EventBus:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._handlers = defaultdict(list)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def subscribe(self, event_type, handler):
+        self._handlers[event_type].append(handler)
+
+    def publish(self, event):
+        """
+        Queue the event for the worker thread. If the queue is full the
+        handlers run inline rather than dropping the event.
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            logger.warning('Event queue full, handling %s inline', type(event).__name__)
+            self._dispatch(event)
+
+    def drain(self, timeout=None):
+        """Wait until every queued event has been handled."""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        done = threading.Thread(target=self._queue.join, daemon=True)
+        done.start()
+        done.join(timeout)
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(self.maxsize)
+            self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                            name='event-bus', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self, events):
+        while True:
+            event = events.get()
+            try:
+                # As around a request: handlers get a usable connection, and
+                # do not leave it open between events
+                close_old_connections()
+                self._dispatch(event)
+            finally:
+                close_old_connections()
+                events.task_done()
+
+    def _dispatch(self, event):
+        for handler in self._handlers[type(event)]:
+            try:
+                handler(event)
+            except Exception:
+                logger.exception('Handler %r failed for %r', handler, event)
+
+
+bus = EventBus(getattr(settings, 'EVENT_QUEUE_SIZE', 1000))
+atexit.register(bus.drain, 5)
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from expenses.models import Expense
+from summaries.rollup import rollups_changed
+
+from .classifier import record_correction, retrain_scheduler
+from .events import CategoryCorrected, bus
+from .personal import bump_history_version
+from .preprocessing import preprocess_text
+
+
+def learn_category_correction(event):
+    record_correction(event.description, event.category, preprocess_text(event.description))
+    retrain_scheduler.schedule()
+
+
+bus.subscribe(CategoryCorrected, learn_category_correction)
+
+
+@receiver(post_save, sender=Expense)
+def expense_saved(sender, instance, created, **kwargs):
+    # New expenses are picked up incrementally; edits invalidate what was learned
+    if not created:
+        bump_history_version([instance.owner_id])
+
+
+@receiver(post_delete, sender=Expense)
+def expense_deleted(sender, instance, **kwargs):
+    bump_history_version([instance.owner_id])
+
+
+@receiver(rollups_changed)
+def expenses_rewritten(sender, totals, **kwargs):
+    # Rows leaving a bucket were edited or deleted, including by the bulk
+    # edits that bypass the receivers above
+    if sender == 'expense':
+        bump_history_version(owner_id for (owner_id, _, _), (_, count) in totals.items() if count < 0)
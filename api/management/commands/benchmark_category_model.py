@@ -0,0 +1,165 @@
+import gc
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import sklearn
+from django.core.management.base import BaseCommand, CommandError
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.model_selection import train_test_split
+from sklearn.naive_bayes import ComplementNB, MultinomialNB
+
+from api.classifier import corpus_version, fit_model, load_corpus, load_model, save_model
+from api.preprocessing import preprocess_text
+
+# Every candidate needs predict_proba, which CategoryModel.predict_many relies on
+CLASSIFIERS = {
+    'random_forest': lambda: RandomForestClassifier(random_state=42, n_estimators=100),
+    'random_forest_small': lambda: RandomForestClassifier(random_state=42, n_estimators=20),
+    'logistic_regression': lambda: LogisticRegression(max_iter=1000),
+    'multinomial_nb': lambda: MultinomialNB(alpha=0.1),
+    'complement_nb': lambda: ComplementNB(alpha=0.1),
+    'sgd_log': lambda: SGDClassifier(loss='log_loss', random_state=42),
+}
+
+
+def scaled_corpus(data, scale, seed=42):
+    """
+    Return dataset.csv itself for scale 1, otherwise a synthetic corpus with
+    scale times as many rows.
+
+    Synthetic descriptions mix 1-3 words from one category's real
+    descriptions with, now and then, a made-up merchant name, so the
+    vocabulary keeps growing with the corpus as it would with real users.
+    """
+    data = data[['description', 'category', 'clean_description']].dropna()
+    if scale == 1:
+        return data.reset_index(drop=True)
+    rng = np.random.RandomState(seed)
+    words = {
+        category: np.array(' '.join(group['clean_description']).split())
+        for category, group in data.groupby('category')
+    }
+    categories = data['category'].to_numpy()
+    n_merchants = max(len(data) * scale // 10, 1)
+    rows = []
+    for category in categories[rng.randint(len(categories), size=len(data) * scale)]:
+        tokens = list(rng.choice(words[category], size=rng.randint(1, 4)))
+        if rng.rand() < 0.3:
+            tokens.append(f'merchant{rng.randint(n_merchants)}')
+        description = ' '.join(tokens)
+        rows.append((description, category, preprocess_text(description)))
+    return pd.DataFrame(rows, columns=['description', 'category', 'clean_description'])
+
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def benchmark(data, classifier_name, samples, workdir):
+    train, test = train_test_split(data, test_size=0.2, random_state=42)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    model = fit_model(train, CLASSIFIERS[classifier_name]())
+    train_seconds = time.perf_counter() - start
+    train_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Cold start: load the published artifact and answer the first request
+    path = os.path.join(workdir, f'{classifier_name}.joblib')
+    save_model(model, path)
+    del model
+    gc.collect()
+    start = time.perf_counter()
+    model = load_model(path, mmap=False)
+    model.predict(preprocess_text(test['description'].iloc[0]))
+    cold_start_seconds = time.perf_counter() - start
+
+    # One request at a time, through the same preprocessing as the views
+    descriptions = test['description'].tolist()
+    replay = [descriptions[i % len(descriptions)] for i in range(samples)]
+    latencies = []
+    for description in replay:
+        start = time.perf_counter()
+        model.predict(preprocess_text(description))
+        latencies.append(time.perf_counter() - start)
+
+    clean = test['clean_description'].tolist()
+    tracemalloc.start()
+    start = time.perf_counter()
+    predictions = model.predict_many(clean)
+    batch_seconds = time.perf_counter() - start
+    predict_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    accuracy = np.mean([
+        p['predicted_category'] == expected for p, expected in zip(predictions, test['category'])
+    ])
+    return {
+        'classifier': classifier_name,
+        'train_rows': len(train),
+        'test_rows': len(test),
+        'vocabulary_size': len(model.vectorizer.vocabulary_),
+        'train_seconds': round(train_seconds, 3),
+        'cold_start_seconds': round(cold_start_seconds, 3),
+        'artifact_bytes': os.path.getsize(path),
+        'latency_p50_ms': percentile_ms(latencies, 50),
+        'latency_p99_ms': percentile_ms(latencies, 99),
+        'predictions_per_second': round(len(latencies) / sum(latencies), 1),
+        'batch_predictions_per_second': round(len(clean) / batch_seconds, 1),
+        'train_peak_memory_bytes': train_peak,
+        'predict_peak_memory_bytes': predict_peak,
+        'held_out_accuracy': round(float(accuracy), 4),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Benchmark category prediction latency, throughput, memory and accuracy '
+            'on dataset.csv and synthetic corpora scaled from it, as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100, 1000],
+                            help='Corpus sizes as multiples of dataset.csv')
+        parser.add_argument('--classifiers', nargs='+', choices=sorted(CLASSIFIERS),
+                            default=list(CLASSIFIERS))
+        parser.add_argument('--samples', type=int, default=1000,
+                            help='Single predictions timed per run')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['samples'] < 1 or min(options['scales']) < 1:
+            raise CommandError('--samples and --scales must be positive')
+        corpus = load_corpus()
+        results = []
+        with tempfile.TemporaryDirectory() as workdir:
+            for scale in options['scales']:
+                data = scaled_corpus(corpus, scale)
+                for name in options['classifiers']:
+                    result = {'scale': scale, 'rows': len(data)}
+                    result.update(benchmark(data, name, options['samples'], workdir))
+                    results.append(result)
+                    self.stderr.write(
+                        f"{scale:>5}x {name:<20} p50 {result['latency_p50_ms']:>8} ms  "
+                        f"accuracy {result['held_out_accuracy']}"
+                    )
+
+        report = json.dumps({
+            'created': datetime.now(timezone.utc).isoformat(),
+            'dataset_version': corpus_version(),
+            'python': platform.python_version(),
+            'sklearn': sklearn.__version__,
+            'results': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report + '\n')
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.classifier import load_corpus
+from api.preprocessing import preprocess_text
+
+
+def nltk_preprocess_text(text):
+    """The original NLTK pipeline, including its per-call data checks."""
+    import nltk
+    from nltk.corpus import stopwords
+    from nltk.tokenize import word_tokenize
+
+    try:
+        stopwords.words('english')
+    except LookupError:
+        nltk.download('stopwords', quiet=True)
+    try:
+        word_tokenize("test")
+    except LookupError:
+        nltk.download('punkt', quiet=True)
+        nltk.download('punkt_tab', quiet=True)
+
+    stop_words = set(stopwords.words('english'))
+    tokens = word_tokenize(text.lower())
+    tokens = [t for t in tokens if t.isalnum() and t not in stop_words]
+    return ' '.join(tokens) if tokens else text.lower()
+
+
+def nltk_available():
+    import nltk
+    try:
+        nltk.data.find('tokenizers/punkt_tab')
+        nltk.data.find('corpora/stopwords')
+    except LookupError:
+        return False
+    return True
+
+
+def time_per_description(func, descriptions, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for description in descriptions:
+            func(description)
+    elapsed = time.perf_counter() - start
+    return elapsed / (repeat * len(descriptions))
+
+
+class Command(BaseCommand):
+    help = 'Compare the precompiled description normaliser with the NLTK pipeline on dataset.csv'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='Passes over the dataset descriptions per timing')
+
+    def handle(self, *args, **options):
+        data = load_corpus()
+        descriptions = [str(d) for d in data['description']]
+        repeat = options['repeat']
+
+        mismatches = [
+            (d, expected, preprocess_text(d))
+            for d, expected in zip(descriptions, data['clean_description'])
+            if preprocess_text(d) != expected
+        ]
+        self.stdout.write(f'{len(descriptions)} descriptions, {len(mismatches)} differ from clean_description')
+        for description, expected, actual in mismatches[:10]:
+            self.stdout.write(f'  {description!r}: expected {expected!r}, got {actual!r}')
+
+        fast = time_per_description(preprocess_text, descriptions, repeat)
+        self.stdout.write(f'precompiled: {fast * 1e6:8.2f} us/description  {1 / fast:12,.0f} descriptions/s')
+
+        if not nltk_available():
+            self.stdout.write('nltk:        skipped, NLTK data not installed (run nltk_downloader.py)')
+            return
+        slow = time_per_description(nltk_preprocess_text, descriptions, repeat)
+        self.stdout.write(f'nltk:        {slow * 1e6:8.2f} us/description  {1 / slow:12,.0f} descriptions/s')
+        self.stdout.write(f'speedup:     {slow / fast:.1f}x')
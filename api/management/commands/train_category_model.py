@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.classifier import CorpusError, retrain
+
+
+class Command(BaseCommand):
+    help = 'Train the category classifier from dataset.csv and the correction log and publish the model artifact'
+
+    def handle(self, *args, **options):
+        try:
+            model = retrain(force=True)
+        except CorpusError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Saved category model version {model.corpus_version}'))
@@ -0,0 +1,104 @@
+"""
+Per-user category models.
+
+Each user's own Expense descriptions and categories train a small
+incremental model that is consulted before the global classifier. Models
+are built lazily on a user's first prediction, kept in a bounded LRU so
+only active users stay in memory, and updated incrementally with expenses
+added since they were built. Users with too little history fall back to
+the global model.
+
+Edits and deletes cannot be unlearned, so they bump the user's
+DataVersion.history_version (handlers.py), shared by all the worker
+processes; a cached model built against an older history version is
+rebuilt from scratch on its next use, in every worker.
+"""
+import threading
+
+from django.conf import settings
+from django.db.models import F
+
+from expenses.models import Expense
+from summaries.models import DataVersion
+
+from .cache import LRUCache
+from .classifier import IncrementalModel
+from .preprocessing import preprocess_text
+
+
+class PersonalModel:
+    def __init__(self, user_id, history_version=None):
+        self.user_id = user_id
+        # The user's history version when the model was built
+        self.history_version = history_version
+        self.model = IncrementalModel()
+        # Highest Expense id learned so far
+        self.last_expense_id = 0
+        self.lock = threading.Lock()
+
+    @property
+    def usable(self):
+        return self.model.n_rows >= getattr(settings, 'CATEGORY_PERSONAL_MIN_EXPENSES', 10)
+
+    def refresh(self):
+        """Learn from the user's expenses added since the last refresh."""
+        with self.lock:
+            new_rows = (
+                Expense.objects
+                .filter(owner_id=self.user_id, id__gt=self.last_expense_id)
+                .order_by('id')
+                .values_list('id', 'description', 'category')
+            )
+            for expense_id, description, category in new_rows:
+                if description and category:
+                    self.model.partial_fit(preprocess_text(description), category)
+                self.last_expense_id = expense_id
+
+    def predict(self, clean_text):
+        """Return (category, probability) from the user's history, or None."""
+        if clean_text in self.model.exact:
+            return self.model.exact[clean_text], 1.0
+        learned = self.model.predict(clean_text)
+        if learned is None or learned[1] < getattr(settings, 'CATEGORY_PERSONAL_MIN_PROBABILITY', 0.6):
+            return None
+        return learned
+
+
+personal_models = LRUCache(getattr(settings, 'CATEGORY_PERSONAL_CACHE_SIZE', 256))
+
+
+def history_version(user_id):
+    return DataVersion.objects.filter(owner_id=user_id).values_list('history_version', flat=True).first()
+
+
+def bump_history_version(user_ids):
+    """Make every worker rebuild these users' models on next use."""
+    DataVersion.objects.filter(owner_id__in=set(user_ids)).update(history_version=F('history_version') + 1)
+
+
+def get_personal_model(user):
+    # Read before the expenses, so an edit committed in between only
+    # causes one more rebuild
+    version = history_version(user.pk)
+    personal = personal_models.get(user.pk)
+    # Without a DataVersion row edits cannot be seen, so nothing is kept
+    if personal is None or version is None or personal.history_version != version:
+        personal = PersonalModel(user.pk, version)
+        if version is not None:
+            personal_models.set(user.pk, personal)
+    personal.refresh()
+    return personal
+
+
+def personalize(user, clean_texts, predictions):
+    """Override global predictions with the user's own history where it is confident."""
+    personal = get_personal_model(user)
+    usable = personal.usable
+    for text, prediction in zip(clean_texts, predictions):
+        learned = personal.predict(text) if usable else None
+        if learned is None:
+            prediction['source'] = 'global'
+        else:
+            prediction['predicted_category'] = learned[0]
+            prediction['source'] = 'personal'
+    return predictions
@@ -0,0 +1,86 @@
+"""
+Text normalisation for category prediction.
+
+Produces the same output as the original NLTK pipeline (word_tokenize,
+keep alphanumeric tokens, drop English stopwords) without loading NLTK
+data or running the Punkt sentence tokenizer on every call: the stopword
+list is frozen here and tokenization is a handful of precompiled regexes
+that mirror the Treebank tokenizer's splitting rules.
+
+One known difference: Punkt does not treat a period after a known
+abbreviation ("dr.", "st.") as a sentence end, so NLTK drops such tokens
+while this normaliser keeps them.
+"""
+import re
+
+# nltk.corpus.stopwords.words('english')
+STOPWORDS = frozenset("""
+i me my myself we our ours ourselves you you're you've you'll you'd your
+yours yourself yourselves he him his himself she she's her hers herself it
+it's its itself they them their theirs themselves what which who whom this
+that that'll these those am is are was were be been being have has had
+having do does did doing a an the and but if or because as until while of
+at by for with about against between into through during before after above
+below to from up down in out on off over under again further then once here
+there when where why how all any both each few more most other some such no
+nor not only own same so than too very s t can will just don don't should
+should've now d ll m o re ve y ain aren aren't couldn couldn't didn didn't
+doesn doesn't hadn hadn't hasn hasn't haven haven't isn isn't ma mightn
+mightn't mustn mustn't needn needn't shan shan't shouldn shouldn't wasn
+wasn't weren weren't won won't wouldn wouldn't
+""".split())
+
+# Sentence-final period, possibly followed by closing brackets or quotes
+_FINAL_PERIOD = re.compile(r"(?<=[^.])\.(?=[\])}>\"'»”’]*$)")
+
+# Characters and sequences the Treebank tokenizer always splits off as tokens
+_SEPARATORS = re.compile(r"""[;@#$%&?!*()\[\]{}<>"`«»“”‘’„\u2012-\u2015]|--|''|\.{2,}""")
+
+# Comma or colon not followed by a digit; the following character is
+# consumed with it, so ",,x" splits only once, as in Treebank
+_COMMA = re.compile(r"([:,])([^\d]|$)")
+
+# Quote opening a word, unless it starts a contraction ("'tis" -> "' tis")
+_LEADING_QUOTE = re.compile(r"(?<!\w)'(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)")
+
+# Contractions or a closing quote at the end of a word, split in two passes
+# ("mcdonald's" -> "mcdonald 's", "can't's" -> "ca n't 's")
+_TRAILING_CLITICS = (
+    re.compile(r"(?<=[^' ])(?:'s|'m|'d|')(?=\s|$)"),
+    re.compile(r"(?<=[^' ])(?:'ll|'re|'ve|n't)(?=\s|$)"),
+)
+
+# Words Treebank splits in two ("cannot" -> "can not", "gonna" -> "gon na")
+_CONTRACTIONS = re.compile(
+    r"\b(?:(can)(not)|(gim)(me)|(gon)(na)|(got)(ta)|(lem)(me)|(more)('n)|(d)('ye))\b"
+    r"|\b(wan)(na)(?=\s|$)"
+)
+
+
+def _split_contraction(match):
+    return ' ' + ' '.join(part for part in match.groups() if part) + ' '
+
+
+
+def tokenize(text):
+    """Yield the alphanumeric tokens word_tokenize would produce for lowercased text."""
+    for word in text.split():
+        if word.isalnum() and not _CONTRACTIONS.search(word):
+            yield word
+            continue
+        word = _FINAL_PERIOD.sub(' ', word)
+        word = _COMMA.sub(r' \1 \2', word)
+        for chunk in _SEPARATORS.sub(' ', word).split():
+            chunk = _LEADING_QUOTE.sub("' ", chunk)
+            for clitic in _TRAILING_CLITICS:
+                chunk = clitic.sub(r' \g<0>', chunk)
+            chunk = _CONTRACTIONS.sub(_split_contraction, chunk)
+            for token in chunk.split():
+                if token.isalnum():
+                    yield token
+
+
+def preprocess_text(text):
+    text = str(text).lower()
+    tokens = [t for t in tokenize(text) if t not in STOPWORDS]
+    return ' '.join(tokens) if tokens else text
@@ -0,0 +1,51 @@
+"""
+Debounced background retraining.
+
+Bursts of corrections collapse into one training run: every request pushes
+the run back by `delay` seconds, but never more than `max_delay` seconds
+after the first request of the burst.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RetrainScheduler:
+    def __init__(self, callback, delay, max_delay):
+        self.callback = callback
+        self.delay = delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._timer = None
+        self._first_request = None
+
+    def schedule(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._first_request is None:
+                self._first_request = now
+            if self._timer is not None:
+                self._timer.cancel()
+            deadline = self._first_request + self.max_delay
+            wait = max(0.0, min(self.delay, deadline - now))
+            self._timer = threading.Timer(wait, self._run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def pending(self):
+        return self._timer is not None
+
+    def _run(self):
+        with self._lock:
+            if self._timer is not threading.current_thread():
+                # Superseded by a later schedule() call
+                return
+            self._timer = None
+            self._first_request = None
+        try:
+            self.callback()
+        except Exception:
+            logger.exception('Background retraining failed')
@@ -1,5 +1,14 @@
+from django.conf import settings
 from rest_framework import serializers
 
 class YourDataSerializer(serializers.Serializer):
     description = serializers.CharField()
     category = serializers.CharField()
+
+
+class BatchPredictionSerializer(serializers.Serializer):
+    descriptions = serializers.ListField(
+        child=serializers.CharField(trim_whitespace=True),
+        allow_empty=False,
+        max_length=getattr(settings, 'CATEGORY_BATCH_MAX_SIZE', 1000),
+    )
@@ -0,0 +1,50 @@
+"""
+Inverted index for closest-match lookups over the TF-IDF corpus.
+
+The corpus matrix is stored column-major (CSC), so each term's column is
+the posting list of the rows that contain it. A query only touches the
+posting lists of its own non-zero terms, instead of scoring every row.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+
+class SimilarityIndex:
+    def __init__(self, matrix):
+        # Rows are expected to be L2-normalised (TfidfVectorizer's default),
+        # so the dot product is the cosine similarity.
+        self.postings = sp.csc_matrix(matrix, dtype=np.float64)
+        self.postings.sort_indices()
+        self.n_rows = matrix.shape[0]
+
+    def search(self, vectors, k=1):
+        """
+        Return (indexes, scores) arrays of shape (n_queries, k) with the
+        k most similar corpus rows for each query row, best first.
+
+        Ties go to the lowest row index; queries sharing no term with the
+        corpus get row 0 with a score of 0, as a full scan's argmax would.
+        """
+        vectors = sp.csr_matrix(vectors)
+        n_queries = vectors.shape[0]
+        indexes = np.zeros((n_queries, k), dtype=np.int64)
+        scores = np.zeros((n_queries, k), dtype=np.float64)
+        indptr, rows, data = self.postings.indptr, self.postings.indices, self.postings.data
+        for i in range(n_queries):
+            start, end = vectors.indptr[i], vectors.indptr[i + 1]
+            terms, weights = vectors.indices[start:end], vectors.data[start:end]
+            lengths = indptr[terms + 1] - indptr[terms]
+            if not lengths.sum():
+                indexes[i] = np.arange(k) % max(self.n_rows, 1)
+                continue
+            candidates = np.concatenate([rows[indptr[t]:indptr[t + 1]] for t in terms])
+            contributions = np.concatenate([
+                data[indptr[t]:indptr[t + 1]] * w for t, w in zip(terms, weights)
+            ])
+            unique_rows, inverse = np.unique(candidates, return_inverse=True)
+            totals = np.bincount(inverse, weights=contributions)
+            # Stable sort keeps the lowest row index first among equal scores
+            order = np.argsort(-totals, kind='stable')[:k]
+            indexes[i, :len(order)] = unique_rows[order]
+            scores[i, :len(order)] = totals[order]
+        return indexes, scores
@@ -1,3 +1,511 @@
-from django.test import TestCase
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
 
-# Create your tests here.
+import joblib
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from expenses.models import Expense
+
+from . import classifier
+from .cache import LRUCache, predict_with_cache
+from .classifier import (ARTIFACT_FORMAT, IncrementalModel, corrections_snapshot, get_model, load_corpus,
+                         load_model, record_correction, retrain, save_model, train_model)
+from .events import CategoryCorrected, EventBus, bus
+from .personal import get_personal_model, history_version, personal_models, personalize
+from .preprocessing import preprocess_text
+from .similarity import SimilarityIndex
+
+SMAPS = '/proc/self/smaps_rollup'
+
+
+def private_kb():
+    """Memory private to this process (not shared with parent or siblings), in kB."""
+    total = 0
+    with open(SMAPS) as f:
+        for line in f:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                total += int(line.split()[1])
+    return total
+
+
+def dirty_kb():
+    """Memory written by this process alone (not file pages it only read), in kB."""
+    with open(SMAPS) as f:
+        for line in f:
+            if line.startswith('Private_Dirty:'):
+                return int(line.split()[1])
+
+
+def rss_kb():
+    with open(SMAPS) as f:
+        for line in f:
+            if line.startswith('Rss:'):
+                return int(line.split()[1])
+
+
+@unittest.skipUnless(os.path.exists(SMAPS) and hasattr(os, 'fork'), 'needs Linux /proc and fork')
+class SharedModelMemoryTests(SimpleTestCase):
+    workers = 3
+    descriptions = ['coffee', 'uber ride', 'paid the rent', 'netflix subscription'] * 25
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.settings_override = override_settings(
+            CATEGORY_MODEL_PATH=os.path.join(cls.tmpdir, 'category_model.joblib'),
+            CATEGORY_CORRECTIONS_PATH=os.path.join(cls.tmpdir, 'corrections.csv'),
+        )
+        cls.settings_override.enable()
+        save_model(train_model())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.tmpdir)
+        super().tearDownClass()
+
+    def worker_growth(self, model=None, mmap=False, measure=private_kb):
+        """
+        Fork the workers, let each predict (loading its own model if none was
+        preloaded) and return how much memory (private by default) each one gained.
+        """
+        read_fd, write_fd = os.pipe()
+        pids = []
+        for _ in range(self.workers):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    start = measure()
+                    worker_model = model or load_model(mmap=mmap)
+                    for description in self.descriptions:
+                        worker_model.predict(preprocess_text(description))
+                    os.write(write_fd, b'%d\n' % (measure() - start))
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        os.close(write_fd)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        with os.fdopen(read_fd) as f:
+            return [int(line) for line in f.read().split()]
+
+    def test_preloaded_model_is_shared_across_workers(self):
+        import gc
+
+        # Warm up the predict path once so both runs start from the same state
+        load_model(mmap=False).predict('warm up')
+        before = rss_kb()
+        model = load_model()
+        model.predict(preprocess_text('warm up'))
+        model_kb = rss_kb() - before
+        gc.freeze()
+        try:
+            shared = self.worker_growth(model)
+        finally:
+            gc.unfreeze()
+        private = self.worker_growth()
+
+        self.assertEqual(len(shared), self.workers)
+        # Each extra worker stays flat: sharing saves at least half the model's
+        # resident size per worker compared with loading a private copy.
+        for shared_kb, private_kb_ in zip(shared, private):
+            self.assertLess(shared_kb, private_kb_ - model_kb / 2,
+                            f'shared {shared} vs private {private}, model {model_kb} kB')
+
+    def test_hot_swapped_model_is_private_to_each_worker(self):
+        """
+        After a retrain publishes a new artifact, each worker loads it itself:
+        the memory-mapped arrays stay in the shared page cache, but sklearn
+        copies the trees into every worker's heap until the next restart.
+        """
+        import gc
+
+        preloaded = load_model()
+        preloaded.predict(preprocess_text('warm up'))
+        gc.freeze()
+        try:
+            shared = self.worker_growth(preloaded, measure=dirty_kb)
+            save_model(train_model())
+            swapped = self.worker_growth(mmap=True, measure=dirty_kb)
+            private = self.worker_growth(mmap=False, measure=dirty_kb)
+        finally:
+            gc.unfreeze()
+
+        model = load_model()
+        self.assertIsInstance(model.index.postings.data, np.memmap)
+        forest_kb = sum(
+            tree.tree_.__getstate__()['nodes'].nbytes + tree.tree_.__getstate__()['values'].nbytes
+            for tree in model.classifier.estimators_
+        ) / 1024
+        for shared_kb, swapped_kb, private_kb_ in zip(shared, swapped, private):
+            message = f'shared {shared}, swapped {swapped}, private {private}, forest {forest_kb:.0f} kB'
+            # Every worker pays for the forest again...
+            self.assertGreater(swapped_kb - shared_kb, forest_kb / 2, message)
+            # ...but not for the arrays, which a load without mmap also copies
+            self.assertLess(swapped_kb, private_kb_, message)
+
+    def test_artifact_arrays_are_memory_mapped(self):
+        model = load_model()
+        self.assertIsInstance(model.index.postings.data, np.memmap)
+        self.assertIsInstance(model.index.postings.indices, np.memmap)
+        self.assertIsNotNone(model.predict(preprocess_text('coffee')))
+
+
+class EventBusTests(SimpleTestCase):
+    def setUp(self):
+        self.bus = EventBus(1)
+        self.handled = []
+        self.bus.subscribe(CategoryCorrected, self.record)
+
+    def record(self, event):
+        self.handled.append((event, threading.current_thread().name))
+
+    def test_publish_runs_the_subscribers_in_the_background(self):
+        def broken(event):
+            raise RuntimeError('handler failed')
+
+        self.bus.subscribe(CategoryCorrected, broken)
+        also = []
+        self.bus.subscribe(CategoryCorrected, also.append)
+        event = CategoryCorrected('Uber', 'transport')
+        with self.assertLogs('api.events', 'ERROR'):
+            self.bus.publish(event)
+            self.bus.drain(5)
+        # A failing handler does not keep the others from the event
+        self.assertEqual(self.handled, [(event, 'event-bus')])
+        self.assertEqual(also, [event])
+
+    def test_full_queue_is_handled_inline(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow(event):
+            if event.description == 'first':
+                started.set()
+                release.wait(5)
+
+        self.bus.subscribe(CategoryCorrected, slow)
+        self.bus.publish(CategoryCorrected('first', 'a'))
+        self.assertTrue(started.wait(5))
+        # The worker is busy and the one-event queue fills up
+        self.bus.publish(CategoryCorrected('second', 'a'))
+        with self.assertLogs('api.events', 'WARNING'):
+            self.bus.publish(CategoryCorrected('third', 'a'))
+        self.assertEqual(self.handled[-1], (CategoryCorrected('third', 'a'), threading.current_thread().name))
+        release.set()
+        self.bus.drain(5)
+        self.assertEqual([event.description for event, _ in self.handled], ['first', 'third', 'second'])
+
+    def test_forked_worker_starts_its_own_thread(self):
+        self.bus.publish(CategoryCorrected('parent', 'a'))
+        self.bus.drain(5)
+        parent_thread = self.bus._thread
+        # A forked worker has a new pid, and none of the parent's threads
+        with mock.patch('api.events.os.getpid', return_value=os.getpid() + 1):
+            self.bus.publish(CategoryCorrected('child', 'a'))
+            self.assertIsNot(self.bus._thread, parent_thread)
+            self.bus.drain(5)
+        self.assertEqual([(event.description, thread) for event, thread in self.handled],
+                         [('parent', 'event-bus'), ('child', 'event-bus')])
+
+
+class IncrementalModelTests(SimpleTestCase):
+    def test_learns_while_other_threads_predict(self):
+        model = IncrementalModel()
+        model.partial_fit('coffee shop', 'food')
+        errors, stop = [], threading.Event()
+
+        def predict():
+            while not stop.is_set():
+                try:
+                    model.predict('coffee shop')
+                except Exception as e:
+                    errors.append(e)
+                    return
+
+        readers = [threading.Thread(target=predict) for _ in range(2)]
+        for reader in readers:
+            reader.start()
+        try:
+            # Every row adds a category, growing the counts predict() iterates
+            for i in range(20000):
+                model.partial_fit(f'coffee {i}', f'category {i}')
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(model.predict('coffee shop')[0], 'food')
+        self.assertEqual(model.n_rows, 20001)
+
+
+class SimilarityIndexTests(SimpleTestCase):
+    def test_matches_a_full_cosine_scan(self):
+        corpus = load_corpus()['clean_description'].fillna('')
+        vectorizer = TfidfVectorizer()
+        matrix = vectorizer.fit_transform(corpus)
+        index = SimilarityIndex(matrix)
+        queries = list(corpus) + [preprocess_text(text) for text in (
+            'Uber ride to the airport', 'monthly rent', 'coffee and a bus ticket', 'qwerty zxcv', '',
+        )]
+        vectors = vectorizer.transform(queries)
+        full = cosine_similarity(vectors, matrix)
+        # The corpus repeats descriptions, and some queries share no term with it
+        self.assertTrue(any((row == row.max()).sum() > 1 for row in full if row.max() > 0))
+        self.assertTrue((full.max(axis=1) == 0).any())
+
+        closest, scores = index.search(vectors, k=1)
+        # argmax breaks ties, and picks row 0 for all-zero rows, like the index
+        np.testing.assert_array_equal(closest[:, 0], full.argmax(axis=1))
+        np.testing.assert_allclose(scores[:, 0], full.max(axis=1), atol=1e-12)
+
+        closest, scores = index.search(vectors, k=3)
+        order = np.argsort(-full, kind='stable')[:, :3]
+        np.testing.assert_allclose(scores, np.take_along_axis(full, order, axis=1), atol=1e-12)
+        matched = scores > 0
+        np.testing.assert_array_equal(closest[matched], order[matched])
+
+
+CORPUS = [
+    ('coffee', 'food'), ('lunch sandwich', 'food'), ('pizza dinner', 'food'),
+    ('uber ride', 'transport'), ('bus ticket', 'transport'), ('train fare', 'transport'),
+    ('rent payment', 'rent'), ('monthly rent', 'rent'), ('apartment rent', 'rent'),
+]
+
+
+class CategoryModelTests(TestCase):
+    """The artifact, the correction log and the hot swap, on a small corpus of their own."""
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.dataset = os.path.join(tmpdir, 'dataset.csv')
+        self.artifact = os.path.join(tmpdir, 'model', 'category_model.joblib')
+        self.corrections = os.path.join(tmpdir, 'corrections.csv')
+        self.write_corpus(CORPUS)
+        overrides = override_settings(CATEGORY_DATASET_PATH=self.dataset, CATEGORY_MODEL_PATH=self.artifact,
+                                      CATEGORY_CORRECTIONS_PATH=self.corrections)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # A fresh worker: nothing loaded, no timers
+        for patcher in (mock.patch.multiple(classifier, _model=None, _artifact_stamp=None, _dataset_stamp=None),
+                        mock.patch.object(classifier.retrain_scheduler, 'schedule')):
+            self.schedule = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_corpus(self, rows):
+        with open(self.dataset, 'w') as f:
+            f.write('clean_description,category\n')
+            f.writelines(f'{text},{category}\n' for text, category in rows)
+
+    def test_artifact_is_trained_once(self):
+        with mock.patch.object(classifier, 'train_model', wraps=train_model) as train:
+            model = get_model()
+            self.assertIs(get_model(), model)
+            self.assertEqual(train.call_count, 1)
+            self.assertTrue(os.path.exists(self.artifact))
+            # Another worker loads the published artifact instead of training
+            classifier._model = None
+            loaded = get_model()
+        self.assertEqual(train.call_count, 1)
+        self.assertIsNot(loaded, model)
+        self.assertEqual(loaded.version, model.version)
+        self.assertEqual(loaded.predict('uber ride')['predicted_category'], 'transport')
+
+    def test_artifact_of_another_format_is_retrained(self):
+        os.makedirs(os.path.dirname(self.artifact))
+        joblib.dump({'format': ARTIFACT_FORMAT - 1, 'classifier': None}, self.artifact)
+        self.assertIsNone(load_model())
+        model = get_model()
+        self.assertEqual(load_model().version, model.version)
+
+    def test_changed_corpus_retrains_in_the_background(self):
+        model = get_model()
+        self.write_corpus(CORPUS + [('gym membership', 'fitness')])
+        # The current model keeps serving until the new artifact is published
+        self.assertIs(get_model(), model)
+        self.schedule.assert_called_once_with()
+        retrain()
+        swapped = get_model()
+        self.assertNotEqual(swapped.dataset_version, model.dataset_version)
+        self.assertIn('fitness', swapped.classifier.classes_)
+
+    def test_retrain_skips_a_current_artifact(self):
+        first = retrain()
+        with mock.patch.object(classifier, 'train_model') as train:
+            self.assertEqual(retrain().version, first.version)
+        train.assert_not_called()
+        record_correction('Gym', 'fitness', 'gym')
+        second = retrain()
+        self.assertEqual(second.trained_offset, corrections_snapshot())
+        self.assertIn('fitness', second.classifier.classes_)
+
+    def test_corrections_are_absorbed_from_the_last_offset(self):
+        model = get_model()
+        record_correction('Gym  membership', 'fitness', 'gym membership')
+        self.assertEqual(model.absorb_corrections(), 1)
+        self.assertEqual(model.corrections_offset, os.path.getsize(self.corrections))
+        self.assertEqual(model.absorb_corrections(), 0)
+        self.assertEqual(model.predict('gym membership'),
+                         dict(model.predict('gym membership'), predicted_category='fitness', confidence=1.0))
+        version = model.version
+
+        # A row still being appended is left for the next call
+        with open(self.corrections, 'a') as f:
+            f.write('Yoga class,fitn')
+        offset = model.corrections_offset
+        self.assertEqual(model.absorb_corrections(), 0)
+        self.assertEqual(model.corrections_offset, offset)
+        with open(self.corrections, 'a') as f:
+            f.write('ess,yoga class\n')
+        record_correction('Netflix', 'entertainment', 'netflix')
+        self.assertEqual(model.absorb_corrections(), 2)
+        self.assertNotEqual(model.version, version)
+        with open(self.corrections) as f:
+            self.assertEqual(f.read().count('clean_description'), 1)
+
+        # A replaced log is read again from the start
+        os.remove(self.corrections)
+        record_correction('Spotify', 'entertainment', 'spotify')
+        self.assertEqual(model.absorb_corrections(), 1)
+        self.assertEqual(model.corrections.n_rows, 1)
+        # Other workers pick corrections up on their next call
+        self.assertEqual(get_model().predict('spotify')['predicted_category'], 'entertainment')
+
+    def test_publishing_is_atomic(self):
+        model = get_model()
+        published = os.path.getsize(self.artifact)
+
+        def interrupted(payload, f):
+            f.write(b'half an artifact')
+            raise OSError('disk full')
+
+        with mock.patch.object(classifier.joblib, 'dump', interrupted), self.assertRaises(OSError):
+            save_model(train_model())
+        self.assertFalse([name for name in os.listdir(os.path.dirname(self.artifact)) if name.endswith('.tmp')])
+        self.assertEqual(os.path.getsize(self.artifact), published)
+        self.assertIs(get_model(), model)
+
+        record_correction('Gym', 'fitness', 'gym')
+        retrain()
+        swapped = get_model()
+        self.assertIsNot(swapped, model)
+        self.assertEqual(swapped.trained_offset, corrections_snapshot())
+        self.assertIn('fitness', swapped.classifier.classes_)
+
+    def test_corrections_reach_the_model(self):
+        user = User.objects.create_user('alice', password='pw')
+        model = get_model()
+        self.assertNotEqual(model.predict('gym membership')['predicted_category'], 'fitness')
+        body = {'new_data': {'description': 'Gym membership', 'category': 'fitness'}}
+        self.assertEqual(self.client.post('/api/update-dataset/', body, content_type='application/json').status_code,
+                         403)
+        self.client.force_login(user)
+        for invalid in ({}, {'new_data': 'gym'}, {'new_data': {'description': 'Gym'}},
+                        {'new_data': {'category': 'fitness'}}):
+            with self.subTest(body=invalid):
+                response = self.client.post('/api/update-dataset/', invalid, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(os.path.exists(self.corrections))
+
+        response = self.client.post('/api/update-dataset/', body, content_type='application/json')
+        self.assertEqual((response.status_code, response.json()), (202, {'status': 'queued'}))
+        bus.drain(5)
+        self.schedule.assert_called_once_with()
+        self.assertEqual(get_model().predict('gym membership')['predicted_category'], 'fitness')
+
+        # Saving an expense under another category than predicted is a correction too
+        form = {'amount': '30', 'expense_date': datetime.date.today().isoformat(), 'description': 'Yoga class'}
+        with mock.patch.object(bus, 'publish') as publish:
+            self.client.post('/add-expense', dict(form, category='food', initial_predicted_category='food'))
+            publish.assert_not_called()
+            self.client.post('/add-expense', dict(form, category='fitness', initial_predicted_category='food'))
+        publish.assert_called_once_with(CategoryCorrected('Yoga class', 'fitness'))
+        self.assertEqual(Expense.objects.filter(owner=user).count(), 2)
+
+    def test_batch_prediction_and_cache(self):
+        user = User.objects.create_user('alice', password='pw')
+        self.client.force_login(user)
+        response = self.client.post('/api/predict-category/batch/',
+                                    {'descriptions': ['Uber ride', 'Monthly rent', 'Uber  ride']},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual(data['model_version'], get_model().version)
+        self.assertEqual([(p['description'], p['predicted_category']) for p in data['predictions']],
+                         [('Uber ride', 'transport'), ('Monthly rent', 'rent'), ('Uber  ride', 'transport')])
+
+        cache = LRUCache(2)
+        model = get_model()
+        with mock.patch('api.cache.prediction_cache', cache), \
+                mock.patch.object(model, 'predict_many', wraps=model.predict_many) as predict_many:
+            predict_with_cache(model, ['coffee', 'uber ride', 'coffee'])
+            predict_with_cache(model, ['coffee', 'rent payment'])
+        # One batch per call, with only the misses, each once
+        self.assertEqual([c.args[0] for c in predict_many.call_args_list], [['coffee', 'uber ride'], ['rent payment']])
+        self.assertEqual({k: cache.stats()[k] for k in ('size', 'hits', 'misses', 'evictions')},
+                         {'size': 2, 'hits': 1, 'misses': 4, 'evictions': 1})
+
+
+class PersonalModelTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+        cls.expenses = [
+            Expense.objects.create(owner=cls.user, amount=4, date=datetime.date.today(),
+                                   description='Starbucks', category='coffee')
+            for _ in range(12)
+        ]
+
+    def setUp(self):
+        personal_models.clear()
+
+    def predict(self, user, description):
+        prediction = {'predicted_category': 'food'}
+        personalize(user, [preprocess_text(description)], [prediction])
+        return prediction['predicted_category'], prediction['source']
+
+    def test_overrides_global_prediction(self):
+        self.assertEqual(self.predict(self.user, 'starbucks'), ('coffee', 'personal'))
+        self.assertEqual(self.predict(self.user, 'rent'), ('food', 'global'))
+
+    def test_too_little_history(self):
+        other = User.objects.create_user('bob', password='pw')
+        Expense.objects.create(owner=other, amount=4, date=datetime.date.today(),
+                               description='Starbucks', category='coffee')
+        self.assertEqual(self.predict(other, 'starbucks'), ('food', 'global'))
+
+    def test_new_expenses_are_learned_incrementally(self):
+        personal = get_personal_model(self.user)
+        expense = Expense.objects.create(owner=self.user, amount=9, date=datetime.date.today(),
+                                         description='Cinema', category='movies')
+        self.assertIs(get_personal_model(self.user), personal)
+        self.assertEqual(personal.last_expense_id, expense.pk)
+        self.assertEqual(personal.predict(preprocess_text('cinema')), ('movies', 1.0))
+
+    def test_edits_rebuild_the_model_in_every_worker(self):
+        personal = get_personal_model(self.user)
+        version = history_version(self.user.pk)
+        for expense in self.expenses:
+            expense.category = 'drinks'
+            expense.save()
+        # Nothing in this process was told; the shared stamp moved
+        self.assertIs(personal_models.get(self.user.pk), personal)
+        self.assertGreater(history_version(self.user.pk), version)
+        self.assertEqual(self.predict(self.user, 'starbucks'), ('drinks', 'personal'))
+        self.assertIsNot(get_personal_model(self.user), personal)
+
+        self.expenses[0].delete()
+        rebuilt = get_personal_model(self.user)
+        Expense.objects.filter(owner=self.user).delete()
+        self.assertIsNot(get_personal_model(self.user), rebuilt)
+        self.assertEqual(self.predict(self.user, 'starbucks'), ('food', 'global'))
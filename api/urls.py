@@ -1,8 +1,10 @@
 # api/urls.py
 from django.urls import path
-from .views import PredictCategory, UpdateDataset
+from .views import PredictCategory, PredictCategoryBatch, PredictionCacheStats, UpdateDataset
 
 urlpatterns = [
     path('predict-category/', PredictCategory.as_view(), name='predict-category'),
+    path('predict-category/batch/', PredictCategoryBatch.as_view(), name='predict-category-batch'),
+    path('prediction-cache-stats/', PredictionCacheStats.as_view(), name='prediction-cache-stats'),
     path('update-dataset/', UpdateDataset.as_view(), name='update-dataset'),
 ]
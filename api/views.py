@@ -2,20 +2,21 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics.pairwise import cosine_similarity
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-import nltk
 import json
-from rest_framework.permissions import IsAuthenticated 
-from .serializers import YourDataSerializer  
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from .serializers import YourDataSerializer, BatchPredictionSerializer
 from statsmodels.tsa.arima.model import ARIMA
 import os
+from django.utils.decorators import method_decorator
+from personalfinance.admission import admission_control
+from .cache import prediction_cache, predict_with_cache
+from .classifier import CorpusError, get_model
+from .events import CategoryCorrected, bus
+from .personal import personalize
+from .preprocessing import preprocess_text
 
 
+@method_decorator(admission_control('prediction'), name='post')
 class PredictCategory(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -33,44 +34,20 @@ class PredictCategory(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Load dataset
-            dataset_path = 'dataset.csv'
-            if not os.path.exists(dataset_path):
+            try:
+                model = get_model()
+            except CorpusError as e:
                 return Response(
-                    {'error': 'Dataset file not found'}, 
+                    {'error': str(e)}, 
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
             
-            data = pd.read_csv(dataset_path)
-            
-            # Check if dataset has required columns
-            if 'clean_description' not in data.columns or 'category' not in data.columns:
-                return Response(
-                    {'error': 'Invalid dataset format'}, 
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-            
-            # Train model
-            tfidf_vectorizer = TfidfVectorizer()
-            X = tfidf_vectorizer.fit_transform(data['clean_description'])
-            model = RandomForestClassifier(random_state=42, n_estimators=100)
-            model.fit(X, data['category'])
-            
-            # Preprocess user input
+            # Preprocess user input and predict with the shared model
             user_input_clean = preprocess_text(user_input)
-            user_input_vector = tfidf_vectorizer.transform([user_input_clean])
-            
-            # Find closest match using cosine similarity
-            similarities = cosine_similarity(user_input_vector, X)
-            closest_match_index = similarities.argmax()
-            
-            # Predict category
-            predicted_category = model.predict(user_input_vector)
+            prediction = predict_with_cache(model, [user_input_clean])[0]
+            personalize(request.user, [user_input_clean], [prediction])
             
-            return Response({
-                'predicted_category': predicted_category[0],
-                'confidence': float(similarities[0][closest_match_index])
-            }, status=status.HTTP_200_OK)
+            return Response(prediction, status=status.HTTP_200_OK)
             
         except Exception as e:
             return Response(
@@ -79,51 +56,59 @@ class PredictCategory(APIView):
             )
 
 
-
-class UpdateDataset(APIView):
-    # permission_classes = [IsAuthenticated]
+@method_decorator(admission_control('prediction'), name='post')
+class PredictCategoryBatch(APIView):
+    permission_classes = [IsAuthenticated]
 
     def post(self, request):
-       new_data = request.data.get('new_data')
-
-       if 'description' in new_data and 'category' in new_data:
-            # Load your existing dataset
-            data = pd.read_csv('dataset.csv')  # Load the existing dataset
-            new_category = new_data['category']
-            new_description = new_data['description']
-
-            # Append the new data to the dataset
-            new_row = {'description': new_description, 'category': new_category, 'clean_description': preprocess_text(new_description)}
-            data = pd.concat([data, pd.DataFrame([new_row])], ignore_index=True)
-            # Save the updated dataset
-            data.to_csv('dataset.csv', index=False)
-            
-            tfidf_vectorizer = TfidfVectorizer()
+        serializer = BatchPredictionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        descriptions = serializer.validated_data['descriptions']
+
+        try:
+            model = get_model()
+        except CorpusError as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        try:
+            clean = [preprocess_text(d) for d in descriptions]
+            predictions = predict_with_cache(model, clean)
+            personalize(request.user, clean, predictions)
+        except Exception as e:
+            return Response(
+                {'error': f'Prediction failed: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
 
-            # Retrain the model with the updated dataset
-            X = tfidf_vectorizer.transform(data['clean_description'])
-            model.fit(X, data['category'])
+        for description, prediction in zip(descriptions, predictions):
+            prediction['description'] = description
+        return Response({
+            'model_version': model.version,
+            'predictions': predictions,
+        }, status=status.HTTP_200_OK)
 
 
+class PredictionCacheStats(APIView):
+    permission_classes = [IsAdminUser]
 
-def preprocess_text(text):
-    try:
-        # Ensure NLTK data is available
-        try:
-            stopwords.words('english')
-        except LookupError:
-            nltk.download('stopwords', quiet=True)
-        
-        try:
-            word_tokenize("test")
-        except LookupError:
-            nltk.download('punkt', quiet=True)
-            nltk.download('punkt_tab', quiet=True)
-        
-        stop_words = set(stopwords.words('english'))
-        tokens = word_tokenize(text.lower())
-        tokens = [t for t in tokens if t.isalnum() and t not in stop_words]
-        return ' '.join(tokens) if tokens else text.lower()
-    except Exception as e:
-        # Fallback to simple preprocessing if NLTK fails
-        return ' '.join([word.lower() for word in text.split() if word.isalnum()])
+    def get(self, request):
+        return Response(prediction_cache.stats(), status=status.HTTP_200_OK)
+
+
+class UpdateDataset(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        new_data = request.data.get('new_data')
+
+        if not isinstance(new_data, dict) or not new_data.get('description') or not new_data.get('category'):
+            return Response(
+                {'error': 'new_data with description and category is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Handled off the request path: appended to the correction log, learned
+        # incrementally and folded into the forest by a debounced retrain.
+        bus.publish(CategoryCorrected(str(new_data['description']), str(new_data['category'])))
+        return Response({'status': 'queued'}, status=status.HTTP_202_ACCEPTED)
@@ -6,11 +6,13 @@ from expenses.models import Expense
 from django.contrib import messages
 import matplotlib.pyplot as plt
 from django.contrib.auth.decorators import login_required
+from personalfinance.admission import admission_control
 
 # NEW: use Holt/Winters
 from statsmodels.tsa.holtwinters import ExponentialSmoothing
 
 @login_required(login_url='/authentication/login')
+@admission_control('forecast')
 def forecast(request):
     # Fetch more history to stabilize the model (e.g., last 180 expenses or last 180 days)
     expenses_qs = Expense.objects.filter(owner=request.user).order_by('-date')[:180]
@@ -1,7 +1,9 @@
 from django.contrib import admin
-from .models import Expense, Category
+from .models import Budget, Expense, Category, StatementImport
 # Register your models here.
 
 
 admin.site.register(Expense)
 admin.site.register(Category)
+admin.site.register(Budget)
+admin.site.register(StatementImport)
@@ -0,0 +1,157 @@
+"""
+Budget evaluation with running counters.
+
+Each budget keeps one BudgetCounter per period (day, week starting
+Monday, or calendar month) holding what has been spent in it. Counters
+follow the expense rollups: every change to DailyRollup (create, edit,
+delete, bulk import) is forwarded by handlers.py to record_totals(),
+in the same transaction. Checking an expense against a user's budgets is
+then one counter lookup per budget, whatever the history length.
+
+A counter is created on first use, seeded from the daily rollups of its
+period; spending is only recorded against counters that already exist.
+The counter row is written before the rollups are read, in one
+transaction, so an expense committed meanwhile is either in the seed or
+finds the counter. `manage.py rebuild_rollups` also repairs counters.
+"""
+import calendar
+import datetime
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from summaries.models import DailyRollup
+
+from .models import Budget, BudgetCounter
+
+# Applies when the user has not set a daily limit of their own
+DEFAULT_DAILY_LIMIT = 5000
+
+
+def period_bounds(period, day):
+    """First and last day of the budget period containing day."""
+    if period == Budget.DAILY:
+        return day, day
+    if period == Budget.WEEKLY:
+        start = day - datetime.timedelta(days=day.weekday())
+        return start, start + datetime.timedelta(days=6)
+    if period == Budget.MONTHLY:
+        return day.replace(day=1), day.replace(day=calendar.monthrange(day.year, day.month)[1])
+    raise ValueError(f'Unknown budget period {period!r}')
+
+
+def parse_limit(text):
+    """The budget limit typed in a form, or None unless it is a finite, non-negative number."""
+    try:
+        limit = float(text)
+    except (TypeError, ValueError):
+        return None
+    return limit if math.isfinite(limit) and limit >= 0 else None
+
+
+def daily_limit_budget(user):
+    """
+    The user's overall daily budget, created with the default limit if
+    missing; for views about to change it (see UserSettings.daily_limit).
+    """
+    budget, _ = Budget.objects.get_or_create(
+        owner=user, period=Budget.DAILY, category='',
+        defaults={'limit': DEFAULT_DAILY_LIMIT},
+    )
+    return budget
+
+
+def rollup_spent(budget, day):
+    """Amount spent against the budget in the period containing day, from the rollups."""
+    start, end = period_bounds(budget.period, day)
+    rollups = DailyRollup.objects.filter(owner_id=budget.owner_id, kind='expense', day__range=(start, end))
+    if budget.category:
+        rollups = rollups.filter(label=budget.category)
+    return rollups.aggregate(total=Sum('total'))['total'] or 0
+
+
+def spent(budget, day):
+    """Amount spent against the budget in the period containing day."""
+    if budget.pk is None:
+        # The unsaved default daily limit has no counters
+        return rollup_spent(budget, day)
+    start, _ = period_bounds(budget.period, day)
+    counter = BudgetCounter.objects.filter(budget=budget, period_start=start).first()
+    if counter is None:
+        with transaction.atomic():
+            # Serialises with record_totals (SQLite already does for any two writes)
+            Budget.objects.select_for_update().filter(pk=budget.pk).exists()
+            counter, created = BudgetCounter.objects.get_or_create(budget=budget, period_start=start)
+            if created:
+                counter.spent = rollup_spent(budget, start)
+                counter.save(update_fields=['spent'])
+    return counter.spent
+
+
+def record_totals(totals):
+    """
+    Move the existing counters covering each day of the
+    {(owner_id, day, category): (amount, count)} rollup deltas by the
+    amount (negative to refund), with one budget query per owner and one
+    batched UPDATE of the counters.
+    """
+    by_owner = defaultdict(list)
+    for (owner_id, day, category), (amount, _) in totals.items():
+        by_owner[owner_id].append((day, category, amount))
+    for owner_id, rows in by_owner.items():
+        budgets = list(Budget.objects.select_for_update().filter(owner_id=owner_id))
+        deltas = defaultdict(float)
+        for day, category, amount in rows:
+            for budget in budgets:
+                if budget.category in ('', category):
+                    deltas[budget.pk, period_bounds(budget.period, day)[0]] += amount
+        if not deltas:
+            continue
+        starts = [start for _, start in deltas]
+        changed = []
+        for counter in BudgetCounter.objects.filter(budget__in=budgets,
+                                                    period_start__range=(min(starts), max(starts))):
+            delta = deltas.get((counter.budget_id, counter.period_start))
+            if delta:
+                counter.spent = F('spent') + delta
+                changed.append(counter)
+        BudgetCounter.objects.bulk_update(changed, ['spent'], batch_size=500)
+
+
+def exceeded_budgets(budgets, day, amount):
+    """
+    Return [(budget, total)] for the budgets a new expense would take over
+    their limit, with the period's total including it. budgets are the
+    ones the expense counts against (UserSettings.applicable_budgets).
+    """
+    exceeded = []
+    for budget in budgets:
+        total = spent(budget, day) + amount
+        if total > budget.limit:
+            exceeded.append((budget, total))
+    return exceeded
+
+
+def verify_counters(owner=None, tolerance=1e-6):
+    """Return [(counter, expected)] for the counters that disagree with the rollups."""
+    counters = BudgetCounter.objects.select_related('budget').order_by('pk')
+    if owner is not None:
+        counters = counters.filter(budget__owner=owner)
+    mismatches = []
+    for counter in counters:
+        expected = rollup_spent(counter.budget, counter.period_start)
+        if abs(expected - counter.spent) > tolerance * max(1.0, abs(expected)):
+            mismatches.append((counter, expected))
+    return mismatches
+
+
+def rebuild_counters(owner=None):
+    """Reset the counters that disagree with the rollups; returns how many were."""
+    with transaction.atomic():
+        mismatches = verify_counters(owner)
+        for counter, expected in mismatches:
+            counter.spent = expected
+        BudgetCounter.objects.bulk_update([counter for counter, _ in mismatches], ['spent'], batch_size=500)
+    return len(mismatches)
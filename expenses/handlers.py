@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from api.events import StatementUploaded, bus
+from personalfinance import reference
+from summaries.rollup import rollups_changed
+
+from .budgets import record_totals
+from .importing import import_uploaded_statement
+from .models import Budget, BudgetCounter, Category
+
+bus.subscribe(StatementUploaded, import_uploaded_statement)
+
+
+@receiver(rollups_changed)
+def expense_rollups_changed(sender, totals, **kwargs):
+    if sender != 'expense':
+        return
+    # Same transaction as the expense write, so counters never drift from it
+    record_totals(totals)
+
+
+@receiver(pre_save, sender=Budget)
+def budget_redefined(sender, instance, raw=False, **kwargs):
+    # Counters of another period, category or owner are not this budget's
+    # totals; spent() seeds new ones from the rollups
+    if raw or instance.pk is None:
+        return
+    old = Budget.objects.filter(pk=instance.pk).values('owner_id', 'period', 'category').first()
+    if old is not None and old != {'owner_id': instance.owner_id, 'period': instance.period,
+                                   'category': instance.category}:
+        BudgetCounter.objects.filter(budget_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    # After commit, so no process can reload the old rows in between
+    transaction.on_commit(reference.invalidate)
@@ -0,0 +1,304 @@
+"""
+Streaming import of bank statements (CSV or OFX) as expenses.
+
+The file is read one line at a time by a generator parser, so memory
+does not grow with its size. Parsed rows are taken in batches of
+IMPORT_BATCH_SIZE; each batch is categorized with one call to the shared
+classifier (rows that already name a category keep it) and written with
+one bulk_create, in its own transaction together with its rollup and
+budget updates. A failed import therefore keeps the batches before the
+failure.
+
+Uploads are imported off the request: queue_import() saves the file and
+publishes a StatementUploaded event, which the worker's event-bus thread
+handles with import_uploaded_statement(). The job's progress is saved
+after every batch, and fail_stale_imports() marks as failed the running
+imports without progress for IMPORT_STALE_AFTER seconds, as their worker
+has died.
+
+Statements use the bank's sign convention: money going out is negative
+and becomes an expense; credits are counted and skipped.
+"""
+import csv
+import datetime
+import html
+import io
+import os
+import re
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+from api.cache import predict_with_cache
+from api.classifier import CorpusError, get_model
+from api.events import StatementUploaded, bus
+from api.preprocessing import preprocess_text
+from summaries.rollup import add_rows
+
+from .models import Expense, StatementImport
+
+FORMATS = ('csv', 'ofx')
+
+# Accepted CSV header names (lower case) for each field
+CSV_COLUMNS = {
+    'date': ('date', 'transaction date', 'posted date', 'posting date', 'booking date'),
+    'description': ('description', 'payee', 'name', 'details', 'narrative', 'memo'),
+    'amount': ('amount', 'value'),
+    # Banks that list debits and credits in separate, unsigned columns
+    'debit': ('debit', 'withdrawal', 'money out'),
+    'credit': ('credit', 'deposit', 'money in'),
+    'category': ('category',),
+}
+
+# Error messages kept per import; the rest are only counted
+MAX_ERRORS = 20
+
+_OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+# Currency symbols, thousands separators and spaces in amounts
+_NOT_NUMERIC = re.compile(r'[^0-9.()+\-]')
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0
+        self.errors = 0
+        self.messages = []
+        # Bytes of the file read so far
+        self.position = 0
+
+    def error(self, line, message):
+        self.errors += 1
+        if len(self.messages) < MAX_ERRORS:
+            self.messages.append(f'Line {line}: {message}')
+
+
+def detect_format(filename):
+    return 'ofx' if filename.lower().endswith(('.ofx', '.qfx')) else 'csv'
+
+
+def _csv_field(header, field):
+    for name in CSV_COLUMNS[field]:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+def parse_csv(lines):
+    """Yield (line number, {field: text}) for each row of a CSV statement."""
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [name.strip().lower() for name in header]
+    columns = {field: _csv_field(header, field) for field in CSV_COLUMNS}
+    if columns['date'] is None or columns['description'] is None \
+            or (columns['amount'] is None and columns['debit'] is None):
+        raise ValueError('The CSV header needs date, description and amount (or debit) columns')
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        yield reader.line_num, {
+            field: row[index].strip() if index < len(row) else ''
+            for field, index in columns.items() if index is not None
+        }
+
+
+def parse_ofx(lines):
+    """Yield (line number, {field: text}) for each STMTTRN of an OFX statement (SGML or XML)."""
+    fields = None
+    for number, line in enumerate(lines, 1):
+        for closing, tag, value in _OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if fields is not None:
+                    yield number, fields
+                fields = None if closing else {}
+            elif fields is not None and not closing:
+                fields[tag] = html.unescape(value.strip())
+    if fields is not None:
+        yield number, fields
+
+
+def _ofx_row(fields):
+    name, memo = fields.get('NAME', ''), fields.get('MEMO', '')
+    return {
+        'date': fields.get('DTPOSTED', '')[:8],
+        'description': name if not memo or memo == name else f'{name} {memo}'.strip(),
+        'amount': fields.get('TRNAMT', ''),
+    }
+
+
+def parse_amount(text):
+    text = _NOT_NUMERIC.sub('', text)
+    if text.startswith('(') and text.endswith(')'):
+        text = '-' + text[1:-1]
+    return float(text)
+
+
+def clean_row(fields, date_format=None):
+    """Return (date, amount, description, category) for a parsed row, or raise ValueError."""
+    description = ' '.join(fields.get('description', '').split())
+    if not description:
+        raise ValueError('missing description')
+    text = fields.get('date', '')
+    try:
+        date = datetime.datetime.strptime(text, date_format or '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'invalid date {text!r}')
+    if date > datetime.date.today():
+        raise ValueError('date in the future')
+    try:
+        if fields.get('amount'):
+            amount = parse_amount(fields['amount'])
+        else:
+            amount = parse_amount(fields.get('credit') or '0') - parse_amount(fields.get('debit') or '0')
+    except ValueError:
+        raise ValueError(f"invalid amount {fields.get('amount') or fields.get('debit')!r}")
+    return date, amount, description, fields.get('category', '')
+
+
+def categorize(expenses):
+    """Fill in the category of expenses without one, with one batched prediction."""
+    missing = [expense for expense in expenses if not expense.category]
+    if not missing:
+        return
+    fallback = getattr(settings, 'IMPORT_FALLBACK_CATEGORY', 'other')
+    try:
+        model = get_model()
+    except CorpusError:
+        for expense in missing:
+            expense.category = fallback
+        return
+    predictions = predict_with_cache(model, [preprocess_text(e.description) for e in missing])
+    for expense, prediction in zip(missing, predictions):
+        expense.category = prediction['predicted_category'] or fallback
+
+
+def import_statement(owner, raw_file, fmt, batch_size=None, date_format=None, progress=None):
+    """
+    Import the statement in the binary file object raw_file as the owner's
+    expenses and return an ImportResult. progress, if given, is called with
+    the result after every batch.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown statement format {fmt!r}, expected one of {FORMATS}')
+    batch_size = batch_size or getattr(settings, 'IMPORT_BATCH_SIZE', 1000)
+    result = ImportResult()
+    text = io.TextIOWrapper(raw_file, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        if fmt == 'csv':
+            rows = parse_csv(text)
+        else:
+            # OFX dates have a fixed format
+            rows = ((line, _ofx_row(fields)) for line, fields in parse_ofx(text))
+            date_format = '%Y%m%d'
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            expenses = []
+            for line, fields in batch:
+                try:
+                    date, amount, description, category = clean_row(fields, date_format)
+                except ValueError as e:
+                    result.error(line, e)
+                    continue
+                if amount >= 0:
+                    result.skipped += 1
+                    continue
+                expenses.append(Expense(owner=owner, date=date, amount=-amount,
+                                        description=description, category=category))
+            categorize(expenses)
+            # bulk_create skips Expense.save(), so the rollups (and through
+            # them the budget counters) are updated here
+            with transaction.atomic():
+                Expense.objects.bulk_create(expenses)
+                add_rows(Expense.rollup_kind, expenses)
+            result.imported += len(expenses)
+            result.position = raw_file.tell()
+            if progress is not None:
+                progress(result)
+    finally:
+        text.detach()
+    return result
+
+
+def run_import(job, raw_file, fmt, progress=None, **options):
+    """
+    import_statement() for a StatementImport, saving its progress after
+    every batch so that it can be followed from other requests.
+    """
+    jobs = StatementImport.objects.filter(pk=job.pk)
+
+    def record(result):
+        jobs.update(position=result.position, imported=result.imported,
+                    skipped=result.skipped, errors=result.errors, updated=now())
+        if progress is not None:
+            progress(result)
+
+    try:
+        result = import_statement(job.owner, raw_file, fmt, progress=record, **options)
+    except Exception as e:
+        jobs.update(status=StatementImport.FAILED, finished=now(), updated=now(), messages=str(e))
+        raise
+    jobs.update(status=StatementImport.DONE, finished=now(), updated=now(), position=job.size or result.position,
+                imported=result.imported, skipped=result.skipped, errors=result.errors,
+                messages='\n'.join(result.messages))
+    return result
+
+
+def upload_path(job_id):
+    return os.path.join(getattr(settings, 'IMPORT_UPLOAD_DIR', os.path.join(settings.BASE_DIR, 'run', 'imports')),
+                        str(job_id))
+
+
+def queue_import(job, upload, fmt, date_format=None):
+    """
+    Save the uploaded file for the job and import it in the background
+    once the job is committed.
+    """
+    path = upload_path(job.pk)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    transaction.on_commit(lambda: bus.publish(StatementUploaded(job.pk, fmt, date_format)))
+
+
+def import_uploaded_statement(event):
+    """Run a queued import; its outcome is recorded on the StatementImport."""
+    try:
+        # Not when it has been failed as stale while waiting in the queue
+        jobs = StatementImport.objects.filter(pk=event.job_id, status=StatementImport.RUNNING)
+        if not jobs.update(updated=now()):
+            return
+        job = jobs.select_related('owner').get()
+        with open(upload_path(job.pk), 'rb') as f:
+            try:
+                run_import(job, f, event.format, date_format=event.date_format)
+            except ValueError:
+                pass
+    finally:
+        _remove_upload(event.job_id)
+
+
+def _remove_upload(job_id):
+    try:
+        os.remove(upload_path(job_id))
+    except FileNotFoundError:
+        pass
+
+
+def fail_stale_imports(owner):
+    """Mark the owner's running imports without recent progress as failed."""
+    stale_after = getattr(settings, 'IMPORT_STALE_AFTER', 600)
+    stale = StatementImport.objects.filter(owner=owner, status=StatementImport.RUNNING,
+                                           updated__lt=now() - datetime.timedelta(seconds=stale_after))
+    for job_id in stale.values_list('pk', flat=True):
+        _remove_upload(job_id)
+    stale.update(status=StatementImport.FAILED, finished=now(),
+                 messages=f'Interrupted: no progress for {stale_after} seconds')
@@ -0,0 +1,45 @@
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.importing import FORMATS, detect_format, run_import
+from expenses.models import StatementImport
+
+
+class Command(BaseCommand):
+    help = "Import a CSV or OFX bank statement as a user's expenses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Statement file')
+        parser.add_argument('--user', required=True, help='Username to import the expenses for')
+        parser.add_argument('--format', choices=FORMATS, help='Statement format (default: from the file name)')
+        parser.add_argument('--batch-size', type=int, help='Rows per transaction (default: IMPORT_BATCH_SIZE)')
+        parser.add_argument('--date-format', help='strptime format of CSV dates (default: %%Y-%%m-%%d)')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['user']!r}")
+        path = options['path']
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            raise CommandError(str(e))
+        fmt = options['format'] or detect_format(path)
+
+        def progress(result):
+            self.stdout.write(f'{result.imported} expenses imported, {result.skipped} credits skipped, '
+                              f'{result.errors} unreadable ({100 * result.position // max(size, 1)}%)')
+
+        job = StatementImport.objects.create(owner=owner, filename=os.path.basename(path)[:255], size=size)
+        with open(path, 'rb') as f:
+            try:
+                result = run_import(job, f, fmt, progress=progress, batch_size=options['batch_size'],
+                                    date_format=options['date_format'])
+            except ValueError as e:
+                raise CommandError(str(e))
+        for message in result.messages:
+            self.stderr.write(f'  {message}')
+        self.stdout.write(self.style.SUCCESS(f'Imported {result.imported} expenses from {path}'))
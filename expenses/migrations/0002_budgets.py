@@ -0,0 +1,66 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def limits_to_budgets(apps, schema_editor):
+    ExpenseLimit = apps.get_model('expenses', 'ExpenseLimit')
+    Budget = apps.get_model('expenses', 'Budget')
+    owners = set()
+    # The views used each owner's first limit
+    for limit in ExpenseLimit.objects.order_by('id'):
+        if limit.owner_id not in owners:
+            owners.add(limit.owner_id)
+            Budget.objects.create(owner_id=limit.owner_id, period='daily', category='',
+                                  limit=limit.daily_expense_limit)
+
+
+def budgets_to_limits(apps, schema_editor):
+    ExpenseLimit = apps.get_model('expenses', 'ExpenseLimit')
+    Budget = apps.get_model('expenses', 'Budget')
+    for budget in Budget.objects.filter(period='daily', category=''):
+        ExpenseLimit.objects.create(owner_id=budget.owner_id, daily_expense_limit=int(budget.limit))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Budget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')], max_length=10)),
+                ('category', models.CharField(blank=True, default='', max_length=266)),
+                ('limit', models.FloatField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BudgetCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField()),
+                ('spent', models.FloatField(default=0)),
+                ('budget', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counters', to='expenses.budget')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='budget',
+            constraint=models.UniqueConstraint(fields=('owner', 'period', 'category'), name='unique_budget'),
+        ),
+        migrations.AddConstraint(
+            model_name='budgetcounter',
+            constraint=models.UniqueConstraint(fields=('budget', 'period_start'), name='unique_budget_counter'),
+        ),
+        migrations.RunPython(limits_to_budgets, budgets_to_limits),
+        migrations.DeleteModel(
+            name='ExpenseLimit',
+        ),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+from personalfinance.search import fts_migration
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0002_budgets'),
+    ]
+
+    operations = [
+        fts_migration('expenses_expense', ['owner_id', 'description', 'category', 'date', 'amount']),
+    ]
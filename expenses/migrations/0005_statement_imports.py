@@ -0,0 +1,37 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0004_owner_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='running', max_length=10)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('position', models.BigIntegerField(default=0)),
+                ('imported', models.IntegerField(default=0)),
+                ('skipped', models.IntegerField(default=0)),
+                ('errors', models.IntegerField(default=0)),
+                ('messages', models.TextField(blank=True, default='')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-started'],
+                'indexes': [models.Index(fields=['owner', 'started'], name='import_owner_started_idx')],
+            },
+        ),
+    ]
@@ -1,11 +1,15 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils.timezone import now
+from summaries.rollup import RolledUp
 
 # Create your models here.
 
 
-class Expense(models.Model):
+class Expense(RolledUp, models.Model):
+    rollup_kind = 'expense'
+    rollup_label = 'category'
+
     amount = models.FloatField()
     date = models.DateField(default=now)
     description = models.TextField()
@@ -17,6 +21,14 @@ class Expense(models.Model):
 
     class Meta:
         ordering =  ['-date']
+        # Every list, search and report filters by owner first; the rowid
+        # (id) ends each index, so (date, id) and (amount, id) keyset
+        # pages are read in index order
+        indexes = [
+            models.Index(fields=['owner', 'date'], name='expense_owner_date_idx'),
+            models.Index(fields=['owner', 'category', 'date'], name='expense_owner_category_idx'),
+            models.Index(fields=['owner', 'amount'], name='expense_owner_amount_idx'),
+        ]
 
 
 class Category(models.Model):
@@ -28,6 +40,71 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
-class ExpenseLimit(models.Model):
+class Budget(models.Model):
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    MONTHLY = 'monthly'
+    PERIOD_CHOICES = [(DAILY, 'Daily'), (WEEKLY, 'Weekly'), (MONTHLY, 'Monthly')]
+
     owner = models.ForeignKey(to=User, on_delete=models.CASCADE)
-    daily_expense_limit=models.IntegerField()
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    # Blank for a limit on all categories together
+    category = models.CharField(max_length=266, blank=True, default='')
+    limit = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'period', 'category'], name='unique_budget'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_period_display()} {self.category or "total"} budget'
+
+
+class BudgetCounter(models.Model):
+    """Running total spent against a budget in one of its periods."""
+    budget = models.ForeignKey(to=Budget, on_delete=models.CASCADE, related_name='counters')
+    period_start = models.DateField()
+    spent = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['budget', 'period_start'], name='unique_budget_counter'),
+        ]
+
+
+class StatementImport(models.Model):
+    """An uploaded bank statement and how far its import has got."""
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    owner = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=RUNNING)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    # Last progress of a running import; one without progress for
+    # IMPORT_STALE_AFTER seconds has died with its worker
+    updated = models.DateTimeField(auto_now=True)
+    # File size and bytes read so far, in bytes
+    size = models.BigIntegerField(default=0)
+    position = models.BigIntegerField(default=0)
+    imported = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    errors = models.IntegerField(default=0)
+    messages = models.TextField(blank=True, default='')
+
+    class Meta:
+        ordering = ['-started']
+        indexes = [
+            models.Index(fields=['owner', 'started'], name='import_owner_started_idx'),
+        ]
+
+    def __str__(self):
+        return self.filename
+
+    @property
+    def percent(self):
+        return min(100, round(100 * self.position / self.size)) if self.size else None
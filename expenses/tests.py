@@ -1,3 +1,408 @@
-from django.test import TestCase
+import base64
+import datetime
+import json
+import os
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.db.models import Sum
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from api.classifier import get_model
+from api.events import StatementUploaded, bus
+from api.personal import get_personal_model
+from api.preprocessing import preprocess_text
+from personalfinance import search as search_module
+from personalfinance.bulk import apply_bulk_edit
+from personalfinance.testing import QueryPlanTestCase
+from summaries.rollup import rebuild, verify
+
+from .budgets import period_bounds, spent, verify_counters
+from .importing import import_uploaded_statement, upload_path
+from .models import Budget, BudgetCounter, Expense, StatementImport
+
+
+class ExpenseQueryPlanTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+        other = User.objects.create_user('bob', password='pw')
+        today = datetime.date.today()
+        for owner in (cls.user, other):
+            Expense.objects.bulk_create([
+                Expense(owner=owner, amount=i, date=today - datetime.timedelta(days=i),
+                        description=f'coffee {i}', category='food' if i % 2 else 'rent')
+                for i in range(20)
+            ])
+        # bulk_create skips the rollups
+        rebuild(Expense)
+        Budget.objects.create(owner=cls.user, period=Budget.MONTHLY, category='food', limit=100)
+        cls.expense = Expense.objects.create(owner=cls.user, amount=5, date=today,
+                                             description='bus ticket', category='transportation')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_list_pages(self):
+        for sort in ('', 'amount_asc', 'amount_desc', 'date_asc', 'date_desc'):
+            response = self.assertNoFullScans(self.client.get, f'/?sort={sort}')
+            page = response.context['page_obj']
+            self.assertNoFullScans(self.client.get, f'/?sort={sort}&after={page.next_cursor}&page=2')
+            self.assertNoFullScans(self.client.get, f'/?sort={sort}&before={page.next_cursor}&page=1')
+            self.assertNoFullScans(self.client.get, f'/?sort={sort}&last=1')
+
+    def test_tampered_cursor_falls_back_to_the_first_page(self):
+        first = self.client.get('/?sort=amount_asc').context['page_obj']
+        for raw in (b'[1, 1e400]', b'[1e400, 1]', b'[1, 100000000000000000000000]', b'{"a": 1}', b'[1]', b'x'):
+            cursor = base64.urlsafe_b64encode(raw).decode().rstrip('=')
+            for sort in ('amount_asc', 'date_desc'):
+                with self.subTest(cursor=raw, sort=sort):
+                    response = self.client.get(f'/?sort={sort}&after={cursor}&page=2')
+                    self.assertEqual(response.status_code, 200)
+                    if sort == 'amount_asc':
+                        self.assertEqual([row.pk for row in response.context['page_obj']],
+                                         [row.pk for row in first])
+
+    def test_search(self):
+        response = self.assertNoFullScans(self.client.post, '/search-expenses',
+                                          json.dumps({'searchText': 'coff', 'page': 'a', 'seq': 1}),
+                                          content_type='application/json')
+        data = response.json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertTrue(all(row['description'].startswith('coffee') for row in data['results']))
+        response = self.client.post('/search-expenses', json.dumps({'searchText': 'coff', 'cursor': data['next_cursor']}),
+                                    content_type='application/json')
+        rest = response.json()
+        self.assertEqual(len(rest['results']), 10)
+        self.assertIsNone(rest['next_cursor'])
+        coffee = set(Expense.objects.filter(owner=self.user, description__startswith='coffee').values_list('id', flat=True))
+        self.assertEqual({row['id'] for row in data['results'] + rest['results']}, coffee)
+
+    def test_search_pages_past_the_window(self):
+        coffee = set(Expense.objects.filter(owner=self.user, description__startswith='coffee').values_list('id', flat=True))
+        found, cursor = [], None
+        with mock.patch.object(search_module, 'CANDIDATES', 7):
+            while True:
+                rows, cursor = search_module.search(Expense, self.user, 'coffee', 3, cursor)
+                found += [row.pk for row in rows]
+                if cursor is None:
+                    break
+        self.assertEqual(len(found), len(coffee))
+        self.assertEqual(set(found), coffee)
+        # Each window holds newer rows than the next one
+        self.assertEqual(set(found[:7]), set(sorted(coffee)[-7:]))
+        with self.assertRaises(ValueError):
+            search_module.search(Expense, self.user, 'coffee', 3, 'x:1')
+
+    def test_search_amounts(self):
+        snack = Expense.objects.create(owner=self.user, amount=4.5, date=datetime.date.today(),
+                                       description='snack', category='food')
+
+        def found(text):
+            return {row.pk for row in search_module.search(Expense, self.user, text)[0]}
+
+        coffee_5 = Expense.objects.get(owner=self.user, description='coffee 5')
+        self.assertEqual(found('5'), {coffee_5.pk, self.expense.pk})
+        self.assertEqual(found('4.5'), {snack.pk})
+        self.assertEqual(found('4.5 snack'), {snack.pk})
+        self.assertEqual(found(coffee_5.date.isoformat()[:7] + ' coffee 5'), {coffee_5.pk})
+
+    def test_search_matches_word_prefixes_with_or_without_the_index(self):
+        def found(text):
+            return {row.pk for row in search_module.search(Expense, self.user, text)[0]}
+
+        coffee = set(Expense.objects.filter(owner=self.user, description__startswith='coffee').values_list('id', flat=True))
+        for indexed in (True, False):
+            with self.subTest(indexed=indexed), mock.patch.object(search_module, 'has_fts', return_value=indexed):
+                self.assertEqual(found('coff'), coffee)
+                self.assertEqual(found('ffee'), set())
+                self.assertEqual(found('tick'), {self.expense.pk})
+                self.assertEqual(found('icket'), set())
+                self.assertEqual(found('transp bus'), {self.expense.pk})
+
+    def test_index_without_its_triggers_is_not_used(self):
+        self.assertTrue(search_module.has_fts(Expense))
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER expenses_expense_fts_au')
+        with mock.patch.object(search_module, '_available', set()), self.assertLogs('personalfinance.search', 'WARNING'):
+            self.assertFalse(search_module.has_fts(Expense))
+            # Searches still work, through the ORM
+            self.assertEqual([row.pk for row in search_module.search(Expense, self.user, 'bus')[0]], [self.expense.pk])
+
+    def test_search_index_follows_writes(self):
+        def found(text):
+            return {row.pk for row in search_module.search(Expense, self.user, text)[0]}
+
+        today = datetime.date.today()
+        expense = Expense.objects.create(owner=self.user, amount=3, date=today,
+                                         description='parking meter', category='transportation')
+        self.assertEqual(found('parking'), {expense.pk})
+        expense.description = 'toll road'
+        expense.save()
+        self.assertEqual((found('parking'), found('toll')), (set(), {expense.pk}))
+        # Bulk writes skip the model code but not the triggers
+        Expense.objects.filter(pk=expense.pk).update(description='ferry')
+        more = Expense.objects.bulk_create([Expense(owner=self.user, amount=9, date=today,
+                                                    description='ferry back', category='transportation')])
+        self.assertEqual((found('toll'), found('ferry')), (set(), {expense.pk, more[0].pk}))
+        Expense.objects.filter(description__startswith='ferry').delete()
+        self.assertEqual(found('ferry'), set())
+        apply_bulk_edit(Expense, self.user, {'ids': [self.expense.pk], 'action': 'set_category',
+                                             'category': 'commute'})
+        self.assertEqual(found('commute'), {self.expense.pk})
+        with connection.cursor() as cursor:
+            # Raises if the index disagrees with the table
+            cursor.execute("INSERT INTO expenses_expense_fts(expenses_expense_fts, rank) VALUES ('integrity-check', 1)")
+
+    def test_search_rejects_malformed_bodies(self):
+        for body in ('[1]', '"x"', '{"searchText": "a", "limit": 1e400}', '{"seq": 1e400, "page": "x"}',
+                     '{"searchText": "a", "cursor": "99999999999999999999999:0"}', '{"searchText": "a", "cursor": "x:1"}',
+                     'not json'):
+            with self.subTest(body=body):
+                response = self.client.post('/search-expenses', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Invalid search request'})
+
+    def test_search_superseded(self):
+        def search(page, seq):
+            return self.client.post('/search-expenses', json.dumps({'searchText': 'bus', 'page': page, 'seq': seq}),
+                                    content_type='application/json')
+
+        for seq in range(1, 6):
+            self.assertEqual(search('first', seq).status_code, 200)
+        self.assertEqual(search('first', 4).status_code, 204)
+        # A reload or a second tab starts its own count
+        for seq in range(1, 4):
+            response = search('second', seq)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([row['id'] for row in response.json()['results']], [self.expense.pk])
+
+    def test_category_summary(self):
+        response = self.assertNoFullScans(self.client.get, '/expense_category_summary')
+        since = datetime.date.today() - datetime.timedelta(days=30 * 6)
+        expected = dict(Expense.objects.filter(owner=self.user, date__gte=since).values('category')
+                        .annotate(total=Sum('amount')).values_list('category', 'total'))
+        self.assertEqual(response.json()['expense_category_data'], expected)
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/expense_category_summary', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Expense.objects.create(owner=self.user, amount=3, date=datetime.date.today(),
+                               description='tea', category='food')
+        response = self.client.get('/expense_category_summary', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['expense_category_data']['food'], expected['food'] + 3)
+
+    def test_add_edit_and_delete(self):
+        today = datetime.date.today().isoformat()
+        self.assertNoFullScans(self.client.post, '/add-expense', {
+            'amount': '12', 'expense_date': today, 'description': 'lunch',
+            'category': 'food', 'initial_predicted_category': 'food',
+        })
+        self.assertNoFullScans(self.client.post, f'/edit-expense/{self.expense.pk}', {
+            'amount': '7', 'expense_date': today, 'description': 'bus ticket',
+            'category': 'food',
+        })
+        self.assertNoFullScans(self.client.get, f'/expense-delete/{self.expense.pk}')
+
+    def test_budgets(self):
+        self.assertNoFullScans(self.client.get, '/preferences/')
+        self.assertNoFullScans(self.client.post, '/set-budget/',
+                               {'period': 'weekly', 'category': '', 'limit': '50'})
+
+    def test_forecast(self):
+        # The view writes its plot into static/; keep the tracked file out of the test
+        with mock.patch('expense_forecast.views.plt.savefig') as savefig:
+            response = self.assertNoFullScans(self.client.get, '/forecast/')
+        savefig.assert_called_once()
+        self.assertEqual(len(response.context['forecast_data']), 30)
+        self.assertGreaterEqual(response.context['total_forecasted_expenses'], 0)
+        self.assertEqual(response.context['category_forecasts'],
+                         dict(Expense.objects.filter(owner=self.user).values('category')
+                              .annotate(total=Sum('amount')).values_list('category', 'total')))
+
+    def test_import(self):
+        today = datetime.date.today()
+        statement = SimpleUploadedFile('statement.csv', (
+            'Date,Description,Amount,Category\n'
+            f'{today},Coffee shop,-4.50,food\n'
+            f'{today},Taxi to the airport,-30,\n'
+            f'{today},Salary,1000,\n'
+            'yesterday,Lunch,-8,\n'
+        ).encode())
+        # The import runs inline instead of on the bus thread, so its queries are checked too
+        with mock.patch.object(bus, 'publish', bus._dispatch), self.captureOnCommitCallbacks(execute=True):
+            self.assertNoFullScans(self.client.post, '/import-expenses/upload', {'statement': statement})
+        job = StatementImport.objects.get(owner=self.user)
+        self.assertEqual((job.status, job.imported, job.skipped, job.errors), (StatementImport.DONE, 2, 1, 1))
+        self.assertIn("invalid date 'yesterday'", job.messages)
+        imported = dict(Expense.objects.filter(owner=self.user, description__in=['Coffee shop', 'Taxi to the airport'])
+                        .values_list('description', 'category'))
+        predicted = get_model().predict(preprocess_text('Taxi to the airport'))['predicted_category']
+        self.assertEqual(imported, {'Coffee shop': 'food', 'Taxi to the airport': predicted})
+        self.assertEqual(verify(Expense), [])
+        self.assertFalse(os.path.exists(upload_path(job.pk)))
+        response = self.assertNoFullScans(self.client.get, '/import-expenses/')
+        self.assertFalse(response.context['running'])
+        self.assertEqual(self.assertNoFullScans(self.client.get, '/import-expenses/progress').json(),
+                         {'running': False})
+
+    def test_stale_import(self):
+        job = StatementImport.objects.create(owner=self.user, filename='statement.csv', size=100)
+        self.assertTrue(self.client.get('/import-expenses/progress').json()['running'])
+        StatementImport.objects.filter(pk=job.pk).update(
+            updated=timezone.now() - datetime.timedelta(seconds=settings.IMPORT_STALE_AFTER + 1))
+        self.assertEqual(self.client.get('/import-expenses/progress').json(), {'running': False})
+        job.refresh_from_db()
+        self.assertEqual(job.status, StatementImport.FAILED)
+        # A queued import failed meanwhile is not started
+        import_uploaded_statement(StatementUploaded(job.pk, 'csv'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.imported), (StatementImport.FAILED, 0))
+
+    def test_bulk_edit(self):
+        today = datetime.date.today()
+        budget = Budget.objects.get(owner=self.user)
+        spent(budget, today)
+        personal = get_personal_model(self.user)
+        self.assertEqual(personal.predict(preprocess_text('coffee 7')), ('food', 1.0))
+
+        def post(body, status=200):
+            response = self.assertNoFullScans(self.client.post, '/bulk-expenses', json.dumps(body),
+                                              content_type='application/json')
+            self.assertEqual(response.status_code, status, response.content)
+            return response.json()
+
+        mine = Expense.objects.filter(owner=self.user)
+        self.assertEqual(post({'action': 'set_category', 'category': 'drinks',
+                               'filter': {'description': 'coffee', 'min_amount': 5}}), {'updated': 15})
+        self.assertEqual(mine.filter(category='drinks').count(), 15)
+        self.assertFalse(mine.filter(description__startswith='coffee', amount__gte=5).exclude(category='drinks'))
+        self.assertEqual(get_personal_model(self.user).predict(preprocess_text('coffee 7')), ('drinks', 1.0))
+
+        dates = dict(mine.filter(category='drinks').values_list('pk', 'date'))
+        self.assertEqual(post({'action': 'shift_date', 'days': -1,
+                               'filter': {'category': 'drinks', 'end_date': '2100-01-01'}}), {'updated': 15})
+        for pk, date in mine.filter(category='drinks').values_list('pk', 'date'):
+            self.assertEqual(date, dates[pk] - datetime.timedelta(days=1))
+
+        other = Expense.objects.exclude(owner=self.user).first()
+        self.assertEqual(post({'action': 'delete', 'ids': [self.expense.pk, other.pk]}), {'deleted': 1})
+        self.assertFalse(Expense.objects.filter(pk=self.expense.pk).exists())
+        self.assertTrue(Expense.objects.filter(pk=other.pk).exists())
+
+        for days in (True, 10 ** 9, -10 ** 6, 0, '3'):
+            self.assertIn('days', post({'action': 'shift_date', 'days': days, 'ids': [other.pk]}, 400)['error'])
+        self.assertIn('future', post({'action': 'shift_date', 'days': 5, 'filter': {'description': 'coffee'}},
+                                     400)['error'])
+
+        self.assertEqual(verify(Expense), [])
+        start, end = period_bounds(budget.period, today)
+        food = mine.filter(category='food', date__range=(start, end)).aggregate(total=Sum('amount'))['total']
+        self.assertAlmostEqual(spent(budget, today), food or 0)
+
+
+class BudgetCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+        cls.food = Budget.objects.create(owner=cls.user, period=Budget.MONTHLY, category='food', limit=100)
+        cls.weekly = Budget.objects.create(owner=cls.user, period=Budget.WEEKLY, limit=100)
+
+    def assertCountersMatch(self, *days):
+        for budget in (self.food, self.weekly):
+            for day in days:
+                rows = Expense.objects.filter(owner=self.user, date__range=period_bounds(budget.period, day))
+                if budget.category:
+                    rows = rows.filter(category=budget.category)
+                self.assertAlmostEqual(spent(budget, day), rows.aggregate(total=Sum('amount'))['total'] or 0,
+                                       msg=f'{budget} on {day}')
+        self.assertEqual(verify_counters(), [])
+
+    def test_counters_follow_writes(self):
+        today = datetime.date.today()
+        earlier = today - datetime.timedelta(days=40)
+        self.assertCountersMatch(today, earlier)
+        expense = Expense.objects.create(owner=self.user, amount=30, date=today, description='lunch', category='food')
+        self.assertCountersMatch(today, earlier)
+        for field, value in (('amount', 45), ('category', 'rent'), ('category', 'food'), ('date', earlier)):
+            setattr(expense, field, value)
+            expense.save()
+            self.assertCountersMatch(today, earlier)
+        expense.delete()
+        self.assertCountersMatch(today, earlier)
+
+        Expense.objects.create(owner=self.user, amount=5, date=today, description='coffee', category='food')
+        apply_bulk_edit(Expense, self.user, {'action': 'set_category', 'category': 'drinks',
+                                             'filter': {'description': 'coffee'}})
+        self.assertCountersMatch(today, earlier)
+        Expense.objects.filter(owner=self.user).delete()
+        self.assertCountersMatch(today, earlier)
+
+    def test_redefined_budget_starts_new_counters(self):
+        today = datetime.date.today()
+        Expense.objects.create(owner=self.user, amount=5, date=today, description='lunch', category='food')
+        Expense.objects.create(owner=self.user, amount=7, date=today, description='cinema', category='fun')
+        self.assertCountersMatch(today)
+        self.food.limit = 200
+        self.food.save()
+        self.assertTrue(BudgetCounter.objects.filter(budget=self.food))
+        for field, value in (('category', 'fun'), ('period', Budget.DAILY), ('category', '')):
+            setattr(self.food, field, value)
+            self.food.save()
+            self.assertFalse(BudgetCounter.objects.filter(budget=self.food))
+            self.assertCountersMatch(today)
+        self.assertEqual(spent(self.food, today), 12)
+
+        # As edited in the admin
+        admin = User.objects.create_superuser('root', password='pw')
+        self.client.force_login(admin)
+        response = self.client.post(f'/admin/expenses/budget/{self.food.pk}/change/', {
+            'owner': self.user.pk, 'period': Budget.DAILY, 'category': 'fun', 'limit': '200',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.food.refresh_from_db()
+        self.assertEqual(spent(self.food, today), 7)
+        self.assertCountersMatch(today)
+
+    def test_rebuild_counters(self):
+        today = datetime.date.today()
+        Expense.objects.create(owner=self.user, amount=5, date=today, description='lunch', category='food')
+        spent(self.food, today)
+        BudgetCounter.objects.filter(budget=self.food).update(spent=999)
+        self.assertEqual([expected for _, expected in verify_counters()], [5])
+        err = StringIO()
+        with self.assertRaisesMessage(CommandError, 'Rollup verification failed'):
+            call_command('rebuild_rollups', verify_only=True, stdout=StringIO(), stderr=err)
+        self.assertIn('1 budget counters disagree with the rollups', err.getvalue())
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(verify_counters(), [])
+        self.assertEqual(spent(self.food, today), 5)
+
+    def test_limits_must_be_finite(self):
+        self.client.force_login(self.user)
+        for limit in ('nan', 'inf', '-inf', '-1', 'abc', ''):
+            self.client.post('/set-budget/', {'period': 'daily', 'category': 'food', 'limit': limit})
+            self.client.post('/set-daily-expense-limit/', {'daily_expense_limit': limit})
+        self.assertFalse(Budget.objects.filter(owner=self.user, period=Budget.DAILY))
+        self.client.post('/set-budget/', {'period': 'daily', 'category': 'food', 'limit': '12.5'})
+        self.assertEqual(Budget.objects.get(owner=self.user, period=Budget.DAILY).limit, 12.5)
+
+class BackgroundImportTests(TransactionTestCase):
+    def test_upload_returns_before_the_import(self):
+        user = User.objects.create_user('alice', password='pw')
+        self.client.force_login(user)
+        today = datetime.date.today()
+        lines = ''.join(f'{today},Coffee {i},-{i + 1},food\n' for i in range(2500))
+        statement = SimpleUploadedFile('statement.csv', f'Date,Description,Amount,Category\n{lines}'.encode())
+        response = self.client.post('/import-expenses/upload', {'statement': statement})
+        self.assertRedirects(response, '/import-expenses/')
+        bus.drain(timeout=60)
+        job = StatementImport.objects.get()
+        self.assertEqual((job.status, job.imported, job.position), (StatementImport.DONE, 2500, job.size))
+        self.assertEqual(Expense.objects.filter(owner=user).count(), 2500)
+        self.assertEqual(verify(Expense), [])
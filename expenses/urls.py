@@ -8,12 +8,18 @@ urlpatterns = [
     path('add-expense', views.add_expense, name="add-expenses"),
     path('edit-expense/<int:id>', views.expense_edit, name="expense-edit"),
     path('expense-delete/<int:id>', views.delete_expense, name="expense-delete"),
+    path('bulk-expenses', views.bulk_expenses, name="bulk-expenses"),
     path('search-expenses', csrf_exempt(views.search_expenses),
          name="search_expenses"),
     path('expense_category_summary', views.expense_category_summary,
          name="expense_category_summary"),
     path('stats', views.stats_view,
          name="stats"),
-    path('set-daily-expense-limit/',views.set_expense_limit,name="set-daily-expense-limit")
+    path('set-daily-expense-limit/',views.set_expense_limit,name="set-daily-expense-limit"),
+    path('set-budget/', views.set_budget, name="set-budget"),
+    path('budget-delete/<int:id>', views.delete_budget, name="budget-delete"),
+    path('import-expenses/', views.import_expenses, name="import-expenses"),
+    path('import-expenses/upload', views.upload_statement, name="upload-statement"),
+    path('import-expenses/progress', views.import_progress, name="import-progress"),
 
 ]
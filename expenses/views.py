@@ -1,112 +1,49 @@
 from django.shortcuts import render, redirect,HttpResponseRedirect
 from django.contrib.auth.decorators import login_required
-from .models import Category, Expense
+from django.views.decorators.http import require_POST
+from .models import Expense
 from django.contrib import messages
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator
-import json
 from django.http import JsonResponse
-from userpreferences.models import UserPreference
+from django.db import transaction
 import datetime
-import requests
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from django.contrib.sessions.models import Session
 from datetime import date
-from sklearn.ensemble import RandomForestClassifier
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-import nltk
-from .models import ExpenseLimit
+from .models import Budget, StatementImport
+from .budgets import daily_limit_budget, exceeded_budgets, parse_limit
+from .importing import FORMATS, detect_format, fail_stale_imports, queue_import
 from django.core.mail import send_mail
 from django.conf import settings
 import os
-
-# Global variables for ML model (loaded lazily)
-_model = None
-_tfidf_vectorizer = None
-
-def get_trained_model():
-    """Load and train the ML model only when needed"""
-    global _model, _tfidf_vectorizer
-    
-    if _model is not None:
-        return _model, _tfidf_vectorizer
-    
-    try:
-        # Check if dataset exists
-        dataset_path = os.path.join(settings.BASE_DIR, 'dataset.csv')
-        if not os.path.exists(dataset_path):
-            return None, None
-            
-        data = pd.read_csv(dataset_path)
-        
-        # Preprocessing
-        stop_words = set(stopwords.words('english'))
-
-        def preprocess_text(text):
-            tokens = word_tokenize(str(text).lower())
-            tokens = [t for t in tokens if t.isalnum() and t not in stop_words]
-            return ' '.join(tokens)
-
-        data['clean_description'] = data['description'].apply(preprocess_text)
-
-        # Feature extraction
-        _tfidf_vectorizer = TfidfVectorizer()
-        X = _tfidf_vectorizer.fit_transform(data['clean_description'])
-
-        # Train a RandomForestClassifier
-        _model = RandomForestClassifier()
-        _model.fit(X, data['category'])
-        
-        return _model, _tfidf_vectorizer
-    except Exception as e:
-        print(f"Error loading ML model: {e}")
-        return None, None
+from api.cache import predict_with_cache
+from api.classifier import CorpusError, get_model
+from api.events import CategoryCorrected, bus
+from api.preprocessing import preprocess_text
+from personalfinance import reference
+from personalfinance.admission import admission_control
+from personalfinance.pagination import keyset_page
+from personalfinance.bulk import bulk_edit
+from personalfinance.search import typeahead
+from summaries.aggregation import row_count, summarize
+from summaries.cache import cached, conditional_on_data
 
 @login_required(login_url='/authentication/login')
 def search_expenses(request):
     if request.method == 'POST':
-        search_str = json.loads(request.body).get('searchText')
-        expenses = Expense.objects.filter(
-            amount__istartswith=search_str, owner=request.user) | Expense.objects.filter(
-            date__istartswith=search_str, owner=request.user) | Expense.objects.filter(
-            description__icontains=search_str, owner=request.user) | Expense.objects.filter(
-            category__icontains=search_str, owner=request.user)
-        data = expenses.values()
-        return JsonResponse(list(data), safe=False)
+        return typeahead(request, Expense, ['id', 'amount', 'category', 'description', 'date'])
+    return JsonResponse({'results': [], 'next_cursor': None, 'seq': None})
 
 
 @login_required(login_url='/authentication/login')
 def index(request):
-    categories = Category.objects.all()
     expenses = Expense.objects.filter(owner=request.user)
 
     sort_order = request.GET.get('sort')
-
-    if sort_order == 'amount_asc':
-        expenses = expenses.order_by('amount')
-    elif sort_order == 'amount_desc':
-        expenses = expenses.order_by('-amount')
-    elif sort_order == 'date_asc':
-        expenses = expenses.order_by('date')
-    elif sort_order == 'date_desc':
-        expenses = expenses.order_by('-date')
-
-    paginator = Paginator(expenses, 5)
-    page_number = request.GET.get('page')
-    page_obj = Paginator.get_page(paginator, page_number)
-    try:
-        currency = UserPreference.objects.get(user=request.user).currency
-    except:
-        currency=None
-
-    total = page_obj.paginator.num_pages
+    page_obj = keyset_page(expenses, request.GET, 5,
+                           total=lambda: row_count(request.user, 'expense'))
     context = {
-        'expenses': expenses,
         'page_obj': page_obj,
-        'currency': currency,
-        'total': total,
+        'currency': request.user_settings.currency,
+        'total': page_obj.num_pages,
         'sort_order': sort_order,
 
     }
@@ -116,9 +53,8 @@ daily_expense_amounts = {}
 
 @login_required(login_url='/authentication/login')
 def add_expense(request):
-    categories = Category.objects.all()
     context = {
-        'categories': categories,
+        'categories': reference.categories(),
         'values': request.POST
     }
     if request.method == 'GET':
@@ -141,12 +77,8 @@ def add_expense(request):
 
         initial_predicted_category = request.POST.get('initial_predicted_category')
         if predicted_category != initial_predicted_category:
-            new_data = {
-                'description': description,
-                'category': predicted_category,
-            }
-            update_url = 'http://127.0.0.1:8000/api/update-dataset/'
-            response = requests.post(update_url, json={'new_data': new_data})
+            # Learned in the background; the form submit does not wait for it
+            bus.publish(CategoryCorrected(description, predicted_category))
 
         try:
             date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
@@ -156,16 +88,12 @@ def add_expense(request):
                 messages.error(request, 'Date cannot be in the future')
                 return render(request, 'expenses/add_expense.html', context)
             
-            user = request.user
-            expense_limits = ExpenseLimit.objects.filter(owner=user)
-            if expense_limits.exists():
-                daily_expense_limit = expense_limits.first().daily_expense_limit
-            else:
-                daily_expense_limit = 5000  # Default value if no limit is set
-
-            total_expenses_today = get_expense_of_day(user) + float(amount)
-            if total_expenses_today > daily_expense_limit:
-                messages.warning(request, 'Your expenses for today exceed your daily expense limit')
+            budgets = request.user_settings.applicable_budgets(predicted_category)
+            for budget, total in exceeded_budgets(budgets, date, float(amount)):
+                if budget.period == Budget.DAILY and not budget.category:
+                    messages.warning(request, 'Your expenses for today exceed your daily expense limit')
+                else:
+                    messages.warning(request, f'This expense takes your {budget} to {total:g} of {budget.limit:g}')
 
             Expense.objects.create(owner=request.user, amount=amount, date=date,
                                    category=predicted_category, description=description)
@@ -179,11 +107,10 @@ def add_expense(request):
 @login_required(login_url='/authentication/login')
 def expense_edit(request, id):
     expense = Expense.objects.get(pk=id)
-    categories = Category.objects.all()
     context = {
         'expense': expense,
         'values': expense,
-        'categories': categories
+        'categories': reference.categories()
     }
     if request.method == 'GET':
         return render(request, 'expenses/edit-expense.html', context)
@@ -233,70 +160,109 @@ def delete_expense(request, id):
     return redirect('expenses')
 
 @login_required(login_url='/authentication/login')
+@conditional_on_data
 def expense_category_summary(request):
     todays_date = datetime.date.today()
     six_months_ago = todays_date-datetime.timedelta(days=30*6)
-    expenses = Expense.objects.filter(owner=request.user,
-                                      date__gte=six_months_ago, date__lte=todays_date)
-    finalrep = {}
-
-    def get_category(expense):
-        return expense.category
-    category_list = list(set(map(get_category, expenses)))
-
-    def get_expense_category_amount(category):
-        amount = 0
-        filtered_by_category = expenses.filter(category=category)
-
-        for item in filtered_by_category:
-            amount += item.amount
-        return amount
-
-    for x in expenses:
-        for y in category_list:
-            finalrep[y] = get_expense_category_amount(y)
-
+    finalrep = cached(request.user, 'expense_category_summary', [todays_date],
+                      lambda: summarize(request.user, 'expense', 'category', six_months_ago, todays_date))
     return JsonResponse({'expense_category_data': finalrep}, safe=False)
 
 @login_required(login_url='/authentication/login')
 def stats_view(request):
     return render(request, 'expenses/stats.html')
 
-@login_required(login_url='/authentication/login')
 def predict_category(description):
-    predict_category_url = 'http://localhost:8000/api/predict-category/' 
-    data = {'description': description}
-    response = requests.post(predict_category_url, data=data)
-
-    if response.status_code == 200:
-        # Get the predicted category from the response
-        predicted_category = response.json().get('predicted_category')
-        return predicted_category
-    else:
-        # Handle the case where the prediction request failed
+    try:
+        model = get_model()
+    except CorpusError:
         return None
+    prediction = predict_with_cache(model, [preprocess_text(description)])[0]
+    return prediction['predicted_category']
     
 
+@login_required(login_url='/authentication/login')
 def set_expense_limit(request):
     if request.method == "POST":
-        daily_expense_limit = request.POST.get('daily_expense_limit')
-        
-        existing_limit = ExpenseLimit.objects.filter(owner=request.user).first()
-        
-        if existing_limit:
-            existing_limit.daily_expense_limit = daily_expense_limit
-            existing_limit.save()
+        limit = parse_limit(request.POST.get('daily_expense_limit'))
+        if limit is None:
+            messages.error(request, 'Enter a daily expense limit')
         else:
-            ExpenseLimit.objects.create(owner=request.user, daily_expense_limit=daily_expense_limit)
-        
-        messages.success(request, "Daily Expense Limit Updated Successfully!")
-        return HttpResponseRedirect('/preferences/')
-    else:
-        return HttpResponseRedirect('/preferences/')
-    
-def get_expense_of_day(user):
-    current_date=date.today()
-    expenses=Expense.objects.filter(owner=user,date=current_date)
-    total_expenses=sum(expense.amount for expense in expenses)
-    return total_expenses
-    
\ No newline at end of file
+            budget = daily_limit_budget(request.user)
+            budget.limit = limit
+            budget.save()
+            messages.success(request, "Daily Expense Limit Updated Successfully!")
+    return HttpResponseRedirect('/preferences/')
+
+
+@login_required(login_url='/authentication/login')
+def set_budget(request):
+    if request.method == "POST":
+        period = request.POST.get('period')
+        limit = parse_limit(request.POST.get('limit'))
+        if period not in dict(Budget.PERIOD_CHOICES) or limit is None:
+            messages.error(request, 'Choose a period and enter a limit')
+        else:
+            Budget.objects.update_or_create(
+                owner=request.user, period=period, category=request.POST.get('category', ''),
+                defaults={'limit': limit},
+            )
+            messages.success(request, 'Budget saved successfully')
+    return HttpResponseRedirect('/preferences/')
+
+
+@login_required(login_url='/authentication/login')
+def delete_budget(request, id):
+    if request.method == "POST":
+        Budget.objects.filter(pk=id, owner=request.user).delete()
+        messages.success(request, 'Budget removed')
+    return HttpResponseRedirect('/preferences/')
+
+
+@login_required(login_url='/authentication/login')
+def import_expenses(request):
+    fail_stale_imports(request.user)
+    imports = StatementImport.objects.filter(owner=request.user)[:10]
+    running = any(job.status == StatementImport.RUNNING for job in imports)
+    return render(request, 'expenses/import_expenses.html', {'imports': imports, 'running': running})
+
+
+@login_required(login_url='/authentication/login')
+@admission_control('import')
+def upload_statement(request):
+    if request.method == "POST":
+        upload = request.FILES.get('statement')
+        if upload is None:
+            messages.error(request, 'Choose a statement file to import')
+            return redirect('import-expenses')
+        fmt = request.POST.get('format') or detect_format(upload.name)
+        if fmt not in FORMATS:
+            messages.error(request, 'Unknown statement format')
+            return redirect('import-expenses')
+
+        with transaction.atomic():
+            job = StatementImport.objects.create(owner=request.user, filename=upload.name[:255],
+                                                 size=upload.size)
+            queue_import(job, upload, fmt, request.POST.get('date_format') or None)
+        messages.success(request, f'Importing {upload.name}; the expenses appear as they are read')
+    return redirect('import-expenses')
+
+
+@login_required(login_url='/authentication/login')
+def import_progress(request):
+    fail_stale_imports(request.user)
+    job = StatementImport.objects.filter(owner=request.user, status=StatementImport.RUNNING).first()
+    if job is None:
+        return JsonResponse({'running': False})
+    return JsonResponse({
+        'running': True,
+        'filename': job.filename,
+        'imported': job.imported,
+        'percent': job.percent,
+    })
+
+
+@login_required(login_url='/authentication/login')
+@require_POST
+def bulk_expenses(request):
+    return bulk_edit(request, Expense)
@@ -0,0 +1,29 @@
+"""
+Gunicorn settings, read automatically from the working directory.
+
+The app and the category model are loaded once in the master process and
+shared copy-on-write by the forked workers, instead of every worker
+loading its own copy.
+
+A model published later by a background retrain is loaded by each worker
+on its own: its memory-mapped arrays are shared, but every worker holds a
+private copy of the forest until the server is restarted and the master
+preloads the new artifact.
+"""
+import gc
+
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before workers fork
+    from api.classifier import get_model
+    from api.preprocessing import preprocess_text
+
+    try:
+        # One prediction also initialises everything the predict path imports lazily
+        get_model().predict(preprocess_text('warm up'))
+    except Exception:
+        server.log.exception('Could not preload the category model')
+    # Keep the garbage collector from writing to (and so un-sharing) these objects
+    gc.freeze()
@@ -0,0 +1,153 @@
+"""
+Admission control for CPU-heavy views.
+
+Each endpoint class (see ADMISSION_CONTROL in settings) has a fixed number
+of concurrent slots shared by every worker process, plus a bounded number
+of requests allowed to wait for one. Anything beyond that is turned away
+at once with 503 and Retry-After, so a handful of slow requests cannot
+tie up all the workers that the cheap pages need.
+
+Slots and waiting places are flock()ed files in ADMISSION_LOCK_DIR, which
+the kernel releases if a worker dies. Without fcntl (Windows) the limits
+apply per process instead.
+"""
+import functools
+import logging
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {'concurrency': 2, 'queue': 4, 'timeout': 5}
+
+
+class _FileSlots:
+    """A fixed set of slots, each an exclusively flock()ed file."""
+
+    def __init__(self, directory, name, size):
+        self.paths = [os.path.join(directory, f'{name}.{i}.lock') for i in range(size)]
+
+    def try_acquire(self):
+        """Return an open descriptor holding a free slot, or None."""
+        for path in self.paths:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return fd
+        return None
+
+    def release(self, fd):
+        # Closing the descriptor drops the lock
+        os.close(fd)
+
+
+class _ThreadSlots:
+    def __init__(self, size):
+        self.semaphore = threading.BoundedSemaphore(size)
+
+    def try_acquire(self):
+        return True if self.semaphore.acquire(blocking=False) else None
+
+    def release(self, token):
+        self.semaphore.release()
+
+
+class Limiter:
+    def __init__(self, name, concurrency, queue, timeout, lock_dir=None):
+        self.name = name
+        self.timeout = timeout
+        if fcntl is not None and lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+            self.slots = _FileSlots(lock_dir, f'{name}.slot', concurrency)
+            self.waiting = _FileSlots(lock_dir, f'{name}.queue', queue)
+        else:
+            self.slots = _ThreadSlots(concurrency)
+            self.waiting = _ThreadSlots(queue)
+
+    def acquire(self):
+        """
+        Return a slot token, or None if the queue is full or no slot freed
+        up within the timeout.
+        """
+        slot = self.slots.try_acquire()
+        if slot is not None:
+            return slot
+        place = self.waiting.try_acquire()
+        if place is None:
+            return None
+        try:
+            # Poll with backoff; flock() has no timed wait
+            deadline = time.monotonic() + self.timeout
+            delay = 0.005
+            while time.monotonic() < deadline:
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+                slot = self.slots.try_acquire()
+                if slot is not None:
+                    return slot
+            return None
+        finally:
+            self.waiting.release(place)
+
+    def release(self, slot):
+        self.slots.release(slot)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limits = dict(DEFAULT_LIMITS, **getattr(settings, 'ADMISSION_CONTROL', {}).get(name, {}))
+            limiter = Limiter(name, limits['concurrency'], limits['queue'], limits['timeout'],
+                              getattr(settings, 'ADMISSION_LOCK_DIR', None))
+            _limiters[name] = limiter
+        return limiter
+
+
+def busy_response(request, retry_after):
+    message = 'The server is busy, please try again shortly.'
+    if 'text/html' in request.headers.get('Accept', ''):
+        response = HttpResponse(message, status=503, content_type='text/plain')
+    else:
+        response = JsonResponse({'error': message}, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def admission_control(name):
+    """
+    Limit a view to the concurrency of the named endpoint class.
+
+    Use method_decorator() for class-based views.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            limiter = get_limiter(name)
+            slot = limiter.acquire()
+            if slot is None:
+                logger.warning('Rejected %s request to %s: over capacity', name, request.path)
+                return busy_response(request, max(1, math.ceil(limiter.timeout)))
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                limiter.release(slot)
+        return wrapper
+    return decorator
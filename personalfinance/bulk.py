@@ -0,0 +1,149 @@
+"""
+Bulk edits of expenses and incomes.
+
+An operation (set the category or source, shift the date, or delete) is
+applied to the user's rows picked by id or by a filter, with a single
+UPDATE or DELETE scoped to the owner. The rollups move by the same
+amounts in the same transaction, using deltas from one GROUP BY over the
+selected rows, so editing 10k rows costs a handful of statements. The
+budget counters, data versions and per-user category models follow the
+rollups (through the rollups_changed receivers), and the full-text index
+follows the table through its triggers.
+"""
+import datetime
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.http import JsonResponse
+
+from summaries.rollup import add_totals
+
+# Largest date shift, in days, in either direction
+MAX_SHIFT_DAYS = 36500
+
+
+class BulkEditError(ValueError):
+    """The bulk edit request is malformed."""
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.date.fromisoformat(str(value))
+    except ValueError:
+        raise BulkEditError(f'{name} must be a YYYY-MM-DD date')
+
+
+def _parse_amount(value, name):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise BulkEditError(f'{name} must be a number')
+
+
+def select_rows(model, owner, body):
+    """The owner's rows picked by the request's ids or filter."""
+    rows = model.objects.filter(owner=owner)
+    ids, conditions = body.get('ids'), body.get('filter')
+    if ids is not None:
+        max_ids = getattr(settings, 'BULK_EDIT_MAX_IDS', 10000)
+        if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+            raise BulkEditError('ids must be a list of integers')
+        if len(ids) > max_ids:
+            raise BulkEditError(f'At most {max_ids} ids per request; use a filter for more')
+        return rows.filter(pk__in=ids)
+    if not isinstance(conditions, dict) or not conditions:
+        raise BulkEditError('Give ids or a filter')
+
+    label = model.rollup_label
+    lookups = {
+        label: lambda value: {label: str(value)},
+        'description': lambda value: {'description__icontains': str(value)},
+        'start_date': lambda value: {'date__gte': _parse_date(value, 'start_date')},
+        'end_date': lambda value: {'date__lte': _parse_date(value, 'end_date')},
+        'min_amount': lambda value: {'amount__gte': _parse_amount(value, 'min_amount')},
+        'max_amount': lambda value: {'amount__lte': _parse_amount(value, 'max_amount')},
+    }
+    unknown = set(conditions) - set(lookups)
+    if unknown:
+        raise BulkEditError(f'Unknown filter {", ".join(sorted(unknown))}; '
+                            f'expected {", ".join(lookups)}')
+    for name, value in conditions.items():
+        rows = rows.filter(**lookups[name](value))
+    return rows
+
+
+def apply_bulk_edit(model, owner, body):
+    """Run the operation in body on the owner's rows; returns (verb, rows affected)."""
+    label = model.rollup_label
+    action = body.get('action')
+    new_label, days = None, 0
+    if action == f'set_{label}':
+        new_label = ' '.join(str(body.get(label) or '').split())
+        if not new_label:
+            raise BulkEditError(f'{label} is required')
+    elif action == 'shift_date':
+        days = body.get('days')
+        if isinstance(days, bool) or not isinstance(days, int) or not days:
+            raise BulkEditError('days must be a non-zero integer')
+        if abs(days) > MAX_SHIFT_DAYS:
+            raise BulkEditError(f'days must be between -{MAX_SHIFT_DAYS} and {MAX_SHIFT_DAYS}')
+    elif action != 'delete':
+        raise BulkEditError(f'Unknown action {action!r}; expected set_{label}, shift_date or delete')
+    shift = datetime.timedelta(days=days)
+
+    rows = select_rows(model, owner, body)
+    with transaction.atomic():
+        groups = list(rows.order_by().values('date', label).annotate(total=Sum('amount'), count=Count('id')))
+        if days and groups:
+            try:
+                latest = max(group['date'] for group in groups) + shift
+                min(group['date'] for group in groups) + shift
+            except OverflowError:
+                raise BulkEditError('The dates cannot be moved that far')
+            if latest > datetime.date.today():
+                raise BulkEditError('The dates cannot be moved into the future')
+
+        totals = defaultdict(lambda: [0.0, 0])
+        for group in groups:
+            old = totals[owner.pk, group['date'], group[label]]
+            old[0] -= group['total']
+            old[1] -= group['count']
+            if action != 'delete':
+                new = totals[owner.pk, group['date'] + shift, new_label or group[label]]
+                new[0] += group['total']
+                new[1] += group['count']
+
+        if action == 'delete':
+            # Nothing references these rows, and the rollups are moved
+            # below, so they are deleted with one statement instead of
+            # being fetched for the per-row post_delete receivers
+            affected = rows._raw_delete(rows.db)
+        elif new_label:
+            affected = rows.update(**{label: new_label})
+        else:
+            affected = rows.update(date=F('date') + shift)
+        add_totals(model.rollup_kind, {key: delta for key, delta in totals.items() if delta != [0.0, 0]})
+    return ('deleted' if action == 'delete' else 'updated'), affected
+
+
+def bulk_edit(request, model):
+    """
+    JSON endpoint for bulk edits. The request body holds:
+
+    - action: set_category (expenses) or set_source (incomes), with the
+      new value under that name; shift_date, with a number of days; or delete
+    - ids: a list of row ids, or filter: an object with any of the category
+      or source, description (a substring), start_date, end_date,
+      min_amount and max_amount
+    """
+    try:
+        body = json.loads(request.body or b'{}')
+        if not isinstance(body, dict):
+            raise BulkEditError('Expected a JSON object')
+        verb, affected = apply_bulk_edit(model, request.user, body)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({verb: affected})
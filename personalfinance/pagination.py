@@ -0,0 +1,132 @@
+"""
+Keyset (cursor) pagination for the expense and income lists.
+
+A page is fetched with a WHERE on the sort key of the row just before or
+after it, instead of an OFFSET, so every page costs the same as the first
+and no COUNT(*) is needed. Rows are ordered by the sort field and then by
+id, which makes the key unique.
+"""
+import base64
+import datetime
+import json
+import math
+
+from django.db.models import Q
+
+# sort parameter -> (field, descending)
+SORT_ORDERS = {
+    'amount_asc': ('amount', False),
+    'amount_desc': ('amount', True),
+    'date_asc': ('date', False),
+    'date_desc': ('date', True),
+}
+DEFAULT_SORT = 'date_desc'
+
+
+def encode_cursor(field, row):
+    value = getattr(row, field)
+    if isinstance(value, datetime.date):
+        value = value.isoformat()
+    raw = json.dumps([value, row.pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(field, cursor):
+    """Return (value, id), or None for a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        if field == 'date':
+            value = datetime.date.fromisoformat(value)
+        else:
+            value = float(value)
+            if not math.isfinite(value):
+                return None
+        pk = int(pk)
+        # Beyond SQLite's integer range the query itself would fail
+        if not -2 ** 63 <= pk < 2 ** 63:
+            return None
+        return value, pk
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, rows, field, number, has_previous, has_next, total=None, per_page=None):
+        self.object_list = rows
+        self.field = field
+        self.number = number
+        self.has_previous = has_previous
+        self.has_next = has_next
+        self.total = total
+        self.num_pages = max(1, -(-total // per_page)) if total is not None else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.field, self.object_list[0]) if self.object_list else None
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.field, self.object_list[-1]) if self.object_list else None
+
+    @property
+    def previous_page_number(self):
+        return max(self.number - 1, 1)
+
+    @property
+    def next_page_number(self):
+        return self.number + 1
+
+
+def keyset_page(queryset, params, per_page, total=None):
+    """
+    Return the KeysetPage of queryset selected by the request's GET params:
+    sort (see SORT_ORDERS), after or before (a cursor from the neighbouring
+    page), last (any value, for the final page) and page (the page number
+    to display). total, if given, is a callable returning the (possibly
+    approximate) row count, used only to display the number of pages.
+    """
+    sort = params.get('sort') if params.get('sort') in SORT_ORDERS else DEFAULT_SORT
+    field, descending = SORT_ORDERS[sort]
+    try:
+        number = max(int(params.get('page', 1)), 1)
+    except ValueError:
+        number = 1
+    count = total() if total is not None else None
+
+    after = decode_cursor(field, params['after']) if params.get('after') else None
+    before = decode_cursor(field, params['before']) if params.get('before') else None
+    last = bool(params.get('last'))
+    # Walking backwards (previous or last page) reverses the order and the comparison
+    backwards = before is not None or (last and after is None)
+    reverse = descending != backwards
+    order = ['-' + field, '-pk'] if reverse else [field, 'pk']
+
+    rows = queryset.order_by(*order)
+    key = after or before
+    if key is not None:
+        value, pk = key
+        op = 'lt' if reverse else 'gt'
+        rows = rows.filter(Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'pk__{op}': pk}))
+
+    size = per_page
+    if last and backwards and count:
+        # Line the last page up with the pages reached by walking forwards
+        size = count % per_page or per_page
+        number = -(-count // per_page)
+    # One extra row tells whether there is another page in this direction
+    fetched = list(rows[:size + 1])
+    more = len(fetched) > size
+    fetched = fetched[:size]
+    if backwards:
+        fetched.reverse()
+        return KeysetPage(fetched, field, number, has_previous=more,
+                          has_next=before is not None, total=count, per_page=per_page)
+    return KeysetPage(fetched, field, number, has_previous=after is not None,
+                      has_next=more, total=count, per_page=per_page)
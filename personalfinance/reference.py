@@ -0,0 +1,93 @@
+"""
+Process-wide registry of reference data: expense categories and currencies.
+
+Both are loaded on first use and then served from memory, so a request
+costs no query and no file read. Each access only stats two files: the
+currencies.json list and a marker file. handlers.py replaces the marker
+whenever a Category is saved or deleted (after the transaction commits),
+so every worker process reloads on its next access.
+"""
+import json
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+
+
+class ReferenceData:
+    def __init__(self, categories, currencies):
+        # Category instances, in id order, for templates
+        self.categories = tuple(categories)
+        # Currency code -> name, in file order
+        self.currencies = dict(currencies)
+        # Options of the preferences form; the stored preference is "CODE - Name"
+        self.currency_choices = tuple({'name': code, 'value': name} for code, name in self.currencies.items())
+
+
+def currencies_path():
+    return getattr(settings, 'CURRENCIES_PATH', os.path.join(settings.BASE_DIR, 'currencies.json'))
+
+
+def marker_path():
+    return getattr(settings, 'REFERENCE_DATA_MARKER',
+                   os.path.join(settings.BASE_DIR, 'run', 'reference-data.marker'))
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def load():
+    from expenses.models import Category
+
+    with open(currencies_path(), encoding='utf-8') as f:
+        currencies = json.load(f)
+    return ReferenceData(Category.objects.order_by('id'), currencies.items())
+
+
+_lock = threading.Lock()
+_data = None
+_stamp = None
+
+
+def get_reference_data():
+    global _data, _stamp
+    stamp = (_file_stamp(marker_path()), _file_stamp(currencies_path()))
+    if _data is not None and stamp == _stamp:
+        return _data
+    with _lock:
+        if _data is None or stamp != _stamp:
+            _data = load()
+            _stamp = stamp
+    return _data
+
+
+def invalidate():
+    """Make every process reload the reference data on its next access."""
+    global _data
+    path = marker_path()
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # A new file (and inode) on every call, so the stamp always changes
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    os.replace(tmp_path, path)
+    _data = None
+
+
+def categories():
+    return get_reference_data().categories
+
+
+def currency_choices():
+    return get_reference_data().currency_choices
+
+
+def currency_name(code):
+    """Name of the currency with this ISO code, or None."""
+    return get_reference_data().currencies.get(code)
@@ -0,0 +1,282 @@
+"""
+Full-text search over expenses and incomes.
+
+On SQLite each searchable table has an FTS5 index, created by the
+expenses and userincome migrations with fts_migration(). It is an
+external-content index: triggers on the table keep it in sync with every
+insert, update and delete, including bulk writes that skip model code.
+Every search term is matched as a prefix of a word of the description
+or the category or source, or as a prefix of the date or the amount, so
+"5" finds 5 and 50 but not 4.5. The owner is a column of the index too,
+so a search only walks that user's postings. Matches are ranked by bm25
+in windows of the CANDIDATES most recent ones; paging goes on into the
+older windows by rowid, so every match can be reached.
+
+Other databases, and SQLite builds without FTS5 or with the index's
+triggers missing, fall back to ORM filters. They match the same word
+prefixes, with two differences: a word there only starts after a space,
+not after punctuation, and diacritics are not folded.
+"""
+import json
+import logging
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connections, migrations, router
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+
+logger = logging.getLogger(__name__)
+
+# bm25 weights by column: a hit in the description counts most
+WEIGHTS = {'owner_id': 0.0, 'description': 10.0, 'label': 5.0, 'date': 1.0, 'amount': 1.0}
+
+# Matches ranked together: each window is the next CANDIDATES most recent
+CANDIDATES = 1000
+
+_available = set()
+
+
+def fts_table(table):
+    return f'{table}_fts'
+
+
+def search_columns(model):
+    """Columns of the model's index, in order; the label is its category or source."""
+    return ['owner_id', 'description', model.rollup_label, 'date', 'amount']
+
+
+def fts_statements(table, columns):
+    fts = fts_table(table)
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+        # Index the rows that already exist
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def fts_migration(table, columns):
+    """
+    A migration operation creating the FTS5 index, or doing nothing where unsupported.
+
+    The triggers are raw SQL that Django's schema editor does not know
+    about: a later migration that makes SQLite rebuild the table (most
+    AlterFields do) drops them silently. has_fts() then turns the index
+    off; such a migration must run fts_statements() again.
+    """
+    fts = fts_table(table)
+
+    def forwards(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        try:
+            for statement in fts_statements(table, columns):
+                schema_editor.execute(statement)
+        except OperationalError as e:
+            # SQLite compiled without FTS5; searches fall back to the ORM
+            logger.warning('Full-text index %s not created: %s', fts, e)
+            for suffix in ('_ai', '_ad', '_au'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS {fts}{suffix}')
+            schema_editor.execute(f'DROP TABLE IF EXISTS {fts}')
+
+    def backwards(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for suffix in ('_ai', '_ad', '_au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {fts}{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {fts}')
+
+    return migrations.RunPython(forwards, backwards)
+
+
+def has_fts(model):
+    """Whether the model's index exists, with the triggers keeping it in sync."""
+    alias = router.db_for_read(model)
+    table = fts_table(model._meta.db_table)
+    if (alias, table) in _available:
+        return True
+    connection = connections[alias]
+    if connection.vendor != 'sqlite':
+        return False
+    triggers = {f'{table}{suffix}' for suffix in ('_ai', '_ad', '_au')}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT type, name FROM sqlite_master WHERE (type = 'table' AND name = %s) "
+            "OR (type = 'trigger' AND name IN (%s, %s, %s))", [table, *sorted(triggers)])
+        found = cursor.fetchall()
+    if not found:
+        return False
+    if {name for kind, name in found if kind == 'trigger'} != triggers:
+        # The table was rebuilt without them (see fts_migration); the index is stale
+        logger.warning('Full-text index %s has lost its triggers; searching without it', table)
+        return False
+    _available.add((alias, table))
+    return True
+
+
+def match_expression(model, owner_id, terms):
+    """
+    FTS5 query: the owner's rows where every term prefixes a word of the
+    text columns, or the whole date or amount.
+    """
+    text = ' '.join(search_columns(model)[1:3])
+    conditions = []
+    for term in terms:
+        quoted = '"{}"*'.format(term.replace('"', '""'))
+        # The tokenizer splits 4.5 and 2024-03-05 into words; ^ anchors
+        # the term at the first one, like the fallback's startswith
+        conditions.append(f'({{{text}}} : {quoted} OR date : ^{quoted} OR amount : ^{quoted})')
+    return f'owner_id : "{int(owner_id)}" AND ' + ' AND '.join(conditions)
+
+
+def ranked_matches(model, owner_id, terms, before=None):
+    """
+    The owner's rows matching all terms, best first within each window, as
+    (id, window, position) where window is the rowid the window was read
+    below (None for the newest) and position the row's rank in it.
+
+    Only CANDIDATES matches are ranked at a time, so a term that matches
+    most of a long history costs no more than a rare one until the caller
+    asks for more. (window, position) resumes the ranking at that row.
+    """
+    fts = fts_table(model._meta.db_table)
+    weights = ', '.join(str(WEIGHTS['label' if c == model.rollup_label else c])
+                        for c in search_columns(model))
+    match = match_expression(model, owner_id, terms)
+    while True:
+        sql = f'SELECT rowid, bm25({fts}, {weights}) FROM {fts} WHERE {fts} MATCH %s'
+        params = [match]
+        if before is not None:
+            sql += ' AND rowid < %s'
+            params.append(before)
+        sql += ' ORDER BY rowid DESC LIMIT %s'
+        params.append(CANDIDATES)
+        with connections[router.db_for_read(model)].cursor() as cursor:
+            cursor.execute(sql, params)
+            window = cursor.fetchall()
+        window.sort(key=lambda row: (row[1], -row[0]))
+        for position, (pk, _) in enumerate(window):
+            yield pk, before, position
+        if len(window) < CANDIDATES:
+            return
+        before = min(pk for pk, _ in window)
+
+
+def fallback_filter(model, terms):
+    """Every term prefixes a word of the text columns, or the whole date or amount."""
+    label = model.rollup_label
+    condition = Q()
+    for term in terms:
+        condition &= (
+            Q(description__istartswith=term)
+            | Q(description__icontains=' ' + term)
+            | Q(**{f'{label}__istartswith': term})
+            | Q(**{f'{label}__icontains': ' ' + term})
+            | Q(date__startswith=term)
+            | Q(amount__startswith=term)
+        )
+    return condition
+
+
+def search(model, owner, text, limit=None, cursor=None, fields=None):
+    """
+    The owner's rows matching every word of text, most relevant first, and
+    the cursor of the next page (None on the last one).
+
+    cursor is the next cursor of the previous page. With fields, rows are
+    returned as dicts of just those fields. Raises ValueError for a
+    malformed cursor.
+    """
+    terms = text.split()
+    if not terms:
+        return [], None
+    rows = model.objects.filter(owner=owner)
+    if not has_fts(model):
+        offset = max(int(cursor or 0), 0)
+        rows = rows.filter(fallback_filter(model, terms))
+        if fields:
+            rows = rows.values(*fields)
+        end = None if limit is None else offset + limit + 1
+        rows = list(rows[offset:end])
+        if limit is None or len(rows) <= limit:
+            return rows, None
+        return rows[:limit], str(offset + limit)
+
+    # The cursor is the window and position of the next page's first row
+    before, _, position = (cursor or '').rpartition(':')
+    before = int(before) if before else None
+    position = max(int(position or 0), 0)
+    matches = ranked_matches(model, owner.pk, terms, before)
+    end = None if limit is None else position + limit + 1
+    page = list(islice(matches, position, end))
+    next_cursor = None
+    if limit is not None and len(page) > limit:
+        _, window, position = page[limit]
+        next_cursor = f'{"" if window is None else window}:{position}'
+        page = page[:limit]
+    ids = [pk for pk, _, _ in page]
+    if fields:
+        by_id = {row['id']: row for row in rows.filter(pk__in=ids).values('id', *fields)}
+        if 'id' not in fields:
+            for row in by_id.values():
+                del row['id']
+    else:
+        by_id = rows.in_bulk(ids)
+    return [by_id[pk] for pk in ids if pk in by_id], next_cursor
+
+
+def _latest_seq_key(request, model, page):
+    return f'search-seq:{model._meta.label_lower}:{request.user.pk}:{request.session.session_key}:{page}'
+
+
+def typeahead(request, model, fields):
+    """
+    JSON search endpoint for search-as-you-type boxes.
+
+    The request body holds searchText and optionally limit, cursor (from
+    the previous page's next_cursor), and page and seq: an id the client
+    picks once per page load, and a number it increases with every
+    keystroke. A request whose seq is older than one already seen from the
+    same page has been superseded and is answered with 204 without
+    searching. Each page load counts from its own start, so a reload or a
+    second tab is never held back by an earlier page's numbers.
+    """
+    try:
+        body = json.loads(request.body or b'{}')
+        if not isinstance(body, dict):
+            raise ValueError('Expected a JSON object')
+        text = str(body.get('searchText') or '')
+        default = getattr(settings, 'SEARCH_PAGE_SIZE', 10)
+        limit = min(max(int(body.get('limit') or default), 1), getattr(settings, 'SEARCH_MAX_PAGE_SIZE', 50))
+        cursor = str(body.get('cursor') or '')
+        seq, page = body.get('seq'), body.get('page')
+        seq = None if seq is None or page is None else int(seq)
+        page = str(page)[:64]
+    except (ValueError, TypeError, OverflowError):
+        return JsonResponse({'error': 'Invalid search request'}, status=400)
+
+    if seq is not None:
+        key = _latest_seq_key(request, model, page)
+        if seq < cache.get(key, -1):
+            return HttpResponse(status=204)
+        cache.set(key, seq, 300)
+
+    try:
+        rows, next_cursor = search(model, request.user, text, limit, cursor, fields)
+    except (ValueError, OverflowError):
+        return JsonResponse({'error': 'Invalid search request'}, status=400)
+    if seq is not None and seq < cache.get(key, -1):
+        return HttpResponse(status=204)
+    return JsonResponse({'results': rows, 'next_cursor': next_cursor, 'seq': seq})
@@ -5,16 +5,6 @@ from django.contrib import messages
 import matplotlib
 matplotlib.use('Agg')
 
-# NLTK Data Path for production
-import nltk
-try:
-    nltk.data.find('tokenizers/punkt')
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('punkt', quiet=True)
-    nltk.download('punkt_tab', quiet=True)
-    nltk.download('stopwords', quiet=True)
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -71,7 +61,8 @@ INSTALLED_APPS = [
     'rest_framework',
     'api',
     'userprofile',
-    'report_generation'
+    'report_generation',
+    'summaries',
 ]
 
 MIDDLEWARE = [
@@ -81,6 +72,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'userpreferences.user_settings.UserSettingsMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -116,6 +108,73 @@ DATABASES = {
 }
 
 
+# Category prediction model: the training corpus and the trained artifact
+CATEGORY_DATASET_PATH = os.path.join(BASE_DIR, 'dataset.csv')
+CATEGORY_MODEL_PATH = os.path.join(BASE_DIR, 'ml_models', 'category_model.joblib')
+# Memory-map the artifact's arrays so all workers share one copy
+CATEGORY_MODEL_MMAP = True
+# Append-only log of user category corrections, learned incrementally
+CATEGORY_CORRECTIONS_PATH = os.path.join(BASE_DIR, 'dataset_corrections.csv')
+# Seconds of quiet after a correction before retraining in the background,
+# and the longest a burst of corrections can postpone it
+CATEGORY_RETRAIN_DELAY = 30
+CATEGORY_RETRAIN_MAX_DELAY = 300
+# Events waiting for the in-process worker thread; beyond this they are handled inline
+EVENT_QUEUE_SIZE = 1000
+# Largest number of descriptions accepted by the batch prediction endpoint
+CATEGORY_BATCH_MAX_SIZE = 1000
+# Number of (model version, description) predictions kept in each worker's LRU cache
+CATEGORY_PREDICTION_CACHE_SIZE = 4096
+# Per-user models: users kept in memory per worker, the history needed before
+# a user's own model is consulted, and the probability it must reach to
+# override the global prediction
+CATEGORY_PERSONAL_CACHE_SIZE = 256
+CATEGORY_PERSONAL_MIN_EXPENSES = 10
+CATEGORY_PERSONAL_MIN_PROBABILITY = 0.6
+# Admission control for CPU-heavy views: concurrent requests across all
+# workers, requests allowed to wait for a slot, and seconds they may wait
+# before getting a 503
+ADMISSION_CONTROL = {
+    'prediction': {'concurrency': 4, 'queue': 16, 'timeout': 2},
+    'forecast': {'concurrency': 2, 'queue': 4, 'timeout': 10},
+    'pdf': {'concurrency': 2, 'queue': 4, 'timeout': 10},
+    'import': {'concurrency': 2, 'queue': 2, 'timeout': 5},
+}
+# Lock files backing the admission slots, shared by the worker processes
+ADMISSION_LOCK_DIR = os.path.join(BASE_DIR, 'run', 'admission')
+# Results per page of the search-as-you-type endpoints, by default and at most
+SEARCH_PAGE_SIZE = 10
+SEARCH_MAX_PAGE_SIZE = 50
+# Statement rows categorized and written per transaction by the importer,
+# and the category given to rows when no classifier is available
+IMPORT_BATCH_SIZE = 1000
+IMPORT_FALLBACK_CATEGORY = 'other'
+# Uploaded statements waiting for the background import, and the seconds
+# without progress after which a running import is taken to have died
+IMPORT_UPLOAD_DIR = os.path.join(BASE_DIR, 'run', 'imports')
+IMPORT_STALE_AFTER = 600
+# Largest id list accepted by the bulk edit endpoints; bigger edits use a filter
+BULK_EDIT_MAX_IDS = 10000
+# Shared by the worker processes; holds the per-user dashboard data
+# (summaries/cache.py) and the typeahead request sequence numbers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'run', 'cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+# Tests use an in-memory cache, so they never touch the one above
+TEST_RUNNER = 'personalfinance.testing.TestRunner'
+# Seconds superseded per-user cache entries are kept; writes invalidate
+# entries through the user's data or settings version, not through this timeout
+DATA_CACHE_TIMEOUT = 86400
+# Currency list of the preferences form, and the file replaced on every
+# Category change to make each worker reload its categories and currencies
+CURRENCIES_PATH = os.path.join(BASE_DIR, 'currencies.json')
+REFERENCE_DATA_MARKER = os.path.join(BASE_DIR, 'run', 'reference-data.marker')
+
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -0,0 +1,69 @@
+"""
+Test helpers shared by the apps' test suites.
+"""
+import unittest
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext
+
+# Small reference tables, and SQLite's schema catalog, that are meant to be read whole
+FULL_SCAN_ALLOWED = {'expenses_category', 'django_content_type', 'sqlite_master'}
+
+
+def full_scans(sql):
+    """Tables that EXPLAIN QUERY PLAN says the query reads in full."""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        details = [row[-1] for row in cursor.fetchall()]
+    scans = []
+    for detail in details:
+        # 'SCAN t', 'SCAN t USING INDEX i' and 'SCAN t USING COVERING INDEX i'
+        # all visit every row; 'SEARCH t USING INDEX i (...)' does not.
+        # Full-text indexes and subquery results are not tables.
+        if not detail.startswith('SCAN ') or 'VIRTUAL TABLE' in detail or detail.startswith('SCAN ('):
+            continue
+        table = detail.split()[1]
+        if table not in FULL_SCAN_ALLOWED:
+            scans.append(detail)
+    return scans
+
+
+# A private cache, so that no view is answered from a cache filled elsewhere
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class QueryPlanTestCase(TestCase):
+    """Fails when a view's queries fall back to a full table scan (SQLite only)."""
+
+    @classmethod
+    def setUpClass(cls):
+        if connection.vendor != 'sqlite':
+            raise unittest.SkipTest('Query plan tests need SQLite')
+        super().setUpClass()
+
+    def assertNoFullScans(self, request, *args, **kwargs):
+        """Run request(*args, **kwargs) and check the plan of every query it made."""
+        with CaptureQueriesContext(connection) as queries:
+            response = request(*args, **kwargs)
+        self.assertLess(response.status_code, 500, f'{args} failed')
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            self.assertEqual(full_scans(sql), [], f'Full table scan in {args}:\n{sql}')
+        return response
+
+
+class TestRunner(DiscoverRunner):
+    """Runs the tests against an in-memory cache instead of the shared one in run/cache."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+        })
+        self._caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.disable()
+        super().teardown_test_environment(**kwargs)
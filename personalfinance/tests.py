@@ -0,0 +1,85 @@
+import json
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from . import admission
+from .admission import admission_control, get_limiter
+
+
+def ok(request):
+    return HttpResponse('ok')
+
+
+def fails(request):
+    raise ValueError('view failed')
+
+
+class AdmissionControlTests(SimpleTestCase):
+    def setUp(self):
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_dir)
+        # Lock files shared by the workers, and the per-process fallback
+        self.backends = {'files': lock_dir, 'threads': None}
+        self.request = RequestFactory().post('/api/predict-category/')
+
+    def limited(self, backend, concurrency=1, queue=1, timeout=0.3):
+        """Patch in a fresh 'test' endpoint class and return its limiter."""
+        patcher = mock.patch.dict(admission._limiters, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        overrides = self.settings(ADMISSION_LOCK_DIR=self.backends[backend], ADMISSION_CONTROL={
+            'test': {'concurrency': concurrency, 'queue': queue, 'timeout': timeout},
+        })
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        return get_limiter('test')
+
+    def test_full_queue_is_turned_away_at_once(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend):
+                limiter = self.limited(backend, queue=0, timeout=2.5)
+                slot = limiter.acquire()
+                started = time.monotonic()
+                response = admission_control('test')(ok)(self.request)
+                self.assertLess(time.monotonic() - started, 1)
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response['Retry-After'], '3')
+                self.assertIn('busy', json.loads(response.content)['error'])
+                html = RequestFactory().get('/forecast/', HTTP_ACCEPT='text/html')
+                self.assertEqual(admission_control('test')(ok)(html)['Content-Type'], 'text/plain')
+                limiter.release(slot)
+                self.assertEqual(admission_control('test')(ok)(self.request).status_code, 200)
+
+    def test_waits_for_a_slot_then_times_out(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend):
+                limiter = self.limited(backend)
+                slot = limiter.acquire()
+                started = time.monotonic()
+                response = admission_control('test')(ok)(self.request)
+                self.assertGreaterEqual(time.monotonic() - started, 0.3)
+                self.assertEqual((response.status_code, response['Retry-After']), (503, '1'))
+
+                # A slot freed while waiting is taken
+                threading.Timer(0.05, limiter.release, [slot]).start()
+                started = time.monotonic()
+                self.assertEqual(admission_control('test')(ok)(self.request).status_code, 200)
+                self.assertLess(time.monotonic() - started, 0.3)
+
+    def test_slot_released_when_the_view_raises(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend):
+                limiter = self.limited(backend, concurrency=2, queue=0)
+                for _ in range(3):
+                    with self.assertRaisesMessage(ValueError, 'view failed'):
+                        admission_control('test')(fails)(self.request)
+                slots = [limiter.acquire(), limiter.acquire()]
+                self.assertNotIn(None, slots)
+                for slot in slots:
+                    limiter.release(slot)
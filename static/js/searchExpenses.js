@@ -6,44 +6,76 @@ const paginationContainer = document.querySelector(".pagination-container");
 tableOutput.style.display = "none";
 const noResults = document.querySelector(".no-results");
 const tbody = document.querySelector(".table-body");
+const moreResults = document.querySelector(".more-results");
 
-searchField.addEventListener("keyup", (e) => {
-  const searchValue = e.target.value;
+const SEARCH_DELAY_MS = 250;
+let searchTimer = null;
+let searchController = null;
+let searchSeq = 0;
+// Tells this page load's requests apart from other tabs' and earlier loads'
+const searchPage = Date.now().toString(36) + Math.random().toString(36).slice(2);
+let nextCursor = null;
 
-  if (searchValue.trim().length > 0) {
-    paginationContainer.style.display = "none";
-    tbody.innerHTML = "";
-    fetch("/search-expenses", {
-      body: JSON.stringify({ searchText: searchValue }),
-      method: "POST",
-    })
-      .then((res) => res.json())
-      .then((data) => {
-        console.log("data", data);
-        appTable.style.display = "none";
+const addRow = (item) => {
+  const row = document.createElement("tr");
+  [item.amount, item.category, item.description, item.date].forEach((value) => {
+    const cell = document.createElement("td");
+    cell.textContent = value;
+    row.appendChild(cell);
+  });
+  tbody.appendChild(row);
+};
+
+const runSearch = (searchValue, cursor) => {
+  // Only the latest request matters: cancel the one in flight
+  if (searchController) searchController.abort();
+  searchController = new AbortController();
+  const seq = ++searchSeq;
+
+  fetch("/search-expenses", {
+    body: JSON.stringify({ searchText: searchValue, cursor: cursor, page: searchPage, seq: seq }),
+    method: "POST",
+    signal: searchController.signal,
+  })
+    .then((res) => (res.status === 204 ? null : res.json()))
+    .then((data) => {
+      if (!data || seq !== searchSeq) return;
+      appTable.style.display = "none";
+      paginationContainer.style.display = "none";
+      if (!cursor) tbody.innerHTML = "";
+      nextCursor = data.next_cursor;
+      moreResults.style.display = nextCursor ? "block" : "none";
+
+      if (!cursor && data.results.length === 0) {
+        noResults.style.display = "block";
+        tableOutput.style.display = "none";
+      } else {
+        noResults.style.display = "none";
         tableOutput.style.display = "block";
+        data.results.forEach(addRow);
+      }
+    })
+    .catch((err) => {
+      if (err.name !== "AbortError") console.error("Search failed", err);
+    });
+};
+
+searchField.addEventListener("input", (e) => {
+  const searchValue = e.target.value;
+  clearTimeout(searchTimer);
 
-        console.log("data.length", data.length);
-
-        if (data.length === 0) {
-          noResults.style.display = "block";
-          tableOutput.style.display = "none";
-        } else {
-          noResults.style.display = "none";
-          data.forEach((item) => {
-            tbody.innerHTML += `
-                <tr>
-                <td>${item.amount}</td>
-                <td>${item.category}</td>
-                <td>${item.description}</td>
-                <td>${item.date}</td>
-                </tr>`;
-          });
-        }
-      });
+  if (searchValue.trim().length > 0) {
+    searchTimer = setTimeout(() => runSearch(searchValue, null), SEARCH_DELAY_MS);
   } else {
+    if (searchController) searchController.abort();
+    searchSeq++;
     tableOutput.style.display = "none";
+    noResults.style.display = "none";
     appTable.style.display = "block";
     paginationContainer.style.display = "block";
   }
 });
+
+moreResults.addEventListener("click", () => {
+  if (nextCursor) runSearch(searchField.value, nextCursor);
+});
@@ -0,0 +1,82 @@
+"""
+Expense and income totals, read from the DailyRollup table.
+
+Every function here issues a single query over at most one row per day
+and category/source in the range, however many transactions those days
+hold: summarize() groups one date range by category, source or period
+with one GROUP BY, and range_totals() sums several date ranges at once
+with filtered aggregates.
+"""
+from django.db.models import F, Q, Sum
+from django.db.models.functions import TruncMonth, TruncYear
+
+from expenses.models import Expense
+from userincome.models import UserIncome
+
+from .models import DailyRollup
+
+# kind -> the model whose rows are rolled up
+KINDS = {model.rollup_kind: model for model in (Expense, UserIncome)}
+
+PERIODS = {
+    'day': lambda: F('day'),
+    'month': lambda: TruncMonth('day'),
+    'year': lambda: TruncYear('day'),
+}
+
+
+def _rollups(owner, kind, start=None, end=None):
+    try:
+        model = KINDS[kind]
+    except KeyError:
+        raise ValueError(f'Unknown kind {kind!r}, expected one of {sorted(KINDS)}')
+    rows = DailyRollup.objects.filter(owner=owner, kind=kind)
+    if start is not None:
+        rows = rows.filter(day__gte=start)
+    if end is not None:
+        rows = rows.filter(day__lte=end)
+    return rows, model.rollup_label
+
+
+def summarize(owner, kind, by, start=None, end=None):
+    """
+    Return {group: total} for the owner's expenses or incomes between start
+    and end (inclusive, either may be None).
+
+    `by` is the row label ('category' for expenses, 'source' for incomes) or
+    a period: 'day', 'month' or 'year', keyed by the period's first date.
+    """
+    rows, label = _rollups(owner, kind, start, end)
+    if by == label:
+        group = F('label')
+    elif by in PERIODS:
+        group = PERIODS[by]()
+    else:
+        raise ValueError(f'Cannot group {kind} by {by!r}')
+    totals = rows.annotate(group=group).values('group').annotate(total=Sum('total'))
+    return {row['group']: row['total'] for row in totals}
+
+
+def range_totals(owner, kind, ranges):
+    """
+    Return {name: total} for a {name: (start, end)} mapping of inclusive
+    date ranges.
+    """
+    if not ranges:
+        return {}
+    rows, _ = _rollups(owner, kind,
+                       min(start for start, _ in ranges.values()),
+                       max(end for _, end in ranges.values()))
+    # Aliases of our own, so that a name such as 'day' cannot shadow a field
+    names = list(ranges)
+    totals = rows.aggregate(**{
+        f'range_{i}': Sum('total', filter=Q(day__range=ranges[name]))
+        for i, name in enumerate(names)
+    })
+    return {name: totals[f'range_{i}'] or 0 for i, name in enumerate(names)}
+
+
+def row_count(owner, kind):
+    """Number of the owner's expenses or incomes, from the rollups."""
+    rows, _ = _rollups(owner, kind)
+    return rows.aggregate(count=Sum('count'))['count'] or 0
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class SummariesConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'summaries'
+
+    def ready(self):
+        from . import handlers  # noqa: F401
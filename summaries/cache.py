@@ -0,0 +1,92 @@
+"""
+Per-user cache of values computed from a user's financial data.
+
+Entries are keyed on the user, the name of the computation, its
+parameters and the user's data version. The version is a DataVersion
+row that handlers.py bumps in the same transaction as every write to the
+user's expenses, incomes or sources, so a write makes every older entry
+unreachable at the moment it commits: invalidation is exact, and the
+cache timeout only bounds how long superseded entries are kept.
+
+The row is created with the user. Bumps only update existing rows, so
+the writes cascading from a user's deletion, which run after the row is
+gone, do not recreate it; a user without a row is never cached.
+
+A cache hit costs one lookup of the version row and none of the
+transaction or rollup tables.
+
+The same version gives GET views computed from the user's data a strong
+ETag (conditional_on_data), so clients polling them get a 304 without
+the view running until the data changes.
+"""
+import datetime
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .models import DataVersion
+
+
+def data_version(user_id):
+    """The user's data version, or None if the user has no DataVersion row."""
+    return DataVersion.objects.filter(owner_id=user_id).values_list('version', flat=True).first()
+
+
+def bump_data_version(user_ids):
+    DataVersion.objects.filter(owner_id__in=set(user_ids)).update(version=F('version') + 1)
+
+
+def cached(user, name, params, compute):
+    """Return compute(), cached for the user under name and the list of params."""
+    version = data_version(user.pk)
+    if version is None:
+        return compute()
+    key = ':'.join(['data', str(user.pk), str(version), name, *map(str, params)])
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, getattr(settings, 'DATA_CACHE_TIMEOUT', 86400))
+    return value
+
+
+def data_etag(request, *args, **kwargs):
+    """
+    ETag of a response computed from the request user's data: it changes
+    with the data version, the path, the query parameters and the date
+    (for responses relative to today).
+    """
+    if not request.user.is_authenticated:
+        return None
+    version = data_version(request.user.pk)
+    if version is None:
+        return None
+    raw = ':'.join([str(request.user.pk), str(version), str(datetime.date.today()),
+                    request.path, repr(sorted(request.GET.lists()))])
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def conditional_on_data(view):
+    """
+    Answer GETs carrying the current data_etag in If-None-Match with 304;
+    clients may keep the response but must revalidate it every time.
+
+    Only 200 responses are tagged and kept: an error, or a 503 from an
+    admission_control() inside, must not be revalidated into a 304 later.
+    Decorated that way, a 304 is answered without taking a slot.
+    """
+    conditional = condition(etag_func=data_etag)(view)
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = conditional(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            del response['ETag']
+        return response
+    return wrapper
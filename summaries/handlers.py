@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from expenses.models import Expense
+from userincome.models import Source, UserIncome
+
+from .cache import bump_data_version
+from .models import DataVersion
+from .rollup import apply, rollups_changed
+
+
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=UserIncome)
+def rolled_up_row_deleted(sender, instance, **kwargs):
+    # Runs inside the deletion's transaction, for queryset deletes too
+    apply(sender.rollup_kind, *instance.rollup_key(), sign=-1)
+
+
+@receiver(rollups_changed)
+def rollups_changed_bump_version(sender, totals, **kwargs):
+    # Covers deletes and the bulk writes that bypass save()
+    bump_data_version(owner_id for owner_id, _, _ in totals)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=UserIncome)
+@receiver(post_save, sender=Source)
+@receiver(post_delete, sender=Source)
+def user_data_written(sender, instance, **kwargs):
+    bump_data_version([instance.owner_id])
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        DataVersion.objects.create(owner=instance)
@@ -0,0 +1,52 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.budgets import rebuild_counters, verify_counters
+from expenses.models import Expense
+from summaries.rollup import rebuild, verify
+from userincome.models import UserIncome
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the daily expense and income rollups from scratch and verify them against the rows, '
+            'then the budget counters against the rollups')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify-only', action='store_true',
+                            help='Only compare the rollups with the rows, without rebuilding')
+        parser.add_argument('--user', help='Limit to this username')
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['user']:
+            try:
+                owner = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user named {options['user']!r}")
+
+        failed = False
+        for model in (Expense, UserIncome):
+            if not options['verify_only']:
+                rebuild(model, owner)
+            mismatches = verify(model, owner)
+            for key, expected, stored in mismatches[:20]:
+                self.stderr.write(f'  {model.rollup_kind} {key}: rows {expected}, rollup {stored}')
+            if mismatches:
+                failed = True
+                self.stderr.write(self.style.ERROR(
+                    f'{len(mismatches)} {model.rollup_kind} rollups disagree with the rows'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{model.rollup_kind} rollups match the rows'))
+        if not options['verify_only']:
+            rebuild_counters(owner)
+        mismatches = verify_counters(owner)
+        for counter, expected in mismatches[:20]:
+            self.stderr.write(f'  {counter.budget} from {counter.period_start}: '
+                              f'rollups {expected}, counter {counter.spent}')
+        if mismatches:
+            failed = True
+            self.stderr.write(self.style.ERROR(f'{len(mismatches)} budget counters disagree with the rollups'))
+        else:
+            self.stdout.write(self.style.SUCCESS('budget counters match the rollups'))
+        if failed:
+            raise CommandError('Rollup verification failed')
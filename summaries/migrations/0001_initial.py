@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('expense', 'Expense'), ('income', 'Income')], max_length=10)),
+                ('day', models.DateField()),
+                ('label', models.CharField(max_length=266)),
+                ('total', models.FloatField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('owner', 'kind', 'day', 'label'), name='unique_daily_rollup')],
+            },
+        ),
+    ]
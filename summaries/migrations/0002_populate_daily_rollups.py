@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+def populate(apps, schema_editor):
+    DailyRollup = apps.get_model('summaries', 'DailyRollup')
+    sources = [
+        ('expense', apps.get_model('expenses', 'Expense'), 'category'),
+        ('income', apps.get_model('userincome', 'UserIncome'), 'source'),
+    ]
+    for kind, model, label in sources:
+        grouped = model.objects.order_by().values('owner_id', 'date', label).annotate(
+            total=Sum('amount'), count=Count('id'))
+        DailyRollup.objects.bulk_create([
+            DailyRollup(owner_id=row['owner_id'], kind=kind, day=row['date'], label=row[label],
+                        total=row['total'], count=row['count'])
+            for row in grouped
+        ], batch_size=1000)
+
+
+def clear(apps, schema_editor):
+    apps.get_model('summaries', 'DailyRollup').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summaries', '0001_initial'),
+        ('expenses', '0001_initial'),
+        ('userincome', '0003_alter_userincome_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate, clear),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def populate(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    DataVersion = apps.get_model('summaries', 'DataVersion')
+    DataVersion.objects.bulk_create([
+        DataVersion(owner_id=user_id)
+        for user_id in User.objects.filter(data_version__isnull=True).values_list('id', flat=True)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summaries', '0003_data_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('summaries', '0004_populate_data_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataversion',
+            name='history_version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from django.db import models
+
+
+class DailyRollup(models.Model):
+    """
+    Sum and count of one owner's expenses (by category) or incomes (by
+    source) on one day, kept up to date as rows are written.
+    """
+    EXPENSE = 'expense'
+    INCOME = 'income'
+    KIND_CHOICES = [(EXPENSE, 'Expense'), (INCOME, 'Income')]
+
+    owner = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    day = models.DateField()
+    # The expense category or income source
+    label = models.CharField(max_length=266)
+    total = models.FloatField(default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'kind', 'day', 'label'],
+                                    name='unique_daily_rollup'),
+        ]
+
+    def __str__(self):
+        return f'{self.owner_id} {self.kind} {self.day} {self.label}'
+
+
+class DataVersion(models.Model):
+    """
+    Counter bumped in the same transaction as every write to one owner's
+    expenses, incomes or income sources; cached results computed from that
+    data are keyed on it.
+    """
+    owner = models.OneToOneField(to=User, on_delete=models.CASCADE, related_name='data_version')
+    version = models.BigIntegerField(default=0)
+    # Bumped only when existing expenses are edited or deleted, which
+    # undoes what the per-user category models (api/personal.py) learned
+    history_version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.owner_id} v{self.version}'
@@ -0,0 +1,185 @@
+"""
+Maintenance of the DailyRollup table.
+
+Expense and UserIncome inherit RolledUp, whose save() moves the row's
+amount between rollup buckets in the same transaction as the write.
+Deletes (including queryset and cascading deletes) are handled by a
+post_delete receiver in handlers.py, which Django already runs inside the
+deletion's transaction.
+
+QuerySet.update() and bulk_create() bypass both, so code using them must
+call add_rows() itself; `manage.py rebuild_rollups` repairs any drift.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Count, F, Sum
+from django.dispatch import Signal
+
+from .models import DailyRollup
+
+# Sent with kind as the sender and the applied {(owner_id, day, label): (amount, count)} deltas
+rollups_changed = Signal()
+
+
+class RolledUp:
+    """Mixin for models whose rows are summarised in DailyRollup."""
+    rollup_kind = None
+    # Field holding the row's category or source
+    rollup_label = None
+
+    def rollup_key(self):
+        """(owner_id, day, label, amount) as it will be stored."""
+        meta = self._meta
+        return (
+            self.owner_id,
+            meta.get_field('date').to_python(self.date),
+            getattr(self, self.rollup_label),
+            meta.get_field('amount').to_python(self.amount),
+        )
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            old = None
+            if self.pk is not None:
+                old = (
+                    type(self)._base_manager
+                    .filter(pk=self.pk)
+                    .values_list('owner_id', 'date', self.rollup_label, 'amount')
+                    .first()
+                )
+            super().save(*args, **kwargs)
+            new = self.rollup_key()
+            if old != new:
+                if old is not None:
+                    apply(self.rollup_kind, *old, sign=-1)
+                apply(self.rollup_kind, *new)
+
+
+def apply(kind, owner_id, day, label, amount, sign=1):
+    """Add (sign=1) or remove (sign=-1) one row's amount from its bucket."""
+    add_totals(kind, {(owner_id, day, label): (sign * amount, sign)})
+
+
+def add_rows(kind, rows, sign=1):
+    """Add or remove many model instances, grouped by bucket."""
+    totals = defaultdict(lambda: [0.0, 0])
+    for row in rows:
+        owner_id, day, label, amount = row.rollup_key()
+        bucket = totals[owner_id, day, label]
+        bucket[0] += sign * amount
+        bucket[1] += sign
+    add_totals(kind, totals)
+
+
+def add_totals(kind, totals):
+    """Apply {(owner_id, day, label): (amount, count)} deltas."""
+    connection = connections[router.db_for_write(DailyRollup)]
+    with transaction.atomic(using=connection.alias):
+        if connection.features.supports_update_conflicts_with_target:
+            _upsert_totals(connection, kind, totals)
+        else:
+            for key, delta in totals.items():
+                _add_bucket(kind, key, delta)
+        rollups_changed.send(sender=kind, totals=totals)
+
+
+def _upsert_totals(connection, kind, totals):
+    """
+    Apply all the deltas with three batched statements: an increment-or-insert
+    for buckets gaining rows, an increment for buckets losing rows, and a
+    delete of the buckets left empty.
+    """
+    qn = connection.ops.quote_name
+    table, owner, day, label, total, count = (
+        qn(name) for name in (DailyRollup._meta.db_table, 'owner_id', 'day', 'label', 'total', 'count'))
+    kind_column = qn('kind')
+    where = f'{owner} = %s AND {kind_column} = %s AND {day} = %s AND {label} = %s'
+    gained, lost = [], []
+    for (owner_id, bucket_day, bucket_label), (amount, rows) in totals.items():
+        key = (owner_id, kind, connection.ops.adapt_datefield_value(bucket_day), bucket_label)
+        if rows > 0:
+            gained.append((*key, amount, rows))
+        else:
+            # Nothing to remove from a missing bucket (e.g. already cascade-deleted)
+            lost.append((amount, rows, *key))
+    with connection.cursor() as cursor:
+        if gained:
+            cursor.executemany(
+                f'INSERT INTO {table} ({owner}, {kind_column}, {day}, {label}, {total}, {count}) '
+                f'VALUES (%s, %s, %s, %s, %s, %s) '
+                f'ON CONFLICT ({owner}, {kind_column}, {day}, {label}) DO UPDATE SET '
+                f'{total} = {table}.{total} + excluded.{total}, {count} = {table}.{count} + excluded.{count}',
+                gained)
+        if lost:
+            cursor.executemany(
+                f'UPDATE {table} SET {total} = {total} + %s, {count} = {count} + %s WHERE {where}', lost)
+            cursor.executemany(f'DELETE FROM {table} WHERE {where} AND {count} <= 0',
+                               [key for _, _, *key in lost])
+
+
+def _add_bucket(kind, key, delta):
+    owner_id, day, label = key
+    amount, count = delta
+    bucket = DailyRollup.objects.filter(owner_id=owner_id, kind=kind, day=day, label=label)
+    # Nothing to remove from a missing bucket (e.g. already cascade-deleted)
+    if not bucket.update(total=F('total') + amount, count=F('count') + count) and count > 0:
+        try:
+            with transaction.atomic():
+                DailyRollup.objects.create(owner_id=owner_id, kind=kind, day=day,
+                                           label=label, total=amount, count=count)
+        except IntegrityError:
+            # Created concurrently since the update above
+            bucket.update(total=F('total') + amount, count=F('count') + count)
+    if count < 0:
+        bucket.filter(count__lte=0).delete()
+
+
+def expected_rollups(model, owner=None):
+    """{(owner_id, day, label): (total, count)} computed from the model's rows."""
+    rows = model._base_manager.order_by()
+    if owner is not None:
+        rows = rows.filter(owner=owner)
+    grouped = rows.values('owner_id', 'date', model.rollup_label).annotate(
+        total=Sum('amount'), count=Count('id'))
+    return {
+        (row['owner_id'], row['date'], row[model.rollup_label]): (row['total'], row['count'])
+        for row in grouped
+    }
+
+
+def stored_rollups(kind, owner=None):
+    rows = DailyRollup.objects.filter(kind=kind)
+    if owner is not None:
+        rows = rows.filter(owner=owner)
+    return {
+        (row.owner_id, row.day, row.label): (row.total, row.count)
+        for row in rows
+    }
+
+
+def rebuild(model, owner=None):
+    """Replace the model's rollups with ones recomputed from its rows."""
+    with transaction.atomic():
+        stale = DailyRollup.objects.filter(kind=model.rollup_kind)
+        if owner is not None:
+            stale = stale.filter(owner=owner)
+        stale.delete()
+        DailyRollup.objects.bulk_create([
+            DailyRollup(owner_id=owner_id, kind=model.rollup_kind, day=day, label=label,
+                        total=total, count=count)
+            for (owner_id, day, label), (total, count) in expected_rollups(model, owner).items()
+        ], batch_size=1000)
+
+
+def verify(model, owner=None, tolerance=1e-6):
+    """Return [(key, expected, stored)] for buckets that disagree with the rows."""
+    expected = expected_rollups(model, owner)
+    stored = stored_rollups(model.rollup_kind, owner)
+    mismatches = []
+    for key in expected.keys() | stored.keys():
+        want, have = expected.get(key), stored.get(key)
+        if want is None or have is None or want[1] != have[1] \
+                or abs(want[0] - have[0]) > tolerance * max(1.0, abs(want[0])):
+            mismatches.append((key, want, have))
+    return sorted(mismatches, key=str)
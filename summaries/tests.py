@@ -0,0 +1,212 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from expenses.models import Expense
+from userincome.models import Source, UserIncome
+
+from .aggregation import range_totals, summarize
+from .cache import data_version
+from .models import DailyRollup, DataVersion
+from .rollup import add_totals, rebuild, rollups_changed, stored_rollups, verify
+
+TODAY = datetime.date.today()
+YESTERDAY = TODAY - datetime.timedelta(days=1)
+
+
+class RollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+        cls.other = User.objects.create_user('bob', password='pw')
+
+    def expense(self, amount, category='food', date=TODAY, owner=None):
+        return Expense.objects.create(owner=owner or self.user, amount=amount, date=date,
+                                      description='lunch', category=category)
+
+    def assertRollups(self, expected, kind='expense'):
+        self.assertEqual(stored_rollups(kind), expected)
+        self.assertEqual(verify(Expense if kind == 'expense' else UserIncome), [])
+
+    def test_save_moves_the_amount_between_buckets(self):
+        first = self.expense(5)
+        self.expense(7)
+        self.assertRollups({(self.user.pk, TODAY, 'food'): (12, 2)})
+        first.amount = 6
+        first.save()
+        self.assertRollups({(self.user.pk, TODAY, 'food'): (13, 2)})
+        first.date = YESTERDAY
+        first.save()
+        self.assertRollups({(self.user.pk, TODAY, 'food'): (7, 1), (self.user.pk, YESTERDAY, 'food'): (6, 1)})
+        first.category = 'rent'
+        first.save()
+        self.assertRollups({(self.user.pk, TODAY, 'food'): (7, 1), (self.user.pk, YESTERDAY, 'rent'): (6, 1)})
+        first.owner = self.other
+        first.save()
+        self.assertRollups({(self.user.pk, TODAY, 'food'): (7, 1), (self.other.pk, YESTERDAY, 'rent'): (6, 1)})
+        # Saving with nothing changed leaves the rollups alone
+        with CaptureQueriesContext(connection) as queries:
+            first.save()
+        self.assertFalse([query for query in queries if 'summaries_dailyrollup' in query['sql']])
+
+    def test_income(self):
+        income = UserIncome.objects.create(owner=self.user, amount=100, date=TODAY,
+                                           description='pay', source='salary')
+        self.assertRollups({(self.user.pk, TODAY, 'salary'): (100, 1)}, 'income')
+        income.source = 'bonus'
+        income.save()
+        self.assertRollups({(self.user.pk, TODAY, 'bonus'): (100, 1)}, 'income')
+        income.delete()
+        self.assertRollups({}, 'income')
+
+    def test_deletes(self):
+        first, second = self.expense(5), self.expense(7, date=YESTERDAY)
+        self.expense(9, owner=self.other)
+        first.delete()
+        self.assertRollups({(self.user.pk, YESTERDAY, 'food'): (7, 1), (self.other.pk, TODAY, 'food'): (9, 1)})
+        self.expense(1, date=YESTERDAY)
+        Expense.objects.filter(owner=self.user).delete()
+        self.assertRollups({(self.other.pk, TODAY, 'food'): (9, 1)})
+
+    def test_add_totals(self):
+        sent = []
+
+        def receiver(sender, totals, **kwargs):
+            sent.append((sender, dict(totals)))
+
+        rollups_changed.connect(receiver)
+        self.addCleanup(rollups_changed.disconnect, receiver)
+        key, other_key = (self.user.pk, TODAY, 'food'), (self.user.pk, TODAY, 'rent')
+        for upsert in (True, False):
+            with self.subTest(upsert=upsert), mock.patch.object(
+                    connection.features, 'supports_update_conflicts_with_target', upsert):
+                sent.clear()
+                add_totals('expense', {key: (10, 2), other_key: (3, 1)})
+                add_totals('expense', {key: (4, 1)})
+                self.assertEqual(stored_rollups('expense'), {key: (14, 3), other_key: (3, 1)})
+                # Emptied buckets are deleted, and missing ones are not created by removals
+                add_totals('expense', {key: (-14, -3), (self.user.pk, YESTERDAY, 'food'): (-1, -1)})
+                self.assertEqual(stored_rollups('expense'), {other_key: (3, 1)})
+                self.assertEqual(sent[0], ('expense', {key: (10, 2), other_key: (3, 1)}))
+                self.assertEqual(len(sent), 3)
+                DailyRollup.objects.all().delete()
+
+    def test_rebuild_and_verify(self):
+        self.expense(5)
+        Expense.objects.bulk_create([
+            Expense(owner=owner, amount=2, date=YESTERDAY, description='bus', category='transport')
+            for owner in (self.user, self.other)
+        ])
+        mine, theirs = (self.user.pk, YESTERDAY, 'transport'), (self.other.pk, YESTERDAY, 'transport')
+        self.assertCountEqual(verify(Expense), [(mine, (2, 1), None), (theirs, (2, 1), None)])
+        DailyRollup.objects.filter(owner=self.user, label='food').update(total=50)
+        self.assertCountEqual(verify(Expense, self.user), [((self.user.pk, TODAY, 'food'), (5, 1), (50, 1)),
+                                                           (mine, (2, 1), None)])
+        rebuild(Expense, self.user)
+        self.assertEqual(verify(Expense, self.user), [])
+        self.assertEqual(verify(Expense), [(theirs, (2, 1), None)])
+        rebuild(Expense)
+        self.assertEqual(verify(Expense), [])
+
+    def test_rebuild_rollups_command(self):
+        self.expense(5)
+        Expense.objects.bulk_create([Expense(owner=self.user, amount=2, date=TODAY, description='bus',
+                                             category='transport')])
+        out, err = StringIO(), StringIO()
+        with self.assertRaisesMessage(CommandError, 'Rollup verification failed'):
+            call_command('rebuild_rollups', verify_only=True, stdout=out, stderr=err)
+        self.assertIn('1 expense rollups disagree with the rows', err.getvalue())
+        self.assertIn('income rollups match the rows', out.getvalue())
+        # --verify-only leaves the drift alone
+        self.assertEqual(len(verify(Expense)), 1)
+
+        call_command('rebuild_rollups', user='alice', stdout=StringIO())
+        call_command('rebuild_rollups', verify_only=True, stdout=out)
+        self.assertIn('expense rollups match the rows', out.getvalue())
+        with self.assertRaisesMessage(CommandError, "No user named 'carol'"):
+            call_command('rebuild_rollups', user='carol')
+
+
+class AggregationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+        other = User.objects.create_user('bob', password='pw')
+        for owner, scale in ((cls.user, 1), (other, 1000)):
+            for day, amount, source in (
+                ('2023-12-30', 1, 'salary'), ('2023-12-31', 10, 'salary'), ('2024-01-01', 20, 'salary'),
+                ('2024-01-01', 2, 'bonus'), ('2024-01-31', 5, 'bonus'), ('2024-02-01', 7, 'salary'),
+                ('2024-02-29', 3, 'bonus'), ('2024-12-31', 40, 'salary'), ('2025-01-01', 100, 'salary'),
+            ):
+                UserIncome.objects.create(owner=owner, amount=amount * scale, date=datetime.date.fromisoformat(day),
+                                          description='pay', source=source)
+        Expense.objects.create(owner=cls.user, amount=9, date=datetime.date(2024, 1, 1),
+                               description='lunch', category='food')
+
+    def test_summarize(self):
+        d = datetime.date.fromisoformat
+        self.assertEqual(summarize(self.user, 'income', 'day', d('2023-12-31'), d('2024-01-31')),
+                         {d('2023-12-31'): 10, d('2024-01-01'): 22, d('2024-01-31'): 5})
+        self.assertEqual(summarize(self.user, 'income', 'month', d('2023-12-31'), d('2024-02-29')),
+                         {d('2023-12-01'): 10, d('2024-01-01'): 27, d('2024-02-01'): 10})
+        self.assertEqual(summarize(self.user, 'income', 'year'),
+                         {d('2023-01-01'): 11, d('2024-01-01'): 77, d('2025-01-01'): 100})
+        self.assertEqual(summarize(self.user, 'income', 'source', end=d('2024-02-01')),
+                         {'salary': 38, 'bonus': 7})
+        self.assertEqual(summarize(self.user, 'expense', 'category'), {'food': 9})
+        self.assertEqual(summarize(self.user, 'income', 'day', d('2024-03-01'), d('2024-11-30')), {})
+        with self.assertRaises(ValueError):
+            summarize(self.user, 'income', 'category')
+        with self.assertRaises(ValueError):
+            summarize(self.user, 'transfer', 'day')
+
+    def test_range_totals(self):
+        d = datetime.date.fromisoformat
+        self.assertEqual(range_totals(self.user, 'income', {
+            'day': (d('2024-01-01'), d('2024-01-01')),
+            'across_a_year': (d('2023-12-31'), d('2024-01-01')),
+            'across_a_month': (d('2024-01-31'), d('2024-02-01')),
+            'leap_february': (d('2024-02-01'), d('2024-02-29')),
+            'year_2024': (d('2024-01-01'), d('2024-12-31')),
+            'across_both': (d('2023-12-31'), d('2025-01-01')),
+            'empty': (d('2024-03-01'), d('2024-03-31')),
+        }), {
+            'day': 22, 'across_a_year': 32, 'across_a_month': 12, 'leap_february': 10,
+            'year_2024': 77, 'across_both': 187, 'empty': 0,
+        })
+        self.assertEqual(range_totals(self.user, 'income', {}), {})
+
+
+class DataVersionTests(TransactionTestCase):
+    def test_tests_use_a_private_cache(self):
+        # The test runner keeps test entries out of the shared file cache
+        self.assertIsInstance(caches['default'], LocMemCache)
+
+    def test_bumped_by_writes(self):
+        user = User.objects.create_user('alice', password='pw')
+        self.assertEqual(data_version(user.pk), 0)
+        expense = Expense.objects.create(owner=user, amount=5, date=datetime.date.today(),
+                                         description='bus', category='transport')
+        created = data_version(user.pk)
+        self.assertGreater(created, 0)
+        expense.delete()
+        self.assertGreater(data_version(user.pk), created)
+
+    def test_delete_user_with_rows(self):
+        user = User.objects.create_user('alice', password='pw')
+        today = datetime.date.today()
+        Source.objects.create(owner=user, name='salary')
+        Expense.objects.create(owner=user, amount=5, date=today, description='bus', category='transport')
+        UserIncome.objects.create(owner=user, amount=50, date=today, description='pay', source='salary')
+        user.delete()
+        self.assertFalse(User.objects.filter(pk=user.pk).exists())
+        self.assertFalse(DataVersion.objects.exists())
+        self.assertFalse(DailyRollup.objects.exists())
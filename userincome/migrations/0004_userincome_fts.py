@@ -0,0 +1,14 @@
+from django.db import migrations
+
+from personalfinance.search import fts_migration
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userincome', '0003_alter_userincome_options'),
+    ]
+
+    operations = [
+        fts_migration('userincome_userincome', ['owner_id', 'description', 'source', 'date', 'amount']),
+    ]
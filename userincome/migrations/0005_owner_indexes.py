@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userincome', '0004_userincome_fts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userincome',
+            index=models.Index(fields=['owner', 'date'], name='income_owner_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userincome',
+            index=models.Index(fields=['owner', 'source', 'date'], name='income_owner_source_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userincome',
+            index=models.Index(fields=['owner', 'amount'], name='income_owner_amount_idx'),
+        ),
+    ]
@@ -1,11 +1,15 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils.timezone import now
+from summaries.rollup import RolledUp
 
 # Create your models here.
 
 
-class UserIncome(models.Model):
+class UserIncome(RolledUp, models.Model):
+    rollup_kind = 'income'
+    rollup_label = 'source'
+
     amount = models.FloatField()  # DECIMAL
     date = models.DateField(default=now)
     description = models.TextField()
@@ -17,6 +21,12 @@ class UserIncome(models.Model):
 
     class Meta:
         ordering = ['-date']
+        # See the matching indexes on Expense
+        indexes = [
+            models.Index(fields=['owner', 'date'], name='income_owner_date_idx'),
+            models.Index(fields=['owner', 'source', 'date'], name='income_owner_source_idx'),
+            models.Index(fields=['owner', 'amount'], name='income_owner_amount_idx'),
+        ]
 
 
 class Source(models.Model):
@@ -1,3 +1,162 @@
-from django.test import TestCase
+import datetime
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+
+from personalfinance.testing import QueryPlanTestCase
+from summaries.rollup import rebuild, verify
+
+from .models import Source, UserIncome
+
+
+class IncomeQueryPlanTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+        other = User.objects.create_user('bob', password='pw')
+        today = datetime.date.today()
+        for owner in (cls.user, other):
+            Source.objects.create(owner=owner, name='salary')
+            UserIncome.objects.bulk_create([
+                UserIncome(owner=owner, amount=100 + i, date=today - datetime.timedelta(days=i * 3),
+                           description=f'pay {i}', source='salary' if i % 2 else 'bonus')
+                for i in range(20)
+            ])
+        # bulk_create skips the rollups
+        rebuild(UserIncome)
+        cls.income = UserIncome.objects.create(owner=cls.user, amount=50, date=today,
+                                               description='gift', source='bonus')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_list_pages(self):
+        for sort in ('', 'amount_asc', 'amount_desc', 'date_asc', 'date_desc'):
+            response = self.assertNoFullScans(self.client.get, f'/income/?sort={sort}')
+            page = response.context['page_obj']
+            self.assertNoFullScans(self.client.get, f'/income/?sort={sort}&after={page.next_cursor}&page=2')
+            self.assertNoFullScans(self.client.get, f'/income/?sort={sort}&last=1')
+
+    def test_search(self):
+        response = self.assertNoFullScans(self.client.post, '/income/search-income',
+                                          json.dumps({'searchText': 'gift', 'page': 'a', 'seq': 1}),
+                                          content_type='application/json')
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.income.pk])
+
+    def test_summaries(self):
+        # alice's incomes, as setUpTestData creates them
+        today = datetime.date.today()
+        incomes = [(today - datetime.timedelta(days=i * 3), 100 + i) for i in range(20)] + [(today, 50)]
+
+        def total(start, end):
+            return sum(amount for day, amount in incomes if start <= day <= end)
+
+        response = self.assertNoFullScans(self.client.get, '/income/income-summary/')
+        self.assertEqual(
+            {name: response.context[f'{name}_income'] for name in ('daily', 'weekly', 'monthly', 'yearly')},
+            {
+                'daily': 150,
+                'weekly': 100 + 101 + 102 + 50,
+                'monthly': total(today.replace(day=1), today),
+                'yearly': total(today.replace(month=1, day=1), today),
+            })
+        monthly = [sum(amount for day, amount in incomes if day.year == today.year and day.month == month)
+                   for month in range(1, 13)]
+        response = self.assertNoFullScans(self.client.get, '/income/monthly-income-data/')
+        self.assertEqual(response.json(), {'monthly_income_data': monthly})
+        response = self.assertNoFullScans(self.client.get, '/income/get_monthly_data/')
+        self.assertEqual(response.json(), {'monthly_data': monthly})
+
+    def test_reports(self):
+        today = datetime.date.today()
+        start = (today - datetime.timedelta(days=30)).isoformat()
+        self.assertNoFullScans(self.client.post, '/income/generate-report/',
+                               {'start_date': start, 'end_date': today.isoformat()})
+        self.assertNoFullScans(self.client.get, '/income/export_pdf/',
+                               {'start_date': start, 'end_date': today.isoformat()})
+
+    def test_add_edit_and_delete(self):
+        today = datetime.date.today().isoformat()
+        self.assertNoFullScans(self.client.post, '/income/add-income', {
+            'amount': '10', 'income_date': today, 'description': 'refund', 'source': 'salary',
+        })
+        self.assertNoFullScans(self.client.post, f'/income/edit-income/{self.income.pk}', {
+            'amount': '60', 'income_date': today, 'description': 'gift', 'source': 'salary',
+        })
+        self.assertNoFullScans(self.client.get, f'/income/income-delete/{self.income.pk}')
+
+    def test_bulk_edit(self):
+        mine = UserIncome.objects.filter(owner=self.user)
+        dates = dict(mine.filter(description__startswith='pay', amount__lte=110).values_list('id', 'date'))
+        for body, changed in (
+            ({'action': 'set_source', 'source': 'wages', 'filter': {'source': 'salary', 'start_date': '2000-01-01'}}, {'updated': 10}),
+            ({'action': 'shift_date', 'days': -1, 'filter': {'description': 'pay', 'max_amount': 110}}, {'updated': 11}),
+            ({'action': 'delete', 'ids': [self.income.pk]}, {'deleted': 1}),
+        ):
+            response = self.assertNoFullScans(self.client.post, '/income/bulk-income', json.dumps(body),
+                                              content_type='application/json')
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(response.json(), changed)
+        self.assertFalse(mine.filter(source='salary'))
+        self.assertEqual(mine.filter(source='wages').count(), 10)
+        self.assertTrue(UserIncome.objects.exclude(owner=self.user).filter(source='salary'))
+        for pk, date in mine.filter(pk__in=dates).values_list('id', 'date'):
+            self.assertEqual(date, dates[pk] - datetime.timedelta(days=1))
+        self.assertFalse(mine.filter(pk=self.income.pk))
+        self.assertEqual(verify(UserIncome, self.user), [])
+
+    def test_conditional_get(self):
+        today = datetime.date.today().isoformat()
+        url = f'/income/export_csv/?start_date=2000-01-01&end_date={today}'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+        with mock.patch('userincome.views.csv.writer') as writer:
+            response = self.assertNoFullScans(self.client.get, url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.content), (304, b''))
+        writer.assert_not_called()
+
+        # Other parameters and other endpoints get their own ETags
+        other_range = self.client.get(f'/income/export_csv/?start_date=2001-01-01&end_date={today}')
+        self.assertNotEqual(other_range['ETag'], etag)
+        for endpoint in ('/income/export_xlsx/', '/income/monthly-income-data/', '/income/get_monthly_data/'):
+            with self.subTest(endpoint=endpoint):
+                first = self.client.get(endpoint, {'start_date': '2000-01-01', 'end_date': today})
+                self.assertNotEqual(first['ETag'], etag)
+                self.assertEqual(self.client.get(endpoint, {'start_date': '2000-01-01', 'end_date': today},
+                                                 HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        # Only the user's own writes change the ETag
+        UserIncome.objects.create(owner=User.objects.get(username='bob'), amount=1, date=datetime.date.today(),
+                                  description='interest', source='bank')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        UserIncome.objects.create(owner=self.user, amount=1, date=datetime.date.today(),
+                                  description='interest', source='bank')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn(f'{today},bank,1.0', response.content.decode())
+
+    def test_errors_are_not_tagged(self):
+        today = datetime.date.today().isoformat()
+        url = f'/income/export_pdf/?start_date=2000-01-01&end_date={today}'
+        limiter = mock.Mock(timeout=10)
+        limiter.acquire.return_value = None
+        with mock.patch('personalfinance.admission.get_limiter', return_value=limiter):
+            busy = self.client.get(url)
+        self.assertEqual(busy.status_code, 503)
+        self.assertFalse(busy.has_header('ETag'))
+        with mock.patch('userincome.views.pisa.pisaDocument', return_value=mock.Mock(err=1)):
+            failed = self.client.get(url)
+        self.assertEqual(failed.status_code, 400)
+        self.assertFalse(failed.has_header('ETag'))
+
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'application/pdf'))
+        # A revalidation is answered without taking a slot
+        with mock.patch('personalfinance.admission.get_limiter', return_value=limiter):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
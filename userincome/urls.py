@@ -8,6 +8,7 @@ urlpatterns = [
     path('add-income', views.add_income, name="add-income"),
     path('edit-income/<int:id>', views.income_edit, name="income-edit"),
     path('income-delete/<int:id>', views.delete_income, name="income-delete"),
+    path('bulk-income', views.bulk_income, name="bulk-income"),
     path('search-income', csrf_exempt(views.search_income),
          name="search_income"),
     path('income-summary/',views.income_summary,name="income-summary"),
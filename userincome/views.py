@@ -2,23 +2,27 @@ from django.shortcuts import render, redirect, HttpResponseRedirect
 from django.http import JsonResponse, HttpResponse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.views.decorators.http import require_POST
 from django.utils import timezone
 
 from django.db.models import Sum
-from django.db.models.functions import ExtractMonth
 
 from datetime import datetime, date, timedelta
 from io import BytesIO
+import calendar
 import csv
 import openpyxl
-import json
 
 from .models import Source, UserIncome
 from expenses.models import Expense
-from userpreferences.models import UserPreference
 from django.template.loader import get_template
 from xhtml2pdf import pisa
+from personalfinance.admission import admission_control
+from personalfinance.pagination import keyset_page
+from personalfinance.bulk import bulk_edit
+from personalfinance.search import typeahead
+from summaries.aggregation import range_totals, row_count, summarize
+from summaries.cache import cached, conditional_on_data
 
 
 # --------------------------
@@ -27,16 +31,8 @@ from xhtml2pdf import pisa
 @login_required(login_url='/authentication/login')
 def search_income(request):
     if request.method == 'POST':
-        search_str = json.loads(request.body).get('searchText', '')
-        income = (
-            UserIncome.objects.filter(owner=request.user, amount__istartswith=search_str) |
-            UserIncome.objects.filter(owner=request.user, date__istartswith=search_str) |
-            UserIncome.objects.filter(owner=request.user, description__icontains=search_str) |
-            UserIncome.objects.filter(owner=request.user, source__icontains=search_str)
-        )
-        data = income.values()
-        return JsonResponse(list(data), safe=False)
-    return JsonResponse([], safe=False)
+        return typeahead(request, UserIncome, ['id', 'amount', 'source', 'description', 'date'])
+    return JsonResponse({'results': [], 'next_cursor': None, 'seq': None})
 
 
 # --------------------------
@@ -48,29 +44,13 @@ def index(request):
     income = UserIncome.objects.filter(owner=request.user)
 
     sort_order = request.GET.get('sort')
-    if sort_order == 'amount_asc':
-        income = income.order_by('amount')
-    elif sort_order == 'amount_desc':
-        income = income.order_by('-amount')
-    elif sort_order == 'date_asc':
-        income = income.order_by('date')
-    elif sort_order == 'date_desc':
-        income = income.order_by('-date')
-
-    paginator = Paginator(income, 5)
-    page_number = request.GET.get('page')
-    page_obj = Paginator.get_page(paginator, page_number)
-
-    try:
-        currency = UserPreference.objects.get(user=request.user).currency
-    except UserPreference.DoesNotExist:
-        currency = None
+    page_obj = keyset_page(income, request.GET, 5,
+                           total=lambda: row_count(request.user, 'income'))
 
     context = {
-        'income': income,
         'page_obj': page_obj,
-        'currency': currency,
-        'total': page_obj.paginator.num_pages,
+        'currency': request.user_settings.currency,
+        'total': page_obj.num_pages,
         'sort_order': sort_order,
         'sources': sources,
     }
@@ -185,6 +165,17 @@ def delete_income(request, id):
     return redirect('income')
 
 
+def income_by_month(user, year):
+    """Twelve monthly income totals for the year, January first."""
+    def compute():
+        totals = summarize(user, 'income', 'month', date(year, 1, 1), date(year, 12, 31))
+        monthly = [0] * 12
+        for month, total in totals.items():
+            monthly[month.month - 1] = float(total or 0)
+        return monthly
+    return cached(user, 'income_by_month', [year], compute)
+
+
 # --------------------------
 # Income Summary (FIXED)
 # --------------------------
@@ -197,16 +188,18 @@ def income_summary(request):
     today = today_dt.date()
     week_start = today - timedelta(days=6)  # last 7 days including today
 
-    daily_income = user.userincome_set.filter(date=today).aggregate(Sum('amount'))['amount__sum'] or 0
-    weekly_income = user.userincome_set.filter(date__range=[week_start, today]).aggregate(Sum('amount'))['amount__sum'] or 0
-    monthly_income = user.userincome_set.filter(date__year=today.year, date__month=today.month).aggregate(Sum('amount'))['amount__sum'] or 0
-    yearly_income = user.userincome_set.filter(date__year=today.year).aggregate(Sum('amount'))['amount__sum'] or 0
+    totals = cached(user, 'income_summary', [today], lambda: range_totals(user, 'income', {
+        'daily': (today, today),
+        'weekly': (week_start, today),
+        'monthly': (today.replace(day=1), today.replace(day=calendar.monthrange(today.year, today.month)[1])),
+        'yearly': (today.replace(month=1, day=1), today.replace(month=12, day=31)),
+    }))
 
     context = {
-        'daily_income': daily_income,
-        'weekly_income': weekly_income,
-        'monthly_income': monthly_income,
-        'yearly_income': yearly_income,
+        'daily_income': totals['daily'],
+        'weekly_income': totals['weekly'],
+        'monthly_income': totals['monthly'],
+        'yearly_income': totals['yearly'],
     }
     return render(request, 'income/dashboard.html', context)
 
@@ -215,54 +208,18 @@ def income_summary(request):
 # Monthly data (JSON) — owner-scoped + aggregated
 # --------------------------
 @login_required(login_url='/authentication/login')
+@conditional_on_data
 def monthly_income_data(request):
-    current_year = datetime.now().year
-
-    # Aggregate per month for the current user
-    monthly_data_qs = (
-        UserIncome.objects
-        .filter(owner=request.user, date__year=current_year)
-        .annotate(month=ExtractMonth('date'))
-        .values('month')
-        .annotate(total_income=Sum('amount'))
-        .order_by('month')
-    )
-
-    monthly_income_data = [0] * 12
-    for item in monthly_data_qs:
-        month_index = (item['month'] or 0) - 1
-        if 0 <= month_index < 12:
-            monthly_income_data[month_index] = float(item['total_income'] or 0)
-
-    return JsonResponse({'monthly_income_data': monthly_income_data})
+    return JsonResponse({'monthly_income_data': income_by_month(request.user, datetime.now().year)})
 
 
 # --------------------------
 # Another monthly endpoint (fixed aggregation)
 # --------------------------
 @login_required(login_url='/authentication/login')
+@conditional_on_data
 def get_monthly_income(request):
-    today = date.today()
-    first_day_of_year = today.replace(month=1, day=1)
-    last_day_of_year = today.replace(month=12, day=31)
-
-    # Proper aggregation instead of overwriting
-    income_qs = (
-        UserIncome.objects
-        .filter(owner=request.user, date__range=(first_day_of_year, last_day_of_year))
-        .annotate(month=ExtractMonth('date'))
-        .values('month')
-        .annotate(total=Sum('amount'))
-        .order_by('month')
-    )
-
-    monthly_data = [0] * 12
-    for row in income_qs:
-        m = (row['month'] or 0) - 1
-        if 0 <= m < 12:
-            monthly_data[m] = float(row['total'] or 0)
-
-    return JsonResponse({'monthly_data': monthly_data})
+    return JsonResponse({'monthly_data': income_by_month(request.user, date.today().year)})
 
 
 # --------------------------
@@ -284,6 +241,8 @@ def render_to_pdf(template_path, context_dict):
 # Report / Exports (owner-scoped)
 # --------------------------
 @login_required(login_url='/authentication/login')
+@conditional_on_data
+@admission_control('pdf')
 def export_pdf(request):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
@@ -346,6 +305,7 @@ def generate_report(request):
 
 
 @login_required(login_url='/authentication/login')
+@conditional_on_data
 def export_csv(request):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
@@ -382,6 +342,7 @@ def export_csv(request):
 
 
 @login_required(login_url='/authentication/login')
+@conditional_on_data
 def export_xlsx(request):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
@@ -417,3 +378,9 @@ def export_xlsx(request):
 
     wb.save(response)
     return response
+
+
+@login_required(login_url='/authentication/login')
+@require_POST
+def bulk_income(request):
+    return bulk_edit(request, UserIncome)
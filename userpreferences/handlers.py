@@ -0,0 +1,23 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from expenses.models import Budget
+
+from .models import UserPreference
+from .user_settings import invalidate
+
+
+@receiver(post_save, sender=UserPreference)
+@receiver(post_delete, sender=UserPreference)
+def preference_changed(sender, instance, **kwargs):
+    # After commit, so no process can cache the old rows under the new token
+    transaction.on_commit(partial(invalidate, instance.user_id))
+
+
+@receiver(post_save, sender=Budget)
+@receiver(post_delete, sender=Budget)
+def budget_changed(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate, instance.owner_id))
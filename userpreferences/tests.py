@@ -1,3 +1,61 @@
-from django.test import TestCase
+import datetime
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from expenses.models import Budget
+from personalfinance.testing import QueryPlanTestCase
+
+from .user_settings import get_user_settings
+
+
+class UserSettingsTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='pw')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_preferences(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.assertNoFullScans(self.client.post, '/preferences/',
+                                              {'currency': 'EUR - Euro'})
+        self.assertContains(response, 'EUR - Euro')
+        response = self.assertNoFullScans(self.client.get, '/preferences/')
+        self.assertEqual(response.context['daily_expense_limit'], 5000)
+
+    def test_cached_until_changed(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            get_user_settings(self.user)
+        self.assertEqual(callbacks, [])
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_user_settings(self.user).currency)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/preferences/', {'currency': 'EUR - Euro'})
+            Budget.objects.create(owner=self.user, period=Budget.WEEKLY, category='food', limit=50)
+        response = self.client.get('/preferences/')
+        self.assertEqual(response.context['user_preferences'].currency, 'EUR - Euro')
+        self.assertEqual([b['budget'].period for b in response.context['budgets']], ['weekly'])
+
+    def test_reads_do_not_create_the_default_budget(self):
+        for url in ('/', '/income/', '/preferences/'):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse(Budget.objects.filter(owner=self.user))
+        user_settings = get_user_settings(self.user)
+        self.assertEqual((user_settings.daily_limit.pk, user_settings.daily_limit.limit), (None, 5000))
+
+        # The default limit still applies to new expenses
+        today = datetime.date.today().isoformat()
+        response = self.client.post('/add-expense', {
+            'amount': '6000', 'expense_date': today, 'description': 'laptop',
+            'category': 'electronics', 'initial_predicted_category': 'electronics',
+        }, follow=True)
+        self.assertIn('Your expenses for today exceed your daily expense limit',
+                      [str(message) for message in response.context['messages']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/set-daily-expense-limit/', {'daily_expense_limit': '7000'})
+        self.assertEqual(get_user_settings(self.user).daily_limit.limit, 7000)
+        self.assertEqual(Budget.objects.get(owner=self.user).limit, 7000)
@@ -0,0 +1,101 @@
+"""
+Snapshot of a user's settings: the preferred currency and the budgets.
+
+UserSettingsMiddleware exposes it as request.user_settings, loaded on
+first access, so a request reads the settings at most once whatever the
+number of views and helpers asking for them. Snapshots are kept in the
+cache between requests, keyed on a per-user version token. handlers.py
+replaces the token once a change to the user's UserPreference or
+Budget rows commits, so the next request loads the new settings. A
+reader that loaded the old rows just before the commit can only store
+them under the old token, where no one looks anymore.
+
+A cache hit costs two cache reads and no query. Loading never writes: a
+user who has not set a daily limit gets an unsaved default budget.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+# Bump when UserSettings changes, so older pickled snapshots are not read
+SNAPSHOT_FORMAT = 2
+
+
+class UserSettings:
+    def __init__(self, user_id=None, currency=None, budgets=()):
+        self.user_id = user_id
+        self.currency = currency
+        # The user's saved Budget instances, by period then category
+        self.budgets = tuple(budgets)
+
+    @property
+    def daily_limit(self):
+        """
+        The overall daily budget; unsaved, with the default limit, if the
+        user has not set one. None for anonymous users.
+        """
+        from expenses.budgets import DEFAULT_DAILY_LIMIT
+        from expenses.models import Budget
+
+        if self.user_id is None:
+            return None
+        for budget in self.budgets:
+            if budget.period == Budget.DAILY and not budget.category:
+                return budget
+        return Budget(owner_id=self.user_id, period=Budget.DAILY, category='', limit=DEFAULT_DAILY_LIMIT)
+
+    def applicable_budgets(self, category):
+        """The budgets an expense in category counts against, including the daily limit."""
+        budgets = [budget for budget in self.budgets if budget.category in ('', category)]
+        daily_limit = self.daily_limit
+        if daily_limit is not None and daily_limit.pk is None:
+            budgets.append(daily_limit)
+        return budgets
+
+
+def load(user):
+    from expenses.models import Budget
+
+    from .models import UserPreference
+
+    currency = UserPreference.objects.filter(user=user).values_list('currency', flat=True).first()
+    return UserSettings(user.pk, currency, Budget.objects.filter(owner=user).order_by('period', 'category'))
+
+
+def _version_key(user_id):
+    return f'user-settings-version:{user_id}'
+
+
+def invalidate(user_id):
+    """Make every process load the user's settings again."""
+    # A fresh token rather than a counter, so a token lost to cache
+    # culling can never come back and revive old snapshots
+    cache.set(_version_key(user_id), uuid.uuid4().hex, None)
+
+
+def get_user_settings(user):
+    if not user.is_authenticated:
+        return UserSettings()
+    version = cache.get(_version_key(user.pk))
+    if version is None:
+        cache.add(_version_key(user.pk), uuid.uuid4().hex, None)
+        version = cache.get(_version_key(user.pk))
+    key = f'user-settings:{SNAPSHOT_FORMAT}:{user.pk}:{version}'
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = load(user)
+        cache.set(key, snapshot, getattr(settings, 'DATA_CACHE_TIMEOUT', 86400))
+    return snapshot
+
+
+class UserSettingsMiddleware:
+    """Sets request.user_settings; must come after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.user_settings = SimpleLazyObject(lambda: get_user_settings(request.user))
+        return self.get_response(request)